@@ -0,0 +1,250 @@
+"""Замеры производительности редактора и экспорта на синтетических картах.
+
+    python benchmark.py --output results.json
+    python benchmark.py --sizes 100 1000 --compare results.json
+
+Каждая операция выполняется --repeat раз на картах из metromap.synthetic разного размера; в JSON
+пишется медиана и все замеры. С --compare результаты сравниваются с прошлым запуском, и если
+какая-то операция стала медленнее больше чем в --threshold раз, скрипт завершается с кодом 1.
+Перерисовка холста (redraw_map) замеряется, только если Tk может открыть окно.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+from metromap import MetroMap, calculate_metro_path, export_png, line_path, pairs, render_view
+from metromap.synthetic import generate_map
+
+BENCH_VERSION = 1
+DEFAULT_SIZES = (100, 1000, 10000, 100000)
+DEFAULT_REPEAT = 3
+REGRESSION_THRESHOLD = 1.25
+# Разница меньше этой считается шумом, сколько бы раз она ни составляла
+NOISE_SECONDS = 0.002
+HIT_TESTS = 1000
+VIEWPORT_QUERIES = 100
+EXPORT_WIDTH = 2048
+# Окно растрового вида редактора при масштабе 1
+VIEW_SIZE = (800, 600)
+
+
+def bench_generate(context):
+    generate_map(context["size"], seed=context["seed"])
+
+
+def bench_save_json(context):
+    context["map"].save(context["json_path"])
+
+
+def bench_import_json(context):
+    MetroMap.load(context["json_path"])
+
+
+def bench_save_binary(context):
+    context["map"].save_binary(context["binary_path"])
+
+
+def bench_load_binary(context):
+    MetroMap.load(context["binary_path"])
+
+
+def bench_line_paths(context):
+    metro_map = context["map"]
+    for line in metro_map.lines:
+        line_path(metro_map.line_points(line), line["smoothing"])
+
+
+def bench_calculate_metro_path(context):
+    for points in context["metro_points"]:
+        calculate_metro_path(points)
+
+
+def bench_hit_test(context):
+    metro_map = context["map"]
+    for x, y in context["points"][:HIT_TESTS]:
+        metro_map.station_at(x, y, 10)
+
+
+def bench_viewport_query(context):
+    spatial = context["map"].spatial
+    for x, y in context["points"][:VIEWPORT_QUERIES]:
+        spatial.query_rect(x, y, x + 800, y + 600)
+
+
+def bench_export_png(context):
+    # Ширина картинки постоянна, так что растёт только работа на станции и линии
+    export_png(context["map"], context["png_path"], width=EXPORT_WIDTH)
+
+
+def bench_render_view(context):
+    # Окно одного размера в середине карты: время не должно расти с числом станций
+    x, y = context["points"][0]
+    render_view(context["map"], 1.0, VIEW_SIZE[0] / 2 - x, VIEW_SIZE[1] / 2 - y, *VIEW_SIZE)
+
+
+def bench_redraw_map(context):
+    app = context["app"]
+    app.redraw_map()
+    app.root.update_idletasks()
+
+
+# Порядок важен: файлы карты пишутся раньше, чем читаются
+OPERATIONS = [
+    ("generate", bench_generate),
+    ("save_json", bench_save_json),
+    ("import_json", bench_import_json),
+    ("save_binary", bench_save_binary),
+    ("load_binary", bench_load_binary),
+    ("line_paths", bench_line_paths),
+    ("calculate_metro_path", bench_calculate_metro_path),
+    ("hit_test", bench_hit_test),
+    ("viewport_query", bench_viewport_query),
+    ("export_png", bench_export_png),
+    ("render_view", bench_render_view),
+    ("redraw_map", bench_redraw_map),
+]
+
+
+def make_editor(metro_map, autosave_dir):
+    """Окно редактора с картой, показанной целиком, или None, если Tk недоступен"""
+    try:
+        import tkinter as tk
+        root = tk.Tk()
+    except Exception:
+        return None
+    from main import MetroMapGenerator
+
+    app = MetroMapGenerator(root, autosave_dir=autosave_dir)
+    xs = [station.x for station in metro_map.stations]
+    ys = [station.y for station in metro_map.stations]
+    root.update_idletasks()
+    width = max(app.canvas.winfo_width(), int(app.canvas.cget("width")))
+    height = max(app.canvas.winfo_height(), int(app.canvas.cget("height")))
+    scale = min(width / max(max(xs) - min(xs), 1), height / max(max(ys) - min(ys), 1))
+    # Тем же путём, что и открытая пользователем карта: с историей правок и журналом автосохранения.
+    # Вид задаётся после: ползунок масштаба не опускается ниже своего минимума, а нужна вся карта
+    app.set_map(metro_map)
+    app.set_view(scale, -min(xs) * scale, -min(ys) * scale)
+    return app
+
+
+def run_benchmarks(sizes, repeat, seed, operations=None, on_result=None):
+    """Замеряет операции на картах размеров sizes; возвращает список результатов"""
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for size in sizes:
+            metro_map = generate_map(size, seed=seed)
+            rng = random.Random(seed)
+            xs = [station.x for station in metro_map.stations]
+            ys = [station.y for station in metro_map.stations]
+            context = {
+                "size": size,
+                "seed": seed,
+                "map": metro_map,
+                "json_path": os.path.join(directory, "map.json"),
+                "binary_path": os.path.join(directory, "map.mmb"),
+                "png_path": os.path.join(directory, "map.png"),
+                "metro_points": [pairs(metro_map.line_points(line)) for line in metro_map.lines
+                                 if line["smoothing"] == "metro"],
+                "points": [(rng.uniform(min(xs), max(xs)), rng.uniform(min(ys), max(ys))) for _ in range(HIT_TESTS)],
+            }
+            for name, operation in OPERATIONS:
+                if operations and name not in operations:
+                    continue
+                result = {"op": name, "stations": size, "lines": len(metro_map.lines), "runs": []}
+                if name == "redraw_map":
+                    context["app"] = context.get("app") or make_editor(metro_map, os.path.join(directory, "autosave"))
+                    if context["app"] is None:
+                        result["skipped"] = "Tk недоступен"
+                if "skipped" not in result:
+                    for _ in range(repeat):
+                        started = time.perf_counter()
+                        operation(context)
+                        result["runs"].append(time.perf_counter() - started)
+                    result["seconds"] = statistics.median(result["runs"])
+                results.append(result)
+                if on_result is not None:
+                    on_result(result)
+            if context.get("app") is not None:
+                context["app"].on_close()
+    return results
+
+
+def environment():
+    try:
+        import numpy
+        numpy_version = numpy.__version__
+    except ImportError:
+        numpy_version = None
+    return {"python": platform.python_version(), "implementation": platform.python_implementation(),
+            "platform": platform.platform(), "machine": platform.machine(), "cpus": os.cpu_count(),
+            "numpy": numpy_version}
+
+
+def compare(results, baseline, threshold=REGRESSION_THRESHOLD):
+    """Пары (результат, прошлый результат, отношение времён) для операций, замеренных в обоих запусках,
+    и список тех из них, что замедлились больше чем в threshold раз"""
+    previous = {(r["op"], r["stations"]): r for r in baseline["results"] if "seconds" in r}
+    compared = []
+    regressions = []
+    for result in results:
+        old = previous.get((result["op"], result["stations"]))
+        if old is None or "seconds" not in result:
+            continue
+        ratio = result["seconds"] / old["seconds"] if old["seconds"] > 0 else float("inf")
+        compared.append((result, old, ratio))
+        if ratio > threshold and result["seconds"] - old["seconds"] > NOISE_SECONDS:
+            regressions.append((result, old, ratio))
+    return compared, regressions
+
+
+def print_result(result):
+    if "skipped" in result:
+        print(f"{result['op']:>22} {result['stations']:>7}  пропущено: {result['skipped']}")
+    else:
+        print(f"{result['op']:>22} {result['stations']:>7} {result['seconds'] * 1000:10.1f} мс")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Замеры производительности на синтетических картах")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES), help="числа станций")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT, help="повторов каждой операции")
+    parser.add_argument("--seed", type=int, default=0, help="seed генератора карт")
+    parser.add_argument("--ops", nargs="+", default=None, choices=[name for name, _ in OPERATIONS],
+                        help="замерить только эти операции")
+    parser.add_argument("--output", default=None, help="сохранить результаты в JSON")
+    parser.add_argument("--compare", default=None, help="сравнить с результатами прошлого запуска")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD,
+                        help="во сколько раз операция может замедлиться, прежде чем это считается регрессией")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.sizes, args.repeat, args.seed, args.ops, print_result)
+    report = {"version": BENCH_VERSION, "created": time.strftime("%Y-%m-%dT%H:%M:%S"), "seed": args.seed,
+              "repeat": args.repeat, "environment": environment(), "results": results}
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        compared, regressions = compare(results, baseline, args.threshold)
+        print("\nСравнение с", args.compare)
+        for result, old, ratio in compared:
+            mark = "  <- медленнее" if (result, old, ratio) in regressions else ""
+            print(f"{result['op']:>22} {result['stations']:>7} {old['seconds'] * 1000:10.1f} -> "
+                  f"{result['seconds'] * 1000:10.1f} мс  x{ratio:.2f}{mark}")
+        if regressions:
+            print(f"Замедлились операций: {len(regressions)}", file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
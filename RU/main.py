@@ -1,26 +1,119 @@
+import os
+import queue
+import sys
+import threading
+import time
 import tkinter as tk
+from collections import deque
 from tkinter import ttk, filedialog, colorchooser, messagebox
-import json
 
-from PIL import Image, ImageDraw, ImageTk, ImageFont
-import math
+from PIL import ImageTk
+
+from metromap import (AUTOSAVE_DIR, BINARY_EXTENSION, LABELS_MIN_SCALE, PDF_EXTENSION, SVG_EXTENSION, ExportCancelled,
+                      History, Journal, MetroMap, bezier_samples, export_png, export_vector, format_frame, has_recovery,
+                      label_cache, profiler, read_network, recover, render_view, simplify_path, station_size_mult,
+                      transform_points, visible_runs)
+
+# Уровни детализации: ниже LOD_OUTLINE_SCALE подписи рисуются без обводки, ниже LABELS_MIN_SCALE - не рисуются
+LOD_OUTLINE_SCALE = 0.5
+
+# Элементы создаются для области на CULL_MARGIN размера холста шире видимой с каждой стороны;
+# пересчёт нужен, когда до её края остаётся меньше CULL_PADDING (подписи выступают за точку станции)
+CULL_MARGIN = 0.5
+CULL_PADDING = 0.15
+
+# Сколько картинок подписей держать для холста; лишние сбрасываются при полной перерисовке
+MAX_LABEL_IMAGES = 4096
+
+# Изменения копятся и применяются к холсту не чаще MAX_FPS раз в секунду
+MAX_FPS = 60
+
+# Как часто главный поток забирает сообщения фоновой операции, мс
+TASK_POLL_MS = 50
+
+# Виды холста: каждая станция и линия - свои элементы Tk или вся видимая часть карты - одна картинка
+DISPLAY_VECTOR = "vector"
+DISPLAY_RASTER = "raster"
+
+# Кольцо вокруг выбранной и перетаскиваемой станции, пикселей
+HANDLE_RADIUS = 10
+# Больше выбранных станций кольцами не отмечаются - вместо них рисуется одна рамка вокруг выбора
+MAX_HANDLE_RINGS = 200
+# Если правка затронула больше станций, холст перестраивается целиком, а не по станциям
+MAX_DIRTY_STATIONS = 2000
+
+# Бит Shift в event.state
+SHIFT_MASK = 0x0001
+
+# Как часто обновляется счётчик кадров и панель профилирования, мс
+FPS_UPDATE_MS = 500
+
+# Пункт выбора разрешения PNG, при котором картинка повторяет масштаб редактора
+EXPORT_SCREEN_DPI = "как на экране"
+
+
+def with_snapshot(metro_map):
+    """Карта и её копия для журнала автосохранения: копия большой карты снимается ещё в фоновом потоке"""
+    return metro_map, metro_map.snapshot()
+
+
+def lod_for_scale(scale):
+    if scale < LABELS_MIN_SCALE:
+        return "markers"
+    elif scale < LOD_OUTLINE_SCALE:
+        return "labels"
+    return "full"
 
 
 class MetroMapGenerator:
-    def __init__(self, root):
+    def __init__(self, root, debug=False, autosave_dir=AUTOSAVE_DIR, profile=False, trace_path=None):
         self.root = root
+        self.debug = debug
+        self.trace_path = trace_path  # куда сохранить трассу профилирования при закрытии
+        self.autosave_dir = autosave_dir
         self.root.title("Генератор карты метро")
 
         # Данные карты
-        self.lines = []
-        self.stations = []
+        self.map = MetroMap()
+        self.history = History(self.map)
+        self.journal = Journal(autosave_dir)  # автосохранение: правки дописываются в журнал в фоне
+        self.drag_serial = 0  # номер текущего перетаскивания: все его перемещения - один шаг отмены
         self.selected_line = None
-        self.selected_station = None
+        self.selection = set()  # id выбранных станций: правки применяются ко всем сразу
+        self.rubber_band = None  # (x, y, добавить к выбору) - начало рамки выбора на холсте
         self.edit_mode = "add"  # Режим: 'add' или 'edit'
         self.scale = 1.0
         self.offset_x = 0
         self.offset_y = 0
         self.drag_start = None
+        self.line_items = {}  # id линии -> элементы холста видимых участков
+        self.station_items = {}  # id станции -> элементы холста (значок и подпись)
+        self.station_layer = None
+        self.lod = lod_for_scale(self.scale)
+        self.cull_rect = None  # область карты, для которой созданы элементы холста
+        self.label_images = {}  # (текст, обводка) -> (PhotoImage, ox, oy), Tk рисует их только пока есть ссылка
+        self.display = DISPLAY_VECTOR
+        self.raster_photo = None  # картинка растрового вида и её элемент на холсте
+        self.raster_item = None
+        self.raster_size = None
+
+        # Отложенная перерисовка: обработчики событий только помечают изменения, кадр применяет их разом
+        self.drawn_view = (self.scale, self.offset_x, self.offset_y)  # вид, в котором построены элементы холста
+        self.dirty_stations = set()
+        self.dirty_lines = set()
+        self.full_redraw = False
+        self.frame_job = None
+        self.last_frame = 0.0
+        self.frame_times = deque()  # моменты кадров за последнюю секунду, для счётчика в режиме отладки
+        self.frame_duration = 0.0
+        self.profile_overlay = False  # панель с разбивкой последнего кадра поверх холста (F3)
+
+        # Долгие операции выполняются в фоновом потоке и сообщают о ходе работы через очередь
+        self.task = None
+        self.task_queue = queue.Queue()
+        self.task_cancel = threading.Event()
+        self.task_on_done = None
+        self.task_on_error = None
 
         # Основные фреймы
         self.control_frame = ttk.Frame(root, padding="10")
@@ -42,19 +135,56 @@ class MetroMapGenerator:
         self.canvas.bind("<Button-2>", self.start_drag)  # Средняя кнопка мыши
         self.canvas.bind("<B2-Motion>", self.on_drag)
         self.canvas.bind("<ButtonRelease-2>", self.end_drag)
+        self.canvas.bind("<Configure>", self.on_canvas_resize)
+        self.root.bind("<Control-z>", lambda event: self.undo())
+        self.root.bind("<Control-y>", lambda event: self.redo())
+        self.root.bind("<Control-Z>", lambda event: self.redo())
+        self.root.bind("<Escape>", lambda event: self.set_selection(set()))
+        self.root.bind("<F3>", lambda event: self.toggle_profiling())
+        self.root.bind("<F4>", lambda event: self.save_trace())
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
 
         # Элементы управления
         self.setup_controls()
 
         # Отрисовка начального состояния
         self.redraw_map()
+        if self.debug:
+            self.update_fps_label()
+        if profile:
+            self.toggle_profiling()
+        self.start_autosave()
 
     def setup_controls(self):
         # Кнопки управления
         ttk.Button(self.control_frame, text="Добавить линию", command=self.add_line).pack(fill=tk.X, pady=2)
         ttk.Button(self.control_frame, text="Экспорт PNG", command=self.export_png).pack(fill=tk.X, pady=2)
+        ttk.Button(self.control_frame, text="Экспорт SVG/PDF", command=self.export_vector).pack(fill=tk.X, pady=2)
         ttk.Button(self.control_frame, text="Экспорт JSON", command=self.export_json).pack(fill=tk.X, pady=2)
         ttk.Button(self.control_frame, text="Импорт JSON", command=self.import_json).pack(fill=tk.X, pady=2)
+        ttk.Button(self.control_frame, text="Импорт CSV/GeoJSON",
+                   command=self.import_network).pack(fill=tk.X, pady=2)
+        ttk.Button(self.control_frame, text="Отменить (Ctrl+Z)", command=self.undo).pack(fill=tk.X, pady=2)
+        ttk.Button(self.control_frame, text="Повторить (Ctrl+Y)", command=self.redo).pack(fill=tk.X, pady=2)
+
+        # Качество PNG: разрешение не зависит от масштаба на экране, если выбрано в dpi
+        ttk.Label(self.control_frame, text="Разрешение PNG:").pack(anchor=tk.W)
+        self.export_dpi_var = tk.StringVar(value=EXPORT_SCREEN_DPI)
+        ttk.Combobox(self.control_frame, textvariable=self.export_dpi_var,
+                     values=[EXPORT_SCREEN_DPI, "96", "150", "300", "600"], state="readonly",
+                     width=12).pack(anchor=tk.W)
+        ttk.Label(self.control_frame, text="Сглаживание PNG:").pack(anchor=tk.W)
+        self.export_antialias_var = tk.StringVar(value="1x")
+        ttk.Combobox(self.control_frame, textvariable=self.export_antialias_var,
+                     values=["1x", "2x", "3x", "4x"], state="readonly", width=12).pack(anchor=tk.W)
+
+        # Ход фоновой операции
+        self.progress_var = tk.DoubleVar(value=0.0)
+        ttk.Progressbar(self.control_frame, variable=self.progress_var, maximum=1.0).pack(fill=tk.X, pady=2)
+        self.status_var = tk.StringVar(value="")
+        ttk.Label(self.control_frame, textvariable=self.status_var).pack(anchor=tk.W)
+        self.cancel_button = ttk.Button(self.control_frame, text="Отмена", command=self.cancel_task, state=tk.DISABLED)
+        self.cancel_button.pack(fill=tk.X, pady=2)
 
         # Выбор режима
         self.mode_var = tk.StringVar(value="add")
@@ -88,7 +218,7 @@ class MetroMapGenerator:
 
         # Список станций
         ttk.Label(self.control_frame, text="Станции:").pack()
-        self.stations_listbox = tk.Listbox(self.control_frame, height=10)
+        self.stations_listbox = tk.Listbox(self.control_frame, height=10, selectmode=tk.EXTENDED)
         self.stations_listbox.pack(fill=tk.X)
         self.stations_listbox.bind("<<ListboxSelect>>", self.on_station_select)
 
@@ -115,6 +245,8 @@ class MetroMapGenerator:
         ttk.Button(self.control_frame, text="Применить к станции", command=self.apply_station_settings).pack(fill=tk.X,
                                                                                                              pady=2)
 
+        ttk.Button(self.control_frame, text="Перенести на линию", command=self.relink_selected).pack(fill=tk.X, pady=2)
+
         # Кнопка удаления
         ttk.Button(self.control_frame, text="Удалить выбранное", command=self.delete_selected).pack(fill=tk.X, pady=2)
 
@@ -125,62 +257,91 @@ class MetroMapGenerator:
 
         ttk.Button(self.control_frame, text="Сбросить вид", command=self.reset_view).pack(fill=tk.X, pady=2)
 
+        # Растровый вид держит на холсте постоянное число элементов, сколько бы станций ни было на карте
+        self.display_var = tk.StringVar(value=DISPLAY_VECTOR)
+        ttk.Label(self.control_frame, text="Отображение:").pack(anchor=tk.W)
+        ttk.Radiobutton(self.control_frame, text="Векторное", variable=self.display_var, value=DISPLAY_VECTOR,
+                        command=self.set_display).pack(anchor=tk.W)
+        ttk.Radiobutton(self.control_frame, text="Растровое (для больших карт)", variable=self.display_var,
+                        value=DISPLAY_RASTER, command=self.set_display).pack(anchor=tk.W)
+
         # Информация
         ttk.Label(self.control_frame, text="Инструкция:").pack()
         ttk.Label(self.control_frame, text="ЛКМ - добавить/переместить").pack(anchor=tk.W)
         ttk.Label(self.control_frame, text="ПКМ - выбрать станцию").pack(anchor=tk.W)
+        ttk.Label(self.control_frame, text="Рамка ЛКМ, Shift+ЛКМ - выбрать несколько").pack(anchor=tk.W)
         ttk.Label(self.control_frame, text="Колесо - масштаб").pack(anchor=tk.W)
         ttk.Label(self.control_frame, text="Средняя кнопка - перемещение").pack(anchor=tk.W)
 
+        if self.debug:
+            self.fps_label = ttk.Label(self.control_frame, text="")
+            self.fps_label.pack(anchor=tk.W)
+
     def set_mode(self):
         self.edit_mode = self.mode_var.get()
 
+    def set_display(self):
+        """Переключает холст между векторным и растровым видом; сцена строится заново"""
+        if self.display_var.get() == self.display:
+            return
+        self.display = self.display_var.get()
+        self.canvas.delete("all")
+        self.raster_photo = None
+        self.raster_item = None
+        self.line_items = {}
+        self.station_items = {}
+        self.invalidate_all()
+
     def add_line(self):
         color = colorchooser.askcolor(title="Выберите цвет линии")[1]
         if color:
-            line_id = len(self.lines) + 1
-            self.lines.append({
-                "id": line_id,
-                "name": f"Линия {line_id}",
-                "color": color,
-                "width": self.line_width_var.get(),
-                "smoothing": self.smoothing_var.get(),
-                "stations": []
-            })
+            with self.history.transaction("Добавление линии"):
+                self.map.add_line(color, self.line_width_var.get(), self.smoothing_var.get())
             self.update_lines_list()
-            self.selected_line = len(self.lines) - 1
+            self.selected_line = len(self.map.lines) - 1
             self.lines_listbox.selection_clear(0, tk.END)
             self.lines_listbox.selection_set(self.selected_line)
-            self.redraw_map()
+            self.invalidate_all()
 
     def change_line_color(self):
         if self.selected_line is not None:
             color = \
                 colorchooser.askcolor(title="Выберите цвет линии",
-                                      initialcolor=self.lines[self.selected_line]["color"])[1]
+                                      initialcolor=self.map.lines[self.selected_line]["color"])[1]
             if color:
-                self.lines[self.selected_line]["color"] = color
-                self.redraw_map()
+                line = self.map.lines[self.selected_line]
+                with self.history.transaction("Цвет линии"):
+                    self.map.update_line(line, color=color)
+                self.invalidate_line(line)
 
     def apply_line_settings(self):
         if self.selected_line is not None:
-            self.lines[self.selected_line]["width"] = self.line_width_var.get()
-            self.lines[self.selected_line]["smoothing"] = self.smoothing_var.get()
-            self.redraw_map()
+            with self.history.transaction("Стиль линии"):
+                self.map.set_line_style(self.map.lines[self.selected_line], self.line_width_var.get(),
+                                        self.smoothing_var.get())
+            self.invalidate_all()
 
     def apply_station_settings(self):
-        if self.selected_station is not None and self.selected_line is not None:
-            station_id = self.lines[self.selected_line]["stations"][self.selected_station]
-            station = next(s for s in self.stations if s["id"] == station_id)
-            station["style"] = self.station_style_var.get()
-
+        if len(self.selection) > 1:
+            # Стиль меняется у всего выбора одной операцией; координаты у группы не задаются
+            style = self.station_style_var.get()
+            with self.history.transaction("Изменение станций"):
+                self.map.update_stations([(self.map.get_station(station_id), {"style": style})
+                                          for station_id in self.selection])
+            self.invalidate_stations(self.selection)
+        elif self.selection:
+            station = self.map.get_station(next(iter(self.selection)))
             try:
-                station["x"] = float(self.x_var.get())
-                station["y"] = float(self.y_var.get())
-            except ValueError:
+                # x_var и y_var - DoubleVar: нечисловой текст в поле даёт TclError, а не ValueError
+                x, y = float(self.x_var.get()), float(self.y_var.get())
+            except (tk.TclError, ValueError):
                 messagebox.showerror("Ошибка", "Координаты должны быть числами")
+                return
+            with self.history.transaction("Изменение станции"):
+                self.map.update_station(station, style=self.station_style_var.get())
+                self.map.move_station(station, x, y)
 
-            self.redraw_map()
+            self.invalidate_station(station.id)
 
     def on_line_select(self, event):
         selection = self.lines_listbox.curselection()
@@ -188,112 +349,145 @@ class MetroMapGenerator:
             self.selected_line = selection[0]
             self.update_stations_list()
             # Обновляем настройки линии в интерфейсе
-            self.line_width_var.set(self.lines[self.selected_line]["width"])
-            self.smoothing_var.set(self.lines[self.selected_line]["smoothing"])
+            self.line_width_var.set(self.map.lines[self.selected_line]["width"])
+            self.smoothing_var.set(self.map.lines[self.selected_line]["smoothing"])
 
     def on_station_select(self, event):
         selection = self.stations_listbox.curselection()
         if selection and self.selected_line is not None:
-            self.selected_station = selection[0]
-            station_id = self.lines[self.selected_line]["stations"][self.selected_station]
-            station = next(s for s in self.stations if s["id"] == station_id)
+            line_stations = self.map.lines[self.selected_line]["stations"]
+            self.set_selection({line_stations[row] for row in selection})
+
+    def set_selection(self, station_ids):
+        """Меняет выбор станций; поля стиля и координат показывают станцию, если она выбрана одна"""
+        self.selection = set(station_ids)
+        if len(self.selection) == 1:
+            station = self.map.get_station(next(iter(self.selection)))
             self.station_style_var.set(station.get("style", "circle"))
-            self.x_var.set(station["x"])
-            self.y_var.set(station["y"])
+            self.x_var.set(station.x)
+            self.y_var.set(station.y)
+        if len(self.selection) > 1:
+            self.status_var.set(f"Выбрано станций: {len(self.selection)}")
+        # Кольца выбора переносятся в ближайшем кадре
+        self.schedule_redraw()
+
+    def selected_in_order(self):
+        """Выбранные станции в порядке карты"""
+        return [station for station in self.map.stations if station.id in self.selection]
+
+    def relink_selected(self):
+        """Переносит выбранные станции на выбранную линию одной операцией"""
+        if not self.selection or self.selected_line is None:
+            return
+        with self.history.transaction("Перенос станций на линию"):
+            self.map.relink_stations([station.id for station in self.selected_in_order()],
+                                     self.map.lines[self.selected_line])
+        self.update_stations_list()
+        # Меняются сразу несколько линий и размеры значков станций
+        self.invalidate_all()
 
     def delete_selected(self):
-        if self.selected_line is not None and self.selected_station is not None:
-            # Удаление станции
-            station_id = self.lines[self.selected_line]["stations"][self.selected_station]
-            station = next(s for s in self.stations if s["id"] == station_id)
-
-            # Удаляем станцию из всех линий
-            for line in self.lines:
-                if station_id in line["stations"]:
-                    line["stations"].remove(station_id)
-
-            # Удаляем саму станцию
-            self.stations = [s for s in self.stations if s["id"] != station_id]
-
-            self.selected_station = None
+        if self.selection:
+            # Выбранные станции удаляются со всех линий и из карты одной операцией
+            station_ids = set(self.selection)
+            with self.history.transaction("Удаление станций" if len(station_ids) > 1 else "Удаление станции"):
+                lines = self.map.remove_stations(station_ids)
+            for line in lines:
+                self.dirty_lines.add(line["id"])
+            self.invalidate_stations(station_ids)
+
+            self.selection = set()
             self.update_stations_list()
-            self.redraw_map()
         elif self.selected_line is not None:
-            # Удаление линии
-            # Сначала удаляем все станции этой линии
-            station_ids = self.lines[self.selected_line]["stations"]
-            self.stations = [s for s in self.stations if s["id"] not in station_ids]
-
-            # Затем удаляем саму линию
-            del self.lines[self.selected_line]
+            # Удаление линии вместе с её станциями
+            with self.history.transaction("Удаление линии"):
+                self.map.remove_line(self.selected_line)
 
             self.selected_line = None
-            self.selected_station = None
+            self.selection = set()
             self.update_lines_list()
             self.update_stations_list()
-            self.redraw_map()
+            self.invalidate_all()
 
     def update_lines_list(self):
+        # Все строки списка передаются в Tk одним вызовом
         self.lines_listbox.delete(0, tk.END)
-        for line in self.lines:
-            self.lines_listbox.insert(tk.END, line["name"])
+        self.lines_listbox.insert(tk.END, *(line["name"] for line in self.map.lines))
 
     def update_stations_list(self):
         self.stations_listbox.delete(0, tk.END)
         if self.selected_line is not None:
-            for station_id in self.lines[self.selected_line]["stations"]:
-                station = next(s for s in self.stations if s["id"] == station_id)
-                self.stations_listbox.insert(tk.END, station["name"])
+            self.stations_listbox.insert(tk.END, *(self.map.get_station(station_id)["name"]
+                                                   for station_id in self.map.lines[self.selected_line]["stations"]))
 
     def on_canvas_click(self, event):
         x, y = self.get_unscaled_coords(event.x, event.y)
 
         if self.edit_mode == "add" and self.selected_line is not None:
             # Добавление новой станции
-            station_id = len(self.stations) + 1
-            self.stations.append({
-                "id": station_id,
-                "name": f"Станция {station_id}",
-                "x": x,
-                "y": y,
-                "style": self.station_style_var.get()
-            })
-            self.lines[self.selected_line]["stations"].append(station_id)
+            line = self.map.lines[self.selected_line]
+            with self.history.transaction("Добавление станции"):
+                station = self.map.add_station(line, x, y, self.station_style_var.get())
             self.update_stations_list()
-            self.redraw_map()
+            self.invalidate_station(station.id)
         elif self.edit_mode == "edit":
-            # Проверяем, кликнули ли мы на станцию
-            for station in self.stations:
-                sx, sy = self.get_scaled_coords(station["x"], station["y"])
-                distance = math.sqrt((sx - event.x) ** 2 + (sy - event.y) ** 2)
-                if distance < 10:  # Радиус выбора
-                    self.dragged_station = station
-                    return
+            # Проверяем, кликнули ли мы на станцию (радиус выбора - 10 пикселей)
+            station = self.map.station_at(x, y, 10 / self.scale)
+            if event.state & SHIFT_MASK and station is not None:
+                # Shift+клик добавляет станцию к выбору или убирает из него
+                self.set_selection(self.selection ^ {station.id})
+            elif station is not None:
+                # Клик по выбранной станции тащит весь выбор, по другой - выбирает только её
+                if station.id not in self.selection:
+                    self.set_selection({station.id})
+                self.dragged_station = station
+                self.drag_serial += 1
+            else:
+                # По пустому месту начинается рамка выбора
+                self.rubber_band = (event.x, event.y, bool(event.state & SHIFT_MASK))
+                self.canvas.create_rectangle(event.x, event.y, event.x, event.y, outline="#1e90ff", dash=(4, 2),
+                                             tags="rubber_band")
 
     def on_canvas_drag(self, event):
-        if hasattr(self, 'dragged_station') and self.dragged_station:
+        if self.rubber_band is not None:
+            self.canvas.coords("rubber_band", self.rubber_band[0], self.rubber_band[1], event.x, event.y)
+        elif hasattr(self, 'dragged_station') and self.dragged_station:
             x, y = self.get_unscaled_coords(event.x, event.y)
-            self.dragged_station["x"] = x
-            self.dragged_station["y"] = y
+            dragged = self.dragged_station
+            if len(self.selection) > 1:
+                # Вся группа сдвигается вслед за станцией под курсором - одна операция на событие мыши
+                dx, dy = x - dragged.x, y - dragged.y
+                with self.history.transaction("Перемещение станций", merge_key=("drag", self.drag_serial)):
+                    self.map.move_stations([(station, station.x + dx, station.y + dy)
+                                            for station in map(self.map.get_station, self.selection)])
+                self.invalidate_stations(self.selection)
+                return
+            with self.history.transaction("Перемещение станции", merge_key=("drag", self.drag_serial)):
+                self.map.move_station(dragged, x, y)
+            self.invalidate_station(dragged.id)
             self.x_var.set(x)
             self.y_var.set(y)
-            self.redraw_map()
 
     def on_canvas_release(self, event):
+        if self.rubber_band is not None:
+            x0, y0, additive = self.rubber_band
+            self.rubber_band = None
+            self.canvas.delete("rubber_band")
+            (x0, y0), (x1, y1) = self.get_unscaled_coords(x0, y0), self.get_unscaled_coords(event.x, event.y)
+            found = self.map.spatial.query_rect(min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1))
+            self.set_selection(self.selection.union(found) if additive else found)
         if hasattr(self, 'dragged_station'):
             del self.dragged_station
+            self.schedule_redraw()
 
     def on_right_click(self, event):
-        x, y = event.x, event.y
-
-        # Проверяем, кликнули ли мы на станцию
-        for station in self.stations:
-            sx, sy = self.get_scaled_coords(station["x"], station["y"])
-            distance = math.sqrt((sx - x) ** 2 + (sy - y) ** 2)
-            if distance < 10:  # Радиус выбора
-                # Показываем диалог редактирования
-                self.edit_station(station)
-                return
+        x, y = self.get_unscaled_coords(event.x, event.y)
+
+        # Проверяем, кликнули ли мы на станцию (радиус выбора - 10 пикселей)
+        station = self.map.station_at(x, y, 10 / self.scale)
+        if station is not None:
+            # Показываем диалог редактирования
+            self.edit_station(station)
 
     def edit_station(self, station):
         dialog = tk.Toplevel(self.root)
@@ -314,29 +508,73 @@ class MetroMapGenerator:
         ttk.Label(dialog, text="Координата X:").grid(row=2, column=0, padx=5, pady=5)
         x_entry = ttk.Entry(dialog)
         x_entry.grid(row=2, column=1, padx=5, pady=5)
-        x_entry.insert(0, str(station["x"]))
+        x_entry.insert(0, str(station.x))
 
         ttk.Label(dialog, text="Координата Y:").grid(row=3, column=0, padx=5, pady=5)
         y_entry = ttk.Entry(dialog)
         y_entry.grid(row=3, column=1, padx=5, pady=5)
-        y_entry.insert(0, str(station["y"]))
+        y_entry.insert(0, str(station.y))
 
         def save_changes():
-            station["name"] = name_entry.get()
-            station["style"] = style_var.get()
             try:
-                station["x"] = float(x_entry.get())
-                station["y"] = float(y_entry.get())
+                x, y = float(x_entry.get()), float(y_entry.get())
             except ValueError:
                 messagebox.showerror("Ошибка", "Координаты должны быть числами")
                 return
+            with self.history.transaction("Изменение станции"):
+                self.map.update_station(station, name=name_entry.get(), style=style_var.get())
+                self.map.move_station(station, x, y)
 
             self.update_stations_list()
-            self.redraw_map()
+            self.invalidate_station(station.id)
             dialog.destroy()
 
         ttk.Button(dialog, text="Сохранить", command=save_changes).grid(row=4, column=0, columnspan=2, pady=5)
 
+    def undo(self):
+        self.apply_history(self.history.undo(), "Отменено")
+
+    def redo(self):
+        self.apply_history(self.history.redo(), "Повторено")
+
+    def apply_history(self, entry, verb):
+        """Перерисовывает то, что затронули операции отменённой или повторённой записи"""
+        if entry is None:
+            return
+        kinds = {op[0] for op in entry.ops}
+        if kinds & {"add_line", "remove_line"}:
+            self.selected_line = None
+            self.update_lines_list()
+        if kinds & {"add_line", "remove_line", "update_line"}:
+            # Цвет и толщина уже созданных элементов линии обновляются только полной перерисовкой
+            self.invalidate_all()
+        elif "set_line_stations" in kinds:
+            # Станции переходили между линиями: меняются сразу несколько линий и размеры значков
+            self.invalidate_all()
+        else:
+            station_ids = set()
+            for op in entry.ops:
+                if op[0] in ("add_station", "remove_station"):
+                    station_ids.add(op[2]["id"])
+                    self.dirty_lines.update(line_id for line_id, _ in op[3])
+                elif op[0] in ("add_stations", "remove_stations"):
+                    for _, station, memberships in op[1]:
+                        station_ids.add(station["id"])
+                        self.dirty_lines.update(line_id for line_id, _ in memberships)
+                elif op[0] in ("move_stations", "update_stations"):
+                    station_ids.update(item[0] for item in op[1])
+                else:
+                    station_ids.add(op[1])
+            self.invalidate_stations(station_ids)
+        # Удалённые или возвращённые станции не должны оставаться в выборе
+        self.selection = {station_id for station_id in self.selection if station_id in self.map.station_index}
+        self.update_stations_list()
+        self.status_var.set(f"{verb}: {entry.label}")
+
+    def on_canvas_resize(self, event):
+        # Проверка области отрисовки выполняется в каждом кадре
+        self.schedule_redraw()
+
     def start_drag(self, event):
         self.drag_start = (event.x, event.y)
 
@@ -344,10 +582,8 @@ class MetroMapGenerator:
         if self.drag_start:
             dx = event.x - self.drag_start[0]
             dy = event.y - self.drag_start[1]
-            self.offset_x += dx
-            self.offset_y += dy
             self.drag_start = (event.x, event.y)
-            self.redraw_map()
+            self.set_view(self.scale, self.offset_x + dx, self.offset_y + dy)
 
     def end_drag(self, event):
         self.drag_start = None
@@ -355,21 +591,16 @@ class MetroMapGenerator:
     def on_mouse_wheel(self, event):
         # Масштабирование колесиком мыши
         scale_factor = 1.1 if event.delta > 0 else 0.9
-        self.scale *= scale_factor
-        self.scale = max(0.025, min(6.0, self.scale))  # Ограничиваем масштаб
+        scale = max(0.025, min(6.0, self.scale * scale_factor))  # Ограничиваем масштаб
+        self.set_view(scale, self.offset_x, self.offset_y)
         self.scale_slider.set(self.scale)
-        self.redraw_map()
 
     def on_scale_change(self, value):
-        self.scale = float(value)
-        self.redraw_map()
+        self.set_view(float(value), self.offset_x, self.offset_y)
 
     def reset_view(self):
-        self.scale = 1.0
-        self.offset_x = 0
-        self.offset_y = 0
+        self.set_view(1.0, 0, 0)
         self.scale_slider.set(self.scale)
-        self.redraw_map()
 
     def get_scaled_coords(self, x, y):
         return x * self.scale + self.offset_x, y * self.scale + self.offset_y
@@ -377,355 +608,613 @@ class MetroMapGenerator:
     def get_unscaled_coords(self, x, y):
         return (x - self.offset_x) / self.scale, (y - self.offset_y) / self.scale
 
-    def calculate_metro_path(self, points):
-        """Строит путь между станциями с углами строго 45 градусов, гарантированно проходя через все точки"""
-        if len(points) < 2:
-            return points
-
-        path = [points[0]]
-
-        for i in range(1, len(points)):
-            prev_x, prev_y = path[-1]
-            curr_x, curr_y = points[i]
-
-            dx = curr_x - prev_x
-            dy = curr_y - prev_y
-
-            # Определяем основные направления движения
-            if dx == 0:  # Вертикальное движение
-                path.append((prev_x, curr_y))
-            elif dy == 0:  # Горизонтальное движение
-                path.append((curr_x, prev_y))
+    def redraw_map(self):
+        """Полностью перестраивает сцену на холсте"""
+        with profiler.frame("redraw_map", {"paths": self.map.path_cache, "labels": label_cache}):
+            self.drawn_view = (self.scale, self.offset_x, self.offset_y)
+            self.dirty_stations.clear()
+            self.dirty_lines.clear()
+            self.full_redraw = False
+            self.lod = lod_for_scale(self.scale)
+            self.cull_rect = self.viewport_rect(CULL_MARGIN)
+            if self.display == DISPLAY_RASTER:
+                self.render_raster()
             else:
-                # Движение под углом 45 градусов
-                distance = min(abs(dx), abs(dy))
-                step_x = distance if dx > 0 else -distance
-                step_y = distance if dy > 0 else -distance
-
-                # Промежуточная точка
-                mid_x = prev_x + step_x
-                mid_y = prev_y + step_y
-
-                # Проверяем, не проходим ли мы уже через целевую точку
-                if (abs(mid_x - curr_x) < 1 and abs(mid_y - curr_y) < 1):
-                    path.append((curr_x, curr_y))
-                else:
-                    path.append((mid_x, mid_y))
-
-                    # Добираемся до конечной точки
-                    if mid_x != curr_x:
-                        path.append((curr_x, mid_y))
-                    if mid_y != curr_y:
-                        path.append((curr_x, curr_y))
-
-        # Оптимизация: удаляем лишние точки на одной прямой
-        optimized_path = [path[0]]
-        for i in range(1, len(path) - 1):
-            x0, y0 = optimized_path[-1]
-            x1, y1 = path[i]
-            x2, y2 = path[i + 1]
-
-            # Если три точки лежат на одной прямой, среднюю можно удалить
-            if (x1 - x0) * (y2 - y0) != (x2 - x0) * (y1 - y0):
-                optimized_path.append((x1, y1))
+                self.rebuild_scene()
 
-        optimized_path.append(path[-1])
-        return optimized_path
-
-    def redraw_map(self):
+    def rebuild_scene(self):
         self.canvas.delete("all")
+        self.line_items = {}
+        self.station_items = {}
+        if len(self.label_images) > MAX_LABEL_IMAGES:
+            self.label_images = {}
+        # Невидимый элемент-граница: линии всегда вставляются под него, станции рисуются над ним
+        self.station_layer = self.canvas.create_line(0, 0, 0, 0, state="hidden")
 
         # Рисуем линии
-        for line in self.lines:
-            if len(line["stations"]) < 2:
-                continue
-
-            points = []
-            for station_id in line["stations"]:
-                station = next(s for s in self.stations if s["id"] == station_id)
-                points.append(self.get_scaled_coords(station["x"], station["y"]))
-
-            if line["smoothing"] == "straight":
-                self.canvas.create_line(points, fill=line["color"], width=line["width"])
-            elif line["smoothing"] == "smooth":
-                # Сглаживание с использованием кубических кривых Безье
-                smooth_points = []
-                for i in range(len(points) - 1):
-                    x1, y1 = points[i]
-                    x2, y2 = points[i + 1]
-
-                    if i == 0:  # Первая точка
-                        x0, y0 = x1, y1
-                    else:
-                        x0, y0 = points[i - 1]
-
-                    if i == len(points) - 2:  # Последняя точка
-                        x3, y3 = x2, y2
-                    else:
-                        x3, y3 = points[i + 2]
-
-                    # Контрольные точки для плавного перехода
-                    cp1x = x1 + (x2 - x0) * 0.2
-                    cp1y = y1 + (y2 - y0) * 0.2
-                    cp2x = x2 - (x3 - x1) * 0.2
-                    cp2y = y2 - (y3 - y1) * 0.2
-
-                    # Генерируем точки вдоль кривой Безье
-                    for t in [i / 10 for i in range(11)]:
-                        t2 = t * t
-                        t3 = t2 * t
-                        mt = 1 - t
-                        mt2 = mt * mt
-                        mt3 = mt2 * mt
-
-                        x = mt3 * x1 + 3 * mt2 * t * cp1x + 3 * mt * t2 * cp2x + t3 * x2
-                        y = mt3 * y1 + 3 * mt2 * t * cp1y + 3 * mt * t2 * cp2y + t3 * y2
-                        smooth_points.extend([x, y])
-
-                self.canvas.create_line(smooth_points, fill=line["color"], width=line["width"], smooth=True)
-            elif line["smoothing"] == "metro":
-                metro_path = self.calculate_metro_path(points)
-                self.canvas.create_line(metro_path, fill=line["color"], width=line["width"],
-                                        smooth=False, capstyle=tk.ROUND, joinstyle=tk.ROUND)
+        with profiler.phase("lines"):
+            for line in self.map.lines:
+                self.refresh_line(line)
 
         # Рисуем станции
-        for station in self.stations:
-            x, y = self.get_scaled_coords(station["x"], station["y"])
-            style = station.get("style", "circle")
-            line_width = 2
-            for line in self.lines:
-                if station["id"] in line["stations"]:
-                    line_width = line["width"]
-                    break
-
-            size_mult = max(1.4, line_width / 8 + 0.5)
-
-            if style == "circle":
-                self.canvas.create_oval(x - 5 * size_mult, y - 5 * size_mult, x + 5 * size_mult, y + 5 * size_mult,
-                                        fill="white", outline="black")
-            elif style == "square":
-                self.canvas.create_rectangle(x - 5 * size_mult, y - 5 * size_mult, x + 5 * size_mult, y + 5 * size_mult,
-                                             fill="white", outline="black")
-            elif style == "horizontal rect":
-                self.canvas.create_rectangle(x - 15 * size_mult, y - 5 * size_mult, x + 5 * size_mult,
-                                             y + 5 * size_mult,
-                                             fill="white", outline="black")
-            elif style == "vertical rect":
-                self.canvas.create_rectangle(x - 5 * size_mult, y - 15 * size_mult, x + 5 * size_mult,
-                                             y + 5 * size_mult,
-                                             fill="white", outline="black")
-            elif style == "triangle":
-                self.canvas.create_polygon(x, y - 6 * size_mult, x - 6 * size_mult, y + 6 * size_mult,
-                                           x + 6 * size_mult, y + 6 * size_mult, fill="white", outline="black")
-            elif style == "label":
-                # Сначала чёрный текст (как "обводка") со смещением во все стороны
-                for dx, dy in [(0, 1), (1, 0), (0, -1), (-1, 0)]:
-                    self.canvas.create_text(
-                        x + dx,
-                        y + dy,
-                        text=station["name"],
-                        anchor=tk.N,
-                        font=("Minecraftia", 10),
-                        fill="black"
-                    )
-                # Затем основной белый текст поверх
-                self.canvas.create_text(
-                    x,
-                    y,
-                    text=station["name"],
-                    anchor=tk.N,
-                    font=("Minecraftia", 10),
-                    fill="white"
-                )
-            else:  # empty
-                pass
-
-            if style != "label" and style != "empty":
-                if style == "horizontal rect":
-                    x -= int(6 * size_mult)
-                # Сначала чёрный текст (как "обводка") со смещением во все стороны
-                for dx, dy in [(0, 1), (1, 0), (0, -1), (-1, 0)]:
-                    self.canvas.create_text(
-                        x + dx,
-                        y + dy + 14 * ((size_mult - 0.4) / 2),
-                        text=station["name"],
-                        anchor=tk.N,
-                        font=("Minecraftia", 10),
-                        fill="black"
-                    )
-                # Затем основной белый текст поверх
-                self.canvas.create_text(
-                    x,
-                    y + 14 * ((size_mult - 0.4) / 2),
-                    text=station["name"],
-                    anchor=tk.N,
-                    font=("Minecraftia", 10),
-                    fill="white"
-                )
+        with profiler.phase("query"):
+            visible = sorted(self.map.spatial.query_rect(*self.cull_rect))
+        with profiler.phase("stations"):
+            for station_id in visible:
+                station = self.map.get_station(station_id)
+                self.draw_station(station, *self.get_scaled_coords(station.x, station.y))
+        profiler.count("visible_stations", len(visible))
+
+    def render_raster(self):
+        """Растровый вид: видимая часть карты рисуется Pillow, как при экспорте, и выводится одной картинкой.
+
+        Картинка того же размера переписывается на месте, а не создаётся заново, так что на холсте
+        всегда один элемент карты - плюс кольца выбора и панель профилирования.
+        """
+        width, height = self.canvas_size()
+        img = render_view(self.map, self.scale, self.offset_x, self.offset_y, width, height,
+                          labels=self.lod != "markers", outline=self.lod == "full")
+        with profiler.phase("blit"):
+            if self.raster_photo is not None and self.raster_size == img.size:
+                self.raster_photo.paste(img)
+            else:
+                self.raster_photo = ImageTk.PhotoImage(img)
+                self.raster_size = img.size
+                if self.raster_item is not None:
+                    self.canvas.itemconfigure(self.raster_item, image=self.raster_photo)
+            if self.raster_item is None:
+                self.raster_item = self.canvas.create_image(0, 0, image=self.raster_photo, anchor=tk.NW, tags="raster")
+                self.canvas.tag_lower(self.raster_item)
+
+    def raster_stale(self):
+        """Нужно ли перерисовать растровый вид: изменилась карта, вид или размер холста"""
+        view = (self.scale, self.offset_x, self.offset_y)
+        return (self.full_redraw or self.dirty_stations or self.dirty_lines or self.raster_item is None
+                or self.drawn_view != view or self.raster_size != self.canvas_size())
+
+    def handle_stations(self):
+        """Станции, вокруг которых рисуется кольцо: выбранные и перетаскиваемая"""
+        stations = [self.map.station_index[station_id] for station_id in self.selection
+                    if station_id in self.map.station_index]
+        dragged = getattr(self, "dragged_station", None)
+        if dragged is not None and dragged.id not in self.selection:
+            stations.append(dragged)
+        return stations
+
+    def draw_handles(self):
+        """Кольца выбора - живые элементы холста поверх карты в любом виде. Большой выбор отмечается
+        одной рамкой, чтобы число элементов не росло вместе с ним"""
+        self.canvas.delete("handle")
+        stations = self.handle_stations()
+        if len(stations) > MAX_HANDLE_RINGS:
+            x0, y0 = self.get_scaled_coords(min(s.x for s in stations), min(s.y for s in stations))
+            x1, y1 = self.get_scaled_coords(max(s.x for s in stations), max(s.y for s in stations))
+            self.canvas.create_rectangle(x0 - HANDLE_RADIUS, y0 - HANDLE_RADIUS, x1 + HANDLE_RADIUS,
+                                         y1 + HANDLE_RADIUS, outline="#1e90ff", width=2, tags="handle")
+            return
+        for station in stations:
+            x, y = self.get_scaled_coords(station.x, station.y)
+            self.canvas.create_oval(x - HANDLE_RADIUS, y - HANDLE_RADIUS, x + HANDLE_RADIUS, y + HANDLE_RADIUS,
+                                    outline="#1e90ff", width=2, tags="handle")
+
+    def canvas_size(self):
+        return (max(self.canvas.winfo_width(), int(self.canvas.cget("width"))),
+                max(self.canvas.winfo_height(), int(self.canvas.cget("height"))))
+
+    def viewport_rect(self, margin=0.0):
+        """Видимая часть холста в координатах карты, расширенная с каждой стороны на долю margin её размера"""
+        width, height = self.canvas_size()
+        x0, y0 = self.get_unscaled_coords(-width * margin, -height * margin)
+        x1, y1 = self.get_unscaled_coords(width * (1 + margin), height * (1 + margin))
+        return x0, y0, x1, y1
+
+    def in_cull_rect(self, station):
+        x0, y0, x1, y1 = self.cull_rect
+        return x0 <= station.x <= x1 and y0 <= station.y <= y1
+
+    def update_culling(self, force=False):
+        """Досоздаёт попавшие в область отрисовки станции и участки линий и удаляет ушедшие из неё.
+
+        Область отрисовки берётся с запасом, поэтому небольшие сдвиги вида обходятся без пересчёта.
+        """
+        if not force:
+            x0, y0, x1, y1 = self.viewport_rect(CULL_PADDING)
+            cx0, cy0, cx1, cy1 = self.cull_rect
+            if cx0 <= x0 and cy0 <= y0 and x1 <= cx1 and y1 <= cy1:
+                return
 
-    def export_png(self):
-        file_path = filedialog.asksaveasfilename(defaultextension=".png", filetypes=[("PNG files", "*.png")])
+        self.cull_rect = self.viewport_rect(CULL_MARGIN)
+        with profiler.phase("query"):
+            visible = set(self.map.spatial.query_rect(*self.cull_rect))
+        with profiler.phase("stations"):
+            for station_id in [s for s in self.station_items if s not in visible]:
+                for item in self.station_items.pop(station_id):
+                    self.canvas.delete(item)
+            for station_id in sorted(visible.difference(self.station_items)):
+                station = self.map.get_station(station_id)
+                self.draw_station(station, *self.get_scaled_coords(station.x, station.y))
+
+        with profiler.phase("lines"):
+            for line in self.map.lines:
+                self.refresh_line(line)
+
+    def line_runs(self, line):
+        """Экранные координаты видимых участков линии с учётом сглаживания"""
+        if len(line["stations"]) < 2:
+            return []
+
+        # Линия целиком вне области отрисовки отбрасывается по границам, без пути из кэша
+        x0, y0, x1, y1 = self.cull_rect
+        lx0, ly0, lx1, ly1 = self.map.line_extent(line, bezier_samples(self.scale))
+        if lx1 < x0 or lx0 > x1 or ly1 < y0 or ly0 > y1:
+            return []
+        path = self.map.line_path(line, bezier_samples(self.scale))
+        runs = visible_runs(path, *self.cull_rect)
+        # Точки, сливающиеся в один пиксель, на экране не видны
+        return [simplify_path(transform_points(run, self.scale, self.offset_x, self.offset_y), 1.0) for run in runs]
+
+    def line_options(self, line):
+        if line["smoothing"] == "smooth":
+            return {"smooth": True}
+        elif line["smoothing"] == "metro":
+            return {"smooth": False, "capstyle": tk.ROUND, "joinstyle": tk.ROUND}
+        return {}
+
+    def refresh_line(self, line):
+        """Обновляет видимые участки линии, по возможности меняя координаты и цвет уже созданных элементов"""
+        with profiler.phase("line_paths"):
+            runs = self.line_runs(line)
+        items = self.line_items.get(line["id"], [])
+        for item, coords in zip(items, runs):
+            self.canvas.coords(item, coords)
+            self.canvas.itemconfigure(item, fill=line["color"])
+        for item in items[len(runs):]:
+            self.canvas.delete(item)
+        items = items[:len(runs)]
+        profiler.count("canvas_items", len(runs) - len(items))
+        for coords in runs[len(items):]:
+            item = self.canvas.create_line(coords, fill=line["color"], width=line["width"],
+                                           tags=("line", f"line_{line['id']}"), **self.line_options(line))
+            self.canvas.tag_lower(item, self.station_layer)
+            items.append(item)
+
+        if items:
+            self.line_items[line["id"]] = items
+        else:
+            self.line_items.pop(line["id"], None)
+
+    def draw_station(self, station, x, y):
+        """Рисует значок и подпись станции в экранной точке (x, y) с учётом уровня детализации"""
+        style = station.get("style", "circle")
+        size_mult = station_size_mult(self.map.station_line_width(station.id))
+        tags = ("station", f"station_{station.id}")
+        items = []
+
+        if style == "circle":
+            items.append(self.canvas.create_oval(x - 5 * size_mult, y - 5 * size_mult, x + 5 * size_mult,
+                                                 y + 5 * size_mult, fill="white", outline="black", tags=tags))
+        elif style == "square":
+            items.append(self.canvas.create_rectangle(x - 5 * size_mult, y - 5 * size_mult, x + 5 * size_mult,
+                                                      y + 5 * size_mult, fill="white", outline="black", tags=tags))
+        elif style == "horizontal rect":
+            items.append(self.canvas.create_rectangle(x - 15 * size_mult, y - 5 * size_mult, x + 5 * size_mult,
+                                                      y + 5 * size_mult, fill="white", outline="black", tags=tags))
+        elif style == "vertical rect":
+            items.append(self.canvas.create_rectangle(x - 5 * size_mult, y - 15 * size_mult, x + 5 * size_mult,
+                                                      y + 5 * size_mult, fill="white", outline="black", tags=tags))
+        elif style == "triangle":
+            items.append(self.canvas.create_polygon(x, y - 6 * size_mult, x - 6 * size_mult, y + 6 * size_mult,
+                                                    x + 6 * size_mult, y + 6 * size_mult, fill="white",
+                                                    outline="black", tags=tags))
+        elif style == "label":
+            items.extend(self.draw_label(station["name"], x, y, tags))
+        else:  # empty
+            pass
+
+        if style != "label" and style != "empty":
+            if style == "horizontal rect":
+                x -= int(6 * size_mult)
+            items.extend(self.draw_label(station["name"], x, y + 14 * ((size_mult - 0.4) / 2), tags))
+
+        self.station_items[station.id] = items
+        if profiler.enabled:
+            profiler.count("canvas_items", len(items))
+
+    def draw_label(self, text, x, y, tags):
+        """Подпись станции: белый текст с чёрной обводкой, при отдалении - без обводки или вовсе без подписи.
+
+        Подпись - одна готовая картинка из общего кэша, а не пять текстовых элементов холста.
+        """
+        if self.lod == "markers":
+            return []
+        image, ox, oy = self.label_image(text, self.lod == "full")
+        return [self.canvas.create_image(x - ox, y - oy, image=image, anchor=tk.NW, tags=tags)]
+
+    def label_image(self, text, outline):
+        key = (text, outline)
+        entry = self.label_images.get(key)
+        if entry is None:
+            with profiler.phase("label_images"):
+                sprite, ox, oy = label_cache.get(text, outline=outline)
+                entry = self.label_images[key] = (ImageTk.PhotoImage(sprite), ox, oy)
+            profiler.count("label_images")
+        return entry
+
+    def schedule_redraw(self):
+        """Планирует один кадр на все накопившиеся изменения, не чаще MAX_FPS раз в секунду"""
+        if self.frame_job is not None:
+            return
+        delay = self.last_frame + 1 / MAX_FPS - time.perf_counter()
+        if delay > 0:
+            self.frame_job = self.root.after(int(delay * 1000) + 1, self.render_frame)
+        else:
+            # Кадр выполнится, когда Tk разберёт уже пришедшие события
+            self.frame_job = self.root.after_idle(self.render_frame)
+
+    def invalidate_station(self, station_id):
+        """Помечает станцию и проходящие через неё линии для перерисовки в ближайшем кадре"""
+        self.dirty_stations.add(station_id)
+        for line in self.map.station_lines.get(station_id, ()):
+            self.dirty_lines.add(line["id"])
+        self.schedule_redraw()
+
+    def invalidate_stations(self, station_ids):
+        """Помечает для перерисовки сразу много станций; при большой правке холст перестраивается целиком"""
+        if len(station_ids) > MAX_DIRTY_STATIONS:
+            self.invalidate_all()
+            return
+        for station_id in station_ids:
+            self.dirty_stations.add(station_id)
+            for line in self.map.station_lines.get(station_id, ()):
+                self.dirty_lines.add(line["id"])
+        self.schedule_redraw()
+
+    def invalidate_line(self, line):
+        self.dirty_lines.add(line["id"])
+        self.schedule_redraw()
+
+    def invalidate_all(self):
+        self.full_redraw = True
+        self.schedule_redraw()
+
+    def render_frame(self):
+        """Применяет к холсту все изменения, накопившиеся с прошлого кадра"""
+        self.frame_job = None
+        started = time.perf_counter()
+
+        with profiler.frame("frame", {"paths": self.map.path_cache, "labels": label_cache}):
+            if self.display == DISPLAY_RASTER:
+                # Растровый вид перерисовывается целиком: его стоимость зависит от размера окна, а не карты
+                if self.raster_stale():
+                    self.redraw_map()
+            elif self.full_redraw:
+                self.redraw_map()
+            else:
+                self.apply_view()
+                self.redraw_dirty()
+            self.draw_handles()
+
+        self.last_frame = time.perf_counter()
+        if self.debug or self.profile_overlay:
+            self.frame_times.append(started)
+            self.frame_duration = self.last_frame - started
+        if self.profile_overlay:
+            self.draw_profile_overlay()
+
+    def redraw_dirty(self):
+        """Пересоздаёт элементы изменённых станций и обновляет изменённые линии"""
+        with profiler.phase("dirty_stations"):
+            for station_id in self.dirty_stations:
+                for item in self.station_items.pop(station_id, ()):
+                    self.canvas.delete(item)
+                station = self.map.station_index.get(station_id)
+                if station is not None and self.in_cull_rect(station):
+                    self.draw_station(station, *self.get_scaled_coords(station.x, station.y))
+        profiler.count("redrawn_stations", len(self.dirty_stations))
+        self.dirty_stations.clear()
+
+        with profiler.phase("dirty_lines"):
+            for line in self.map.lines:
+                if line["id"] in self.dirty_lines:
+                    self.refresh_line(line)
+        self.dirty_lines.clear()
+
+    def frames_per_second(self):
+        """Сколько кадров отрисовано за последнюю секунду"""
+        now = time.perf_counter()
+        while self.frame_times and self.frame_times[0] < now - 1.0:
+            self.frame_times.popleft()
+        return len(self.frame_times)
+
+    def update_fps_label(self):
+        """Счётчик кадров в режиме отладки: сколько кадров отрисовано за последнюю секунду и время последнего"""
+        self.fps_label.configure(text=f"Кадров/с: {self.frames_per_second()} ({self.frame_duration * 1000:.1f} мс)")
+        self.root.after(FPS_UPDATE_MS, self.update_fps_label)
+
+    def toggle_profiling(self):
+        """Включает замеры отрисовки вместе с панелью разбивки кадра на холсте или выключает их (F3)"""
+        self.profile_overlay = not self.profile_overlay
+        profiler.enable(self.profile_overlay)
+        if self.profile_overlay:
+            self.draw_profile_overlay()
+            self.root.after(FPS_UPDATE_MS, self.update_profile_overlay)
+        else:
+            self.canvas.delete("profile_overlay")
+
+    def update_profile_overlay(self):
+        # Счётчик кадров должен падать и тогда, когда кадров нет
+        if self.profile_overlay:
+            self.draw_profile_overlay()
+            self.root.after(FPS_UPDATE_MS, self.update_profile_overlay)
+
+    def draw_profile_overlay(self):
+        """Панель в левом верхнем углу холста: кадры в секунду и разбивка последнего кадра по фазам"""
+        self.canvas.delete("profile_overlay")
+        text = f"Кадров/с: {self.frames_per_second()}  (F4 - сохранить трассу)"
+        frame = profiler.last_frame("frame") or profiler.last_frame("redraw_map")
+        if frame is not None:
+            text += "\n" + format_frame(frame)
+        item = self.canvas.create_text(8, 8, text=text, anchor=tk.NW, font=("TkFixedFont", 9), fill="black",
+                                       tags="profile_overlay")
+        x0, y0, x1, y1 = self.canvas.bbox(item)
+        background = self.canvas.create_rectangle(x0 - 4, y0 - 4, x1 + 4, y1 + 4, fill="white", outline="gray",
+                                                  tags="profile_overlay")
+        self.canvas.tag_raise(background)
+        self.canvas.tag_raise(item)
+
+    def save_trace(self):
+        """Сохраняет накопленные замеры в формате Chrome Trace Event (F4)"""
+        if not profiler.events:
+            messagebox.showinfo("Профилирование", "Замеров нет: включите профилирование клавишей F3")
+            return
+        file_path = filedialog.asksaveasfilename(defaultextension=".json", filetypes=[("Трасса Chrome", "*.json")])
         if file_path:
-            # Создаем изображение с учетом масштаба
-            padding = 40
-            size = 1 / self.scale
-
-            all_points = [(s["x"], s["y"]) for s in self.stations]
-            if not all_points:
-                messagebox.showerror("Ошибка", "Нет станций для экспорта")
+            try:
+                profiler.export_trace(file_path)
+            except OSError as e:
+                messagebox.showerror("Ошибка", f"Не удалось сохранить трассу: {str(e)}")
                 return
-
-            min_x = min(p[0] // size for p in all_points) - padding
-            max_x = max(p[0] // size for p in all_points) + padding
-            min_y = min(p[1] // size for p in all_points) - padding
-            max_y = max(p[1] // size for p in all_points) + padding
-
-            width = int(max_x - min_x)
-            height = int(max_y - min_y)
-
-            img = Image.new("RGB", (width, height), "white")
-            draw = ImageDraw.Draw(img)
-
-            # Рисуем линии
-            for line in self.lines:
-                if len(line["stations"]) < 2:
+            self.status_var.set(f"Трасса сохранена: {os.path.basename(file_path)}")
+
+    def set_view(self, scale, offset_x, offset_y):
+        """Меняет масштаб и смещение вида; холст догонит его в ближайшем кадре"""
+        self.scale = scale
+        self.offset_x = offset_x
+        self.offset_y = offset_y
+        self.schedule_redraw()
+
+    def apply_view(self):
+        """Переводит элементы холста из вида, в котором они построены, в текущий вместо полной перерисовки"""
+        drawn_scale, drawn_x, drawn_y = self.drawn_view
+        scale, offset_x, offset_y = self.scale, self.offset_x, self.offset_y
+        if (scale, offset_x, offset_y) == self.drawn_view:
+            self.update_culling()
+            return
+        self.drawn_view = (scale, offset_x, offset_y)
+
+        if scale == drawn_scale:
+            # Панорамирование - один сдвиг всех элементов
+            with profiler.phase("move"):
+                self.canvas.move("all", offset_x - drawn_x, offset_y - drawn_y)
+            self.update_culling()
+            return
+
+        if lod_for_scale(scale) != self.lod:
+            # Сменился уровень детализации - меняется и набор элементов станций
+            self.redraw_map()
+            return
+
+        # Значки и подписи станций не меняют размер при масштабировании, поэтому их достаточно сдвинуть
+        scale_delta = scale - drawn_scale
+        with profiler.phase("move"):
+            for station_id, items in self.station_items.items():
+                station = self.map.station_index.get(station_id)
+                if station is None:
                     continue
+                dx = station.x * scale_delta + offset_x - drawn_x
+                dy = station.y * scale_delta + offset_y - drawn_y
+                for item in items:
+                    self.canvas.move(item, dx, dy)
 
-                points = []
-                for station_id in line["stations"]:
-                    station = next(s for s in self.stations if s["id"] == station_id)
-                    points.append((station["x"] // size - min_x, station["y"] // size - min_y))
-
-                if line["smoothing"] == "straight":
-                    draw.line(points, fill=line["color"], width=line["width"], joint="curve")
-                elif line["smoothing"] == "smooth":
-                    smooth_points = []
-                    for i in range(len(points) - 1):
-                        x1, y1 = points[i]
-                        x2, y2 = points[i + 1]
-
-                        if i == 0:  # Первая точка
-                            x0, y0 = x1, y1
-                        else:
-                            x0, y0 = points[i - 1]
-
-                        if i == len(points) - 2:  # Последняя точка
-                            x3, y3 = x2, y2
-                        else:
-                            x3, y3 = points[i + 2]
-
-                        cp1x = x1 + (x2 - x0) * 0.2
-                        cp1y = y1 + (y2 - y0) * 0.2
-                        cp2x = x2 - (x3 - x1) * 0.2
-                        cp2y = y2 - (y3 - y1) * 0.2
-
-                        for t in [i / 10 for i in range(11)]:
-                            t2 = t * t
-                            t3 = t2 * t
-                            mt = 1 - t
-                            mt2 = mt * mt
-                            mt3 = mt2 * mt
-
-                            x = mt3 * x1 + 3 * mt2 * t * cp1x + 3 * mt * t2 * cp2x + t3 * x2
-                            y = mt3 * y1 + 3 * mt2 * t * cp1y + 3 * mt * t2 * cp2y + t3 * y2
-                            smooth_points.append((x, y))
-
-                    draw.line(smooth_points, fill=line["color"], width=line["width"])
-                elif line["smoothing"] == "metro":
-                    metro_path = self.calculate_metro_path(points)
-                    draw.line(metro_path, fill=line["color"], width=line["width"], joint="curve")
-
-            # Рисуем станции
-            font = ImageFont.truetype(r"assets/Minecraft.ttf", 10)
-            for station in self.stations:
-                x, y = station["x"] // size - min_x, station["y"] // size - min_y
-                style = station.get("style", "circle")
-
-                line_width = 2
-                for line in self.lines:
-                    if station["id"] in line["stations"]:
-                        line_width = line["width"]
-                        break
-
-                size_mult = max(1.4, line_width / 8 + 0.5)
-
-                if style == "circle":
-                    draw.ellipse([x - 5 * size_mult, y - 5 * size_mult, x + 5 * size_mult, y + 5 * size_mult],
-                                 fill="white", outline="black")
-                elif style == "square":
-                    draw.rectangle([x - 5 * size_mult, y - 5 * size_mult, x + 5 * size_mult, y + 5 * size_mult],
-                                   fill="white", outline="black")
-                elif style == "horizontal rect":
-                    draw.rectangle([x - 15 * size_mult, y - 5 * size_mult, x + 5 * size_mult, y + 5 * size_mult],
-                                   fill="white", outline="black")
-                elif style == "vertical rect":
-                    draw.rectangle([x - 5 * size_mult, y - 15 * size_mult, x + 5 * size_mult, y + 5 * size_mult],
-                                   fill="white", outline="black")
-                elif style == "triangle":
-                    draw.polygon([x, y - 6 * size_mult, x - 6 * size_mult, y + 6 * size_mult, x + 6 * size_mult,
-                                  y + 6 * size_mult], fill="white", outline="black")
-                elif style == "label":
-                    for dx, dy in [(0, -1), (0, 1), (-1, 0), (1, 0)]:
-                        draw.text((x + dx, y + dy),
-                                  station["name"], fill="black", anchor="ma", font=font)
-                    # Затем основной чёрный текст
-                    draw.text((x, y),
-                              station["name"], fill="white", anchor="ma", font=font)
-                else:  # empty
-                    pass
-
-                if style != "label" and style != "empty":
-                    if style == "horizontal rect":
-                        x -= int(6 * size_mult)
-                    for dx, dy in [(0, -1), (0, 1), (-1, 0), (1, 0)]:
-                        draw.text((x + dx, y + 14 * ((size_mult - 0.4) / 2) + dy),
-                                  station["name"], fill="black", anchor="ma", font=font)
-                    # Затем основной чёрный текст
-                    draw.text((x, y + 14 * ((size_mult - 0.4) / 2)),
-                              station["name"], fill="white", anchor="ma", font=font)
-
-            img.save(file_path)
+        self.update_culling(force=True)
+
+    def export_png(self):
+        file_path = filedialog.asksaveasfilename(defaultextension=".png", filetypes=[("PNG files", "*.png")])
+        if file_path:
+            # Без выбранного dpi масштаб картинки берётся из текущего масштаба редактора. Рисуется копия карты
+            # в фоновом потоке, так что редактировать карту можно, не дожидаясь окончания экспорта
+            data = self.map.snapshot()
+            if self.export_dpi_var.get() == EXPORT_SCREEN_DPI:
+                scale, dpi = self.scale, None
+            else:
+                scale, dpi = None, int(self.export_dpi_var.get())
+            antialias = int(self.export_antialias_var.get().rstrip("x"))
+            self.run_task(f"Экспорт {os.path.basename(file_path)}",
+                          lambda progress, cancelled: export_png(MetroMap.from_dict(data), file_path, scale,
+                                                                 on_progress=progress, cancelled=cancelled, dpi=dpi,
+                                                                 antialias=antialias),
+                          lambda result: self.status_var.set(f"Сохранено: {os.path.basename(file_path)}"),
+                          self.on_export_error,
+                          cancellable=True)
+
+    def export_vector(self):
+        file_path = filedialog.asksaveasfilename(defaultextension=SVG_EXTENSION,
+                                                 filetypes=[("SVG files", "*" + SVG_EXTENSION),
+                                                            ("PDF files", "*" + PDF_EXTENSION)])
+        if file_path:
+            data = self.map.snapshot()
+            scale = self.scale
+            self.run_task(f"Экспорт {os.path.basename(file_path)}",
+                          lambda progress, cancelled: export_vector(MetroMap.from_dict(data), file_path, scale,
+                                                                    on_progress=progress, cancelled=cancelled),
+                          lambda result: self.status_var.set(f"Сохранено: {os.path.basename(file_path)}"),
+                          self.on_export_error,
+                          cancellable=True)
+
+    def on_export_error(self, error):
+        if isinstance(error, ExportCancelled):
+            self.status_var.set(str(error))
+        else:
+            messagebox.showerror("Ошибка", str(error))
 
     def export_json(self):
-        file_path = filedialog.asksaveasfilename(defaultextension=".json", filetypes=[("JSON files", "*.json")])
+        file_path = filedialog.asksaveasfilename(defaultextension=".json",
+                                                 filetypes=[("JSON files", "*.json"),
+                                                            ("Двоичная карта", "*" + BINARY_EXTENSION)])
         if file_path:
-            data = {
-                "lines": self.lines,
-                "stations": self.stations,
-                "scale": self.scale,
-                "offset_x": self.offset_x,
-                "offset_y": self.offset_y
-            }
-            with open(file_path, "w", encoding="utf-8") as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
+            self.map.scale = self.scale
+            self.map.offset_x = self.offset_x
+            self.map.offset_y = self.offset_y
+            # Большие карты быстрее сохранять и открывать в двоичном формате
+            if file_path.lower().endswith(BINARY_EXTENSION):
+                self.map.save_binary(file_path)
+            else:
+                self.map.save(file_path)
             messagebox.showinfo("Успех", f"Данные сохранены как {file_path}")
 
     def import_json(self):
-        file_path = filedialog.askopenfilename(filetypes=[("JSON files", "*.json")])
+        # Формат файла определяется по содержимому
+        file_path = filedialog.askopenfilename(filetypes=[("Карты метро", "*.json *" + BINARY_EXTENSION),
+                                                          ("JSON files", "*.json"),
+                                                          ("Двоичная карта", "*" + BINARY_EXTENSION)])
         if file_path:
-            try:
-                with open(file_path, "r", encoding="utf-8") as f:
-                    data = json.load(f)
-
-                self.lines = data.get("lines", [])
-                self.stations = data.get("stations", [])
-                self.scale = data.get("scale", 1.0)
-                self.offset_x = data.get("offset_x", 0)
-                self.offset_y = data.get("offset_y", 0)
-                self.scale_slider.set(self.scale)
-
-                self.selected_line = None
-                self.selected_station = None
-                self.update_lines_list()
-                self.update_stations_list()
-                self.redraw_map()
+            # Большая карта читается в фоне, окно всё это время отвечает
+            self.run_task(f"Загрузка {os.path.basename(file_path)}",
+                          lambda progress, cancelled: with_snapshot(MetroMap.load(file_path, progress)),
+                          lambda loaded: self.on_map_loaded(*loaded, f"Данные загружены из {file_path}"),
+                          lambda e: messagebox.showerror("Ошибка", f"Не удалось загрузить файл: {str(e)}"))
+
+    def import_network(self):
+        file_path = filedialog.askopenfilename(filetypes=[("Сеть метро", "*.csv *.geojson *.json"), ("CSV", "*.csv"),
+                                                          ("GeoJSON", "*.geojson *.json")])
+        if file_path:
+            # Файл разбирается и пересчитывается в координаты редактора в фоне, на карту сеть добавляется разом
+            self.run_task(f"Импорт {os.path.basename(file_path)}",
+                          lambda progress, cancelled: read_network(file_path),
+                          self.on_network_read,
+                          lambda e: messagebox.showerror("Ошибка", f"Не удалось импортировать сеть: {str(e)}"))
+
+    def on_network_read(self, network):
+        with self.history.transaction("Импорт сети"):
+            added = self.map.add_network(network["lines"], network["stations"])
+        # Списки и холст обновляются один раз на весь импорт
+        self.update_lines_list()
+        self.update_stations_list()
+        self.invalidate_all()
+        self.status_var.set(f"Импортировано линий: {len(added)}, станций: {len(network['stations'])}")
+
+    def on_map_loaded(self, metro_map, data, message):
+        self.set_map(metro_map, data)
+        messagebox.showinfo("Успех", message)
+
+    def set_map(self, metro_map, data=None):
+        """Делает metro_map картой редактора: новая история, журнал автосохранения и вид из карты.
+        data - копия карты для журнала, если уже снята (см. with_snapshot)"""
+        self.map = metro_map
+        self.history = History(self.map)
+        self.journal.attach(self.map, data)
+        self.scale = self.map.scale
+        self.offset_x = self.map.offset_x
+        self.offset_y = self.map.offset_y
+        self.scale_slider.set(self.scale)
 
-                messagebox.showinfo("Успех", f"Данные загружены из {file_path}")
+        self.selected_line = None
+        self.selection = set()
+        self.update_lines_list()
+        self.update_stations_list()
+        self.invalidate_all()
+
+    def start_autosave(self):
+        """Предлагает восстановить карту, оставшуюся от аварийно завершённого запуска, и включает автосохранение"""
+        if has_recovery(self.autosave_dir) and messagebox.askyesno("Восстановление",
+                                                  "Редактор в прошлый раз был закрыт аварийно. "
+                                                  "Восстановить несохранённую карту?"):
+            self.run_task("Восстановление карты",
+                          lambda progress, cancelled: with_snapshot(recover(self.autosave_dir, progress)),
+                          lambda loaded: self.on_map_loaded(*loaded, "Карта восстановлена"),
+                          self.on_recovery_failed)
+        else:
+            # Новый журнал заменяет оставшийся от прошлого запуска
+            self.journal.attach(self.map)
+
+    def on_recovery_failed(self, e):
+        messagebox.showerror("Ошибка", f"Не удалось восстановить карту: {str(e)}")
+        self.journal.attach(self.map)
+
+    def on_close(self):
+        # При нормальном закрытии автосохранение больше не нужно
+        self.journal.close(discard_files=True)
+        if self.trace_path is not None and profiler.events:
+            try:
+                profiler.export_trace(self.trace_path)
+            except OSError as e:
+                print(f"Не удалось сохранить трассу: {e}", file=sys.stderr)
+        self.root.destroy()
+
+    def run_task(self, title, work, on_done, on_error, cancellable=False):
+        """Запускает work(progress, cancelled) в фоновом потоке.
+
+        Поток не трогает Tk: ход работы и результат передаются через очередь, которую главный поток
+        разбирает в poll_task, и уже там вызываются on_done(результат) или on_error(исключение).
+        Для cancellable-операций включается кнопка "Отмена", а cancelled() начинает возвращать True.
+        """
+        if self.task is not None:
+            messagebox.showwarning("Подождите", "Дождитесь окончания текущей операции")
+            return
+
+        def run():
+            try:
+                result = work(lambda fraction: self.task_queue.put(("progress", fraction)), self.task_cancel.is_set)
             except Exception as e:
-                messagebox.showerror("Ошибка", f"Не удалось загрузить файл: {str(e)}")
+                self.task_queue.put(("error", e))
+            else:
+                self.task_queue.put(("done", result))
+
+        self.task_on_done = on_done
+        self.task_on_error = on_error
+        self.task_cancel.clear()
+        self.status_var.set(title + "...")
+        self.progress_var.set(0.0)
+        if cancellable:
+            self.cancel_button.configure(state=tk.NORMAL)
+        self.task = threading.Thread(target=run, daemon=True)
+        self.task.start()
+        self.root.after(TASK_POLL_MS, self.poll_task)
+
+    def poll_task(self):
+        while True:
+            try:
+                kind, value = self.task_queue.get_nowait()
+            except queue.Empty:
+                break
+            if kind == "progress":
+                self.progress_var.set(value)
+                continue
+
+            self.task = None
+            self.status_var.set("")
+            self.progress_var.set(0.0)
+            self.cancel_button.configure(state=tk.DISABLED)
+            if kind == "done":
+                self.task_on_done(value)
+            else:
+                self.task_on_error(value)
+            return
+        self.root.after(TASK_POLL_MS, self.poll_task)
+
+    def cancel_task(self):
+        if self.task is not None:
+            self.task_cancel.set()
+            self.cancel_button.configure(state=tk.DISABLED)
+            self.status_var.set("Отмена...")
 
 
 if __name__ == "__main__":
+    # python main.py [--debug] [--profile [трасса.json]]
+    args = sys.argv[1:]
+    profile = "--profile" in args
+    following = args[args.index("--profile") + 1:][:1] if profile else []
+    trace_path = following[0] if following and not following[0].startswith("--") else None
     root = tk.Tk()
-    app = MetroMapGenerator(root)
+    app = MetroMapGenerator(root, debug="--debug" in args, profile=profile, trace_path=trace_path)
     root.mainloop()
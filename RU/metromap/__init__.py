@@ -0,0 +1,19 @@
+"""Движок генератора карты метро, не зависящий от Tk: модель, геометрия и отрисовка"""
+from .binary import BINARY_EXTENSION, is_binary_map, read_binary, write_binary
+from .geometry import (bezier_samples, calculate_metro_path, calculate_smooth_path, flatten, image_points, line_path,
+                       pairs, simplify_path, station_size_mult, transform_points, visible_runs)
+from .jsonstream import iter_map_records, write_map_records
+from .model import MetroMap
+from .pathcache import PathCache
+from .spatial import SpatialGrid
+from .station import STATION_FIELDS, Station
+from .history import History, HistoryEntry, invert_op
+from .importer import import_network, project_network, read_csv, read_geojson, read_network
+from .journal import AUTOSAVE_DIR, Journal, discard, has_recovery, recover, replay
+from .labels import FONT_PATH, LABELS_MIN_SCALE, LabelCache, label_cache, load_font
+from .profiling import Profiler, format_frame, profiler
+from .render import ExportCancelled, export_png, export_png_tiled, render_map, render_view, resolve_resolution
+from .vector import PDF_EXTENSION, SVG_EXTENSION, export_pdf, export_svg, export_vector, write_svg
+from .synthetic import generate_map
+from .tiles import TileRenderer, make_tile_server, map_hash
+from .batch import batch_export, collect_maps
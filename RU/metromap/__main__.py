@@ -0,0 +1,124 @@
+"""Командная строка: python -m metromap карта.json карта.png"""
+import argparse
+import json
+import os
+import sys
+
+from .batch import batch_export, collect_maps
+from .model import MetroMap
+from .profiling import format_frame, profiler
+from .render import export_png
+from .tiles import DEFAULT_MAX_ZOOM, make_tile_server
+from .vector import PDF_EXTENSION, SVG_EXTENSION, export_vector
+
+
+def print_result(result):
+    if result["error"]:
+        print(f"ОШИБКА  {result['input']}: {result['error']}", file=sys.stderr)
+    else:
+        print(f"{result['seconds']:8.2f} с  {result['input']} -> {result['output']}")
+
+
+def run_batch(args):
+    input_paths = collect_maps(args.input)
+    if not input_paths:
+        print(f"Ошибка: не найдено карт по пути {args.input}", file=sys.stderr)
+        return 1
+
+    try:
+        results = batch_export(input_paths, args.output, args.workers, args.timeout, args.scale, args.tile_size,
+                               print_result, args.dpi, args.width, args.antialias)
+    except ValueError as e:
+        print(f"Ошибка: {e}", file=sys.stderr)
+        return 1
+    failed = [r for r in results if r["error"]]
+    total = sum(r["seconds"] for r in results if r["seconds"] is not None)
+    print(f"Готово: {len(results) - len(failed)} из {len(results)}, суммарное время отрисовки {total:.2f} с")
+
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    return 1 if failed else 0
+
+
+def run_server(args):
+    try:
+        server = make_tile_server(MetroMap.load(args.input), args.output, args.host, args.port, args.min_zoom,
+                                  args.max_zoom)
+    except (OSError, ValueError) as e:
+        print(f"Ошибка: {e}", file=sys.stderr)
+        return 1
+
+    host, port = server.server_address[:2]
+    print(f"Плитки: http://{host}:{port}/{{z}}/{{x}}/{{y}}.png (уровни {args.min_zoom}-{args.max_zoom}), "
+          f"описание: http://{host}:{port}/tiles.json, кэш: {server.renderer.cache_dir}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m metromap",
+                                     description="Экспорт карты метро из JSON в PNG, SVG или PDF")
+    parser.add_argument("input", help="файл карты в формате JSON (с --batch - папка или маска файлов)")
+    parser.add_argument("output", help="путь к PNG, SVG или PDF - по расширению (с --batch - папка для картинок)")
+    parser.add_argument("--scale", type=float, default=None,
+                        help="масштаб экспорта (по умолчанию - сохранённый в карте)")
+    resolution = parser.add_mutually_exclusive_group()
+    resolution.add_argument("--dpi", type=float, default=None,
+                            help="разрешение картинки: при 96 dpi единица карты при масштабе 1 - один пиксель")
+    resolution.add_argument("--width", type=int, default=None, help="ширина картинки в пикселях")
+    parser.add_argument("--antialias", type=int, default=1,
+                        help="сглаживание: рисовать в N раз крупнее и уменьшать (по умолчанию 1 - без сглаживания)")
+    parser.add_argument("--tile-size", type=int, default=None,
+                        help="рисовать полосами такой высоты, не держа всю картинку в памяти "
+                             "(огромные карты пишутся полосами автоматически)")
+    parser.add_argument("--profile", default=None, metavar="TRACE",
+                        help="замерить фазы экспорта PNG, напечатать разбивку и сохранить трассу "
+                             "для chrome://tracing или Perfetto")
+    parser.add_argument("--batch", action="store_true", help="экспортировать много карт параллельно")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="число процессов для --batch (по умолчанию - число ядер)")
+    parser.add_argument("--timeout", type=float, default=None,
+                        help="ограничение времени на одну карту в секундах для --batch")
+    parser.add_argument("--report", default=None, help="сохранить времена и ошибки --batch в JSON")
+    parser.add_argument("--serve", action="store_true",
+                        help="раздавать плитки z/x/y по HTTP, рисуя их по запросу (output - папка кэша плиток)")
+    parser.add_argument("--host", default="127.0.0.1", help="адрес сервера плиток")
+    parser.add_argument("--port", type=int, default=8000, help="порт сервера плиток")
+    parser.add_argument("--min-zoom", type=int, default=0, help="наименьший уровень плиток")
+    parser.add_argument("--max-zoom", type=int, default=DEFAULT_MAX_ZOOM, help="наибольший уровень плиток")
+    args = parser.parse_args(argv)
+    if args.antialias < 1:
+        parser.error("--antialias должно быть не меньше 1")
+
+    if args.batch:
+        return run_batch(args)
+    if args.serve:
+        return run_server(args)
+
+    profiler.enable(args.profile is not None)
+    try:
+        metro_map = MetroMap.load(args.input)
+        if os.path.splitext(args.output)[1].lower() in (SVG_EXTENSION, PDF_EXTENSION):
+            export_vector(metro_map, args.output, args.scale)
+        else:
+            export_png(metro_map, args.output, args.scale, args.tile_size, dpi=args.dpi, width=args.width,
+                       antialias=args.antialias)
+        if args.profile is not None:
+            frame = profiler.last_frame("export_png")
+            if frame is not None:
+                print(format_frame(frame))
+            profiler.export_trace(args.profile)
+    except (OSError, ValueError, RuntimeError) as e:
+        print(f"Ошибка: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
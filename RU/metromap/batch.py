@@ -0,0 +1,91 @@
+"""Пакетный экспорт множества JSON-карт в PNG на пуле процессов"""
+import glob
+import os
+import signal
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from .binary import BINARY_EXTENSION
+from .model import MetroMap
+from .render import export_png
+
+
+def collect_maps(pattern):
+    """Список карт: все *.json и двоичные карты в папке либо файлы, подходящие под маску"""
+    if os.path.isdir(pattern):
+        return sorted(glob.glob(os.path.join(pattern, "*.json")) +
+                      glob.glob(os.path.join(pattern, "*" + BINARY_EXTENSION)))
+    return sorted(glob.glob(pattern))
+
+
+def output_names(input_paths):
+    """Имена картинок для карт: имя файла карты с расширением .png.
+
+    Если так совпадают имена разных карт (a.json и a.mmb в одной папке), в имя картинки входит и
+    расширение карты: a.json.png и a.mmb.png. Одинаково названные файлы из разных папок различить
+    нельзя - тогда ValueError, а не молчаливая перезапись картинки.
+    """
+    stems = [os.path.splitext(os.path.basename(path))[0] for path in input_paths]
+    taken = {}
+    for stem in stems:
+        taken[stem.lower()] = taken.get(stem.lower(), 0) + 1
+    names = [(stem if taken[stem.lower()] == 1 else os.path.basename(path)) + ".png"
+             for path, stem in zip(input_paths, stems)]
+    seen = {}
+    for path, name in zip(input_paths, names):
+        other = seen.setdefault(name.lower(), path)
+        if other != path:
+            raise ValueError(f"Карты {other} и {path} дают одну и ту же картинку {name}")
+    return names
+
+
+def _on_timeout(signum, frame):
+    raise TimeoutError("Превышено время отрисовки")
+
+
+def _export_one(input_path, output_path, scale, timeout, tile_size, dpi=None, width=None, antialias=1):
+    """Отрисовка одной карты в процессе пула. Таймаут работает там, где есть SIGALRM"""
+    use_alarm = timeout and hasattr(signal, "setitimer")
+    if use_alarm:
+        signal.signal(signal.SIGALRM, _on_timeout)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    start = time.perf_counter()
+    try:
+        export_png(MetroMap.load(input_path), output_path, scale, tile_size, dpi=dpi, width=width,
+                   antialias=antialias)
+    finally:
+        if use_alarm:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+    return time.perf_counter() - start
+
+
+def batch_export(input_paths, output_dir, workers=None, timeout=None, scale=None, tile_size=None, on_result=None,
+                 dpi=None, width=None, antialias=1):
+    """Экспортирует карты в output_dir параллельно.
+
+    Возвращает по словарю на карту (в порядке input_paths) с ключами input, output, seconds и error.
+    on_result вызывается для каждой карты сразу по мере готовности. Если две карты дают одно имя
+    картинки (см. output_names), ValueError до начала экспорта.
+    """
+    names = output_names(input_paths)
+    os.makedirs(output_dir, exist_ok=True)
+    results = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {}
+        for input_path, name in zip(input_paths, names):
+            output_path = os.path.join(output_dir, name)
+            future = pool.submit(_export_one, input_path, output_path, scale, timeout, tile_size, dpi, width, antialias)
+            futures[future] = (input_path, output_path)
+
+        for future in as_completed(futures):
+            input_path, output_path = futures[future]
+            result = {"input": input_path, "output": output_path, "seconds": None, "error": None}
+            try:
+                result["seconds"] = future.result()
+            except Exception as e:
+                result["error"] = f"{type(e).__name__}: {e}"
+            results[input_path] = result
+            if on_result:
+                on_result(result)
+
+    return [results[input_path] for input_path in input_paths]
@@ -0,0 +1,272 @@
+"""Компактный двоичный формат карты (.mmb).
+
+Файл читается через mmap: координаты и номера станций лежат готовыми массивами, состав линий -
+массивами смещений и номеров строк станций, все строки - в общей таблице без повторов. Формат без
+потерь повторяет JSON-схему карты (lines, stations, scale, offset_x, offset_y): целые числа остаются
+целыми, отсутствующие поля - отсутствующими, а незнакомые поля сохраняются в небольшом JSON-хвосте.
+
+Все числа записываются в порядке байтов little-endian, каждый массив выровнен на 8 байт.
+"""
+import json
+import mmap
+import struct
+import sys
+from array import array
+
+MAGIC = b"METROMAP"
+VERSION = 1
+BINARY_EXTENSION = ".mmb"
+
+# magic, версия, число станций, линий, ссылок линий на станции, строк, размер таблицы строк в байтах
+HEADER = struct.Struct("<8sIIIIII")
+# scale, offset_x, offset_y, флаги этих полей, выравнивание
+VIEW = struct.Struct("<dddI4x")
+
+# Поля, которые хранятся массивами; ID - целое число, NUM - целое или дробное, STR - строка из таблицы
+ID, NUM, STR = "q", "d", "i"
+STATION_FIELDS = [("id", ID), ("name", STR), ("x", NUM), ("y", NUM), ("style", STR)]
+LINE_FIELDS = [("id", ID), ("name", STR), ("color", STR), ("width", NUM), ("smoothing", STR)]
+VIEW_FIELDS = [("scale", NUM), ("offset_x", NUM), ("offset_y", NUM)]
+
+# Для каждого поля два бита флагов: поля нет в словаре / число было целым
+ABSENT, INTEGER = 1, 2
+
+
+def _aligned(size):
+    return (size + 7) & ~7
+
+
+def _pack(typecode, values):
+    packed = array(typecode, values)
+    if sys.byteorder == "big":
+        packed.byteswap()
+    data = packed.tobytes()
+    return data + b"\0" * (_aligned(len(data)) - len(data))
+
+
+def _unpack(buffer, offset, typecode, count):
+    """Массив из count значений, лежащий в buffer по смещению offset; возвращает его и смещение следующего"""
+    values = array(typecode)
+    size = values.itemsize * count
+    values.frombytes(buffer[offset:offset + size])
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values, offset + _aligned(size)
+
+
+def is_binary_map(file_path):
+    with open(file_path, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+class _StringTable:
+    def __init__(self):
+        self.index = {}
+
+    def add(self, text):
+        return self.index.setdefault(text, len(self.index))
+
+    def pack(self):
+        """Смещения строк и сами строки в UTF-8 через нулевой байт (по нему таблица читается одним split)"""
+        encoded = [text.encode("utf-8") for text in self.index]
+        offsets = [0]
+        for data in encoded:
+            offsets.append(offsets[-1] + len(data) + 1)
+        return offsets, b"".join(data + b"\0" for data in encoded)
+
+
+def _encode_fields(items, fields, strings, skip=()):
+    """Раскладывает словари по столбцам; то, что не укладывается в схему (кроме ключей skip), уходит в extras"""
+    columns = [[] for _ in fields]
+    flags = []
+    extras = {}
+    for row, item in enumerate(items):
+        item_flags = 0
+        extra = {}
+        for i, (key, kind) in enumerate(fields):
+            value = item.get(key)
+            stored = None
+            if kind == STR and isinstance(value, str):
+                stored = strings.add(value)
+            elif kind == ID and type(value) is int and -2 ** 63 <= value < 2 ** 63:
+                stored = value
+            elif kind == NUM and (type(value) is float or type(value) is int and abs(value) <= 2 ** 53):
+                stored = float(value)
+                if type(value) is int:
+                    item_flags |= INTEGER << 2 * i
+            if stored is None:
+                item_flags |= ABSENT << 2 * i
+                stored = -1 if kind == STR else 0
+                if key in item:
+                    extra[key] = item[key]
+            columns[i].append(stored)
+        known = {key for key, _ in fields}
+        extra.update({key: value for key, value in item.items() if key not in known and key not in skip})
+        if extra:
+            extras[str(row)] = extra
+        flags.append(item_flags)
+    return columns, flags, extras
+
+
+def _decode_fields(columns, flags, fields, strings, count):
+    """Собирает словари из столбцов. Столбцы с одинаковыми для всех строк флагами переносятся целиком"""
+    flags = flags.tolist()
+    distinct = set(flags)
+    keys, values, mixed = [], [], []
+    for i, (key, kind) in enumerate(fields):
+        column = columns[i].tolist()
+        if kind == STR:
+            # В конце таблицы строк стоит None, на него указывает -1
+            column = list(map(strings.__getitem__, column))
+        field_flags = {item_flags >> 2 * i & 3 for item_flags in distinct}
+        if field_flags == {0}:
+            keys.append(key)
+            values.append(column)
+        elif field_flags == {INTEGER}:
+            keys.append(key)
+            values.append(list(map(int, column)))
+        elif field_flags != {ABSENT}:
+            mixed.append((i, key, column))
+
+    items = [dict(zip(keys, row)) for row in zip(*values)] if keys else [{} for _ in range(count)]
+    for i, key, column in mixed:
+        for item, value, item_flags in zip(items, column, flags):
+            field_flags = item_flags >> 2 * i
+            if not field_flags & ABSENT:
+                item[key] = int(value) if field_flags & INTEGER else value
+    return items
+
+
+def write_binary(data, file_path):
+    """Сохраняет карту в формате словаря MetroMap.to_dict() в двоичный файл"""
+    stations = data.get("stations", [])
+    lines = data.get("lines", [])
+    strings = _StringTable()
+
+    station_columns, station_flags, station_extras = _encode_fields(stations, STATION_FIELDS, strings)
+    line_columns, line_flags, line_extras = _encode_fields(lines, LINE_FIELDS, strings, skip=("stations",))
+
+    # Состав линий - номера строк станций в массивах выше
+    rows = {}
+    for row, station in enumerate(stations):
+        rows.setdefault(station.get("id"), row)
+    line_offsets = [0]
+    members = []
+    for row, line in enumerate(lines):
+        station_ids = line.get("stations")
+        if isinstance(station_ids, list) and all(type(s) is int and s in rows for s in station_ids):
+            members.extend(rows[s] for s in station_ids)
+        else:
+            line_flags[row] |= ABSENT << 2 * len(LINE_FIELDS)
+            if "stations" in line:
+                line_extras.setdefault(str(row), {})["stations"] = station_ids
+        line_offsets.append(len(members))
+
+    view_columns, view_flags, view_extras = _encode_fields([data], VIEW_FIELDS, strings, skip=("lines", "stations"))
+
+    string_offsets, string_blob = strings.pack()
+    extras = {}
+    if station_extras:
+        extras["stations"] = station_extras
+    if line_extras:
+        extras["lines"] = line_extras
+    if view_extras:
+        extras["map"] = view_extras["0"]
+    extras_blob = json.dumps(extras, ensure_ascii=False).encode("utf-8") if extras else b""
+
+    with open(file_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(stations), len(lines), len(members), len(string_offsets) - 1,
+                            len(string_blob)))
+        f.write(VIEW.pack(*(column[0] for column in view_columns), view_flags[0]))
+
+        f.write(_pack(ID, station_columns[0]))
+        coords = [0.0] * (2 * len(stations))
+        coords[0::2] = station_columns[2]
+        coords[1::2] = station_columns[3]
+        f.write(_pack("d", coords))
+        f.write(_pack(STR, station_columns[1]))
+        f.write(_pack(STR, station_columns[4]))
+        f.write(_pack("I", station_flags))
+
+        f.write(_pack(ID, line_columns[0]))
+        f.write(_pack(NUM, line_columns[3]))
+        for column in (line_columns[1], line_columns[2], line_columns[4]):
+            f.write(_pack(STR, column))
+        f.write(_pack("I", line_flags))
+        f.write(_pack("I", line_offsets))
+        f.write(_pack("I", members))
+
+        f.write(_pack("I", string_offsets))
+        f.write(string_blob + b"\0" * (_aligned(len(string_blob)) - len(string_blob)))
+        f.write(struct.pack("<Q", len(extras_blob)))
+        f.write(extras_blob)
+
+
+def read_binary(file_path):
+    """Читает двоичную карту через mmap и возвращает словарь в формате MetroMap.to_dict()"""
+    with open(file_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        buffer = memoryview(mm)
+        try:
+            return _read(buffer)
+        finally:
+            buffer.release()
+
+
+def _read(buffer):
+    magic, version, station_count, line_count, member_count, string_count, string_size = \
+        HEADER.unpack_from(buffer, 0)
+    if magic != MAGIC:
+        raise ValueError("Файл не является двоичной картой метро")
+    if version != VERSION:
+        raise ValueError(f"Неподдерживаемая версия двоичной карты: {version}")
+    scale, offset_x, offset_y, view_flags = VIEW.unpack_from(buffer, HEADER.size)
+    offset = HEADER.size + VIEW.size
+
+    station_ids, offset = _unpack(buffer, offset, ID, station_count)
+    coords, offset = _unpack(buffer, offset, "d", 2 * station_count)
+    station_names, offset = _unpack(buffer, offset, STR, station_count)
+    station_styles, offset = _unpack(buffer, offset, STR, station_count)
+    station_flags, offset = _unpack(buffer, offset, "I", station_count)
+
+    line_ids, offset = _unpack(buffer, offset, ID, line_count)
+    line_widths, offset = _unpack(buffer, offset, NUM, line_count)
+    line_names, offset = _unpack(buffer, offset, STR, line_count)
+    line_colors, offset = _unpack(buffer, offset, STR, line_count)
+    line_smoothing, offset = _unpack(buffer, offset, STR, line_count)
+    line_flags, offset = _unpack(buffer, offset, "I", line_count)
+    line_offsets, offset = _unpack(buffer, offset, "I", line_count + 1)
+    members, offset = _unpack(buffer, offset, "I", member_count)
+
+    string_offsets, offset = _unpack(buffer, offset, "I", string_count + 1)
+    blob = buffer[offset:offset + string_size].tobytes()
+    strings = blob.decode("utf-8").split("\0")[:-1]
+    if len(strings) != string_count:
+        # Нулевой символ внутри какой-то строки - читаем по смещениям
+        strings = [blob[string_offsets[i]:string_offsets[i + 1] - 1].decode("utf-8") for i in range(string_count)]
+    strings.append(None)
+    offset += _aligned(string_size)
+    extras_size, = struct.unpack_from("<Q", buffer, offset)
+    offset += 8
+    extras = json.loads(buffer[offset:offset + extras_size].tobytes().decode("utf-8")) if extras_size else {}
+
+    stations = _decode_fields([station_ids, station_names, coords[0::2], coords[1::2], station_styles],
+                              station_flags, STATION_FIELDS, strings, station_count)
+    lines = _decode_fields([line_ids, line_names, line_colors, line_widths, line_smoothing],
+                           line_flags, LINE_FIELDS, strings, line_count)
+
+    ids = station_ids.tolist()
+    members = members.tolist()
+    for row, line in enumerate(lines):
+        if not line_flags[row] >> 2 * len(LINE_FIELDS) & ABSENT:
+            line["stations"] = [ids[member] for member in members[line_offsets[row]:line_offsets[row + 1]]]
+
+    for key, items in (("stations", stations), ("lines", lines)):
+        for row, extra in extras.get(key, {}).items():
+            items[int(row)].update(extra)
+
+    data = _decode_fields([array(NUM, [scale]), array(NUM, [offset_x]), array(NUM, [offset_y])],
+                          array("I", [view_flags]), VIEW_FIELDS, strings, 1)[0]
+    data["lines"] = lines
+    data["stations"] = stations
+    data.update(extras.get("map", {}))
+    return data
@@ -0,0 +1,246 @@
+"""Построение путей линий: прямые, сглаженные кривыми Безье и в стиле схемы метро"""
+from functools import lru_cache
+
+try:
+    import numpy as np
+except ImportError:  # NumPy необязателен: без него те же вычисления идут на списках
+    np = None
+
+DEFAULT_BEZIER_SAMPLES = 10
+MIN_BEZIER_SAMPLES = 4
+MAX_BEZIER_SAMPLES = 40
+
+
+def calculate_metro_path(points):
+    """Строит путь между станциями с углами строго 45 градусов, гарантированно проходя через все точки"""
+    if len(points) < 2:
+        return points
+
+    path = [points[0]]
+
+    for i in range(1, len(points)):
+        prev_x, prev_y = path[-1]
+        curr_x, curr_y = points[i]
+
+        dx = curr_x - prev_x
+        dy = curr_y - prev_y
+
+        # Определяем основные направления движения
+        if dx == 0:  # Вертикальное движение
+            path.append((prev_x, curr_y))
+        elif dy == 0:  # Горизонтальное движение
+            path.append((curr_x, prev_y))
+        else:
+            # Движение под углом 45 градусов
+            distance = min(abs(dx), abs(dy))
+            step_x = distance if dx > 0 else -distance
+            step_y = distance if dy > 0 else -distance
+
+            # Промежуточная точка
+            mid_x = prev_x + step_x
+            mid_y = prev_y + step_y
+
+            # Проверяем, не проходим ли мы уже через целевую точку
+            if (abs(mid_x - curr_x) < 1 and abs(mid_y - curr_y) < 1):
+                path.append((curr_x, curr_y))
+            else:
+                path.append((mid_x, mid_y))
+
+                # Добираемся до конечной точки
+                if mid_x != curr_x:
+                    path.append((curr_x, mid_y))
+                if mid_y != curr_y:
+                    path.append((curr_x, curr_y))
+
+    # Оптимизация: удаляем лишние точки на одной прямой
+    optimized_path = [path[0]]
+    for i in range(1, len(path) - 1):
+        x0, y0 = optimized_path[-1]
+        x1, y1 = path[i]
+        x2, y2 = path[i + 1]
+
+        # Если три точки лежат на одной прямой, среднюю можно удалить
+        if (x1 - x0) * (y2 - y0) != (x2 - x0) * (y1 - y0):
+            optimized_path.append((x1, y1))
+
+    optimized_path.append(path[-1])
+    return optimized_path
+
+
+def bezier_samples(scale):
+    """Число отрезков на кривую Безье в зависимости от масштаба: 10 при масштабе 1"""
+    return max(MIN_BEZIER_SAMPLES, min(MAX_BEZIER_SAMPLES, round(DEFAULT_BEZIER_SAMPLES * scale)))
+
+
+@lru_cache(maxsize=None)
+def bezier_basis(samples):
+    """Значения базисных многочленов кубической кривой Безье в точках t = 0, 1/samples, ..., 1"""
+    basis = []
+    for t in [i / samples for i in range(samples + 1)]:
+        t2 = t * t
+        t3 = t2 * t
+        mt = 1 - t
+        mt2 = mt * mt
+        mt3 = mt2 * mt
+        basis.append((mt3, 3 * mt2 * t, 3 * mt * t2, t3))
+    return basis
+
+
+@lru_cache(maxsize=None)
+def _bezier_basis_matrix(samples):
+    return np.array(bezier_basis(samples))
+
+
+def flatten(points):
+    return [c for point in points for c in point]
+
+
+def pairs(coords):
+    """Точки из плоского списка координат [x0, y0, x1, y1, ...]"""
+    return list(zip(coords[0::2], coords[1::2]))
+
+
+def transform_points(coords, scale, offset_x, offset_y):
+    """Переводит все точки из координат карты в экранные за одну операцию.
+
+    coords - плоский список [x0, y0, x1, y1, ...] (или массив NumPy (n, 2)), результат - плоский список,
+    который без преобразований принимают и холст Tk, и Pillow.
+    """
+    if np is not None:
+        return (np.asarray(coords, dtype=float).reshape(-1, 2) * scale + (offset_x, offset_y)).ravel().tolist()
+    return [c for x, y in zip(coords[0::2], coords[1::2]) for c in (x * scale + offset_x, y * scale + offset_y)]
+
+
+def image_points(coords, size, min_x, min_y):
+    """Переводит точки карты в пиксели экспортируемой картинки (с округлением вниз по сетке size)"""
+    if np is not None:
+        coords = np.asarray(coords, dtype=float).reshape(-1, 2)
+        return (np.floor_divide(coords, size) - (min_x, min_y)).ravel().tolist()
+    return [c for x, y in zip(coords[0::2], coords[1::2]) for c in (x // size - min_x, y // size - min_y)]
+
+
+def calculate_smooth_path(coords, samples=DEFAULT_BEZIER_SAMPLES):
+    """Сглаживает ломаную кубическими кривыми Безье, проходящими через все точки.
+
+    Принимает и возвращает плоские списки координат.
+    """
+    if len(coords) < 4:
+        return list(coords)
+    if np is not None:
+        return _calculate_smooth_path_numpy(coords, samples)
+
+    points = pairs(coords)
+    basis = bezier_basis(samples)
+    smooth_points = []
+    for i in range(len(points) - 1):
+        x1, y1 = points[i]
+        x2, y2 = points[i + 1]
+
+        if i == 0:  # Первая точка
+            x0, y0 = x1, y1
+        else:
+            x0, y0 = points[i - 1]
+
+        if i == len(points) - 2:  # Последняя точка
+            x3, y3 = x2, y2
+        else:
+            x3, y3 = points[i + 2]
+
+        # Контрольные точки для плавного перехода
+        cp1x = x1 + (x2 - x0) * 0.2
+        cp1y = y1 + (y2 - y0) * 0.2
+        cp2x = x2 - (x3 - x1) * 0.2
+        cp2y = y2 - (y3 - y1) * 0.2
+
+        # Генерируем точки вдоль кривой Безье
+        for b0, b1, b2, b3 in basis:
+            smooth_points.extend([b0 * x1 + b1 * cp1x + b2 * cp2x + b3 * x2,
+                                  b0 * y1 + b1 * cp1y + b2 * cp2y + b3 * y2])
+    return smooth_points
+
+
+def _calculate_smooth_path_numpy(coords, samples):
+    """То же, что calculate_smooth_path, но все отрезки линии считаются одним умножением матриц"""
+    p = np.asarray(coords, dtype=float).reshape(-1, 2)
+    p1 = p[:-1]
+    p2 = p[1:]
+    # Соседние точки; у крайних отрезков соседом считается сама крайняя точка
+    p0 = np.concatenate((p[:1], p[:-2]))
+    p3 = np.concatenate((p[2:], p[-1:]))
+
+    # Опорные точки всех отрезков: (4, число отрезков * 2)
+    control = np.stack((p1, p1 + (p2 - p0) * 0.2, p2 - (p3 - p1) * 0.2, p2)).reshape(4, -1)
+    basis = _bezier_basis_matrix(samples)
+    curves = (basis @ control).reshape(len(basis), -1, 2).transpose(1, 0, 2)
+    return curves.ravel().tolist()
+
+
+def line_path(coords, smoothing, samples=DEFAULT_BEZIER_SAMPLES):
+    """Путь линии через точки станций в соответствии со стилем сглаживания (плоские списки координат)"""
+    if smoothing == "smooth":
+        return calculate_smooth_path(coords, samples)
+    elif smoothing == "metro":
+        return flatten(calculate_metro_path(pairs(coords)))
+    return list(coords)
+
+
+def visible_runs(coords, x0, y0, x1, y1):
+    """Участки пути, отрезки которых пересекают прямоугольник (x0, y0, x1, y1).
+
+    Каждый участок - плоский список координат, дополненный соседним отрезком с каждой стороны,
+    чтобы стыки у края видимой области рисовались без разрывов.
+    """
+    segment_count = len(coords) // 2 - 1
+    if segment_count < 1:
+        return []
+
+    if np is not None:
+        p = np.asarray(coords, dtype=float).reshape(-1, 2)
+        a, b = p[:-1], p[1:]
+        lo, hi = np.minimum(a, b), np.maximum(a, b)
+        hit = (hi[:, 0] >= x0) & (lo[:, 0] <= x1) & (hi[:, 1] >= y0) & (lo[:, 1] <= y1)
+        if hit.all():
+            return [list(coords)]
+        segments = np.flatnonzero(hit).tolist()
+    else:
+        segments = []
+        for i in range(segment_count):
+            ax, ay, bx, by = coords[2 * i:2 * i + 4]
+            if max(ax, bx) >= x0 and min(ax, bx) <= x1 and max(ay, by) >= y0 and min(ay, by) <= y1:
+                segments.append(i)
+
+    runs = []
+    for i in segments:
+        if runs and i - 1 <= runs[-1][1] + 2:
+            runs[-1][1] = i + 1
+        else:
+            runs.append([i - 1, i + 1])
+    return [list(coords[2 * max(0, start):2 * (min(segment_count - 1, end) + 2)]) for start, end in runs]
+
+
+def simplify_path(coords, tolerance):
+    """Убирает подряд идущие точки, попадающие в одну клетку сетки с шагом tolerance (первая и последняя остаются)"""
+    if len(coords) <= 4:
+        return list(coords)
+
+    if np is not None:
+        p = np.asarray(coords, dtype=float).reshape(-1, 2)
+        cells = np.floor(p / tolerance)
+        keep = np.ones(len(p), dtype=bool)
+        keep[1:-1] = (cells[1:-1] != cells[:-2]).any(axis=1)
+        return p[keep].ravel().tolist()
+
+    result = list(coords[:2])
+    last_cell = (coords[0] // tolerance, coords[1] // tolerance)
+    for i in range(2, len(coords) - 2, 2):
+        cell = (coords[i] // tolerance, coords[i + 1] // tolerance)
+        if cell != last_cell:
+            result.extend(coords[i:i + 2])
+        last_cell = cell
+    result.extend(coords[-2:])
+    return result
+
+
+def station_size_mult(line_width):
+    """Множитель размера значка станции в зависимости от толщины её линии"""
+    return max(1.4, line_width / 8 + 0.5)
@@ -0,0 +1,168 @@
+"""История правок для отмены и повтора.
+
+Запись истории - не копия карты, а список операций, которыми карта сообщает о своих изменениях
+(см. описание model.py), поэтому перемещение станции стоит несколько десятков байт независимо от
+размера карты. Размер истории ограничен оценкой занимаемой памяти, а не числом шагов.
+"""
+import sys
+from collections import deque
+from contextlib import contextmanager
+
+DEFAULT_BUDGET = 32 * 1024 * 1024
+
+_INVERSE = {"add_station": "remove_station", "remove_station": "add_station",
+            "add_stations": "remove_stations", "remove_stations": "add_stations",
+            "add_line": "remove_line", "remove_line": "add_line"}
+
+
+def invert_op(op):
+    """Операция, отменяющая op"""
+    kind = op[0]
+    if kind in _INVERSE:
+        return (_INVERSE[kind],) + op[1:]
+    if kind == "move_station":
+        return kind, op[1], op[4], op[5], op[2], op[3]
+    if kind == "move_stations":
+        return kind, [(m[0], m[3], m[4], m[1], m[2]) for m in op[1]]
+    if kind in ("update_stations", "set_line_stations"):
+        return kind, [(item, new, old) for item, old, new in op[1]]
+    # update_station и update_line: старые и новые поля меняются местами
+    return kind, op[1], op[3], op[2]
+
+
+def _deep_size(value):
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(_deep_size(item) for item in value.values())
+    elif isinstance(value, (list, tuple)):
+        size += sum(_deep_size(item) for item in value)
+    return size
+
+
+class HistoryEntry:
+    __slots__ = ("label", "ops", "merge_key", "size")
+
+    def __init__(self, label, ops, merge_key):
+        self.label = label
+        self.ops = ops
+        self.merge_key = merge_key
+        self.size = sum(map(_deep_size, ops))
+
+
+class History:
+    """Стеки отмены и повтора для одной карты.
+
+    Правки записываются транзакциями: всё, что карта сообщила внутри with history.transaction(...),
+    отменяется и повторяется как один шаг.
+    """
+
+    def __init__(self, metro_map, budget=DEFAULT_BUDGET):
+        self.map = metro_map
+        self.budget = budget
+        self.undo_stack = deque()
+        self.redo_stack = []
+        self.size = 0
+
+    @contextmanager
+    def transaction(self, label, merge_key=None):
+        """Собирает операции карты в одну запись истории.
+
+        Записи с одинаковым merge_key, идущие подряд, сливаются в одну: так всё перетаскивание станции
+        отменяется одним шагом.
+        """
+        ops = []
+        self.map.listeners.append(ops.append)
+        try:
+            yield
+        finally:
+            self.map.listeners.remove(ops.append)
+            if ops:
+                self.record(label, ops, merge_key)
+
+    def record(self, label, ops, merge_key=None):
+        self._clear_redo()
+        last = self.undo_stack[-1] if self.undo_stack else None
+        if merge_key is not None and last is not None and last.merge_key == merge_key:
+            self.size -= last.size
+            last.ops = _merge_moves(last.ops, ops)
+            last.size = sum(map(_deep_size, last.ops))
+            self.size += last.size
+        else:
+            entry = HistoryEntry(label, ops, merge_key)
+            self.undo_stack.append(entry)
+            self.size += entry.size
+        self._trim()
+
+    def undo(self):
+        """Отменяет последнюю запись и возвращает её (или None, если отменять нечего)"""
+        if not self.undo_stack:
+            return None
+        entry = self.undo_stack.pop()
+        for op in reversed(entry.ops):
+            self.map.apply(invert_op(op))
+        self.redo_stack.append(entry)
+        return entry
+
+    def redo(self):
+        if not self.redo_stack:
+            return None
+        entry = self.redo_stack.pop()
+        for op in entry.ops:
+            self.map.apply(op)
+        # Повторённая запись не должна сливаться с новыми правками
+        entry.merge_key = None
+        self.undo_stack.append(entry)
+        return entry
+
+    def can_undo(self):
+        return bool(self.undo_stack)
+
+    def can_redo(self):
+        return bool(self.redo_stack)
+
+    def clear(self):
+        self.undo_stack.clear()
+        self.redo_stack.clear()
+        self.size = 0
+
+    def _clear_redo(self):
+        self.size -= sum(entry.size for entry in self.redo_stack)
+        self.redo_stack.clear()
+
+    def _trim(self):
+        # Самые старые записи забываются первыми; последняя остаётся, даже если одна больше бюджета
+        while self.size > self.budget and len(self.undo_stack) > 1:
+            self.size -= self.undo_stack.popleft().size
+
+    def stats(self):
+        return {"undo": len(self.undo_stack), "redo": len(self.redo_stack), "size": self.size,
+                "budget": self.budget}
+
+
+def _move_key(op):
+    """Станция или группа станций, которую перемещает операция, или None, если это не перемещение"""
+    if op[0] == "move_station":
+        return op[1]
+    if op[0] == "move_stations":
+        return tuple(m[0] for m in op[1])
+    return None
+
+
+def _merge_moves(ops, new_ops):
+    """Дописывает new_ops к ops, схлопывая повторные перемещения одной станции или группы в одно"""
+    ops = list(ops)
+    moves = {_move_key(op): i for i, op in enumerate(ops) if _move_key(op) is not None}
+    for op in new_ops:
+        key = _move_key(op)
+        i = moves.get(key) if key is not None else None
+        if i is None:
+            if key is not None:
+                moves[key] = len(ops)
+            ops.append(op)
+        elif op[0] == "move_station":
+            first = ops[i]
+            ops[i] = (first[0], first[1], first[2], first[3], op[4], op[5])
+        else:
+            ops[i] = (op[0], [(first[0], first[1], first[2], last[3], last[4])
+                              for first, last in zip(ops[i][1], op[1])])
+    return ops
@@ -0,0 +1,255 @@
+"""Пакетный импорт сети метро из CSV и GeoJSON.
+
+Файл разбирается в сеть - станции и линии с временными id, - координаты которой уже переведены в
+координаты редактора; MetroMap.add_network() добавляет её на карту разом. Географические
+координаты (долгота и широта) переводятся в проекцию Меркатора, спроецированные (например, метры)
+- просто масштабируются; в обоих случаях сеть вписывается в квадрат со стороной size, а ось y
+разворачивается, потому что в редакторе она направлена вниз.
+
+CSV - одна строка на станцию линии: столбцы name, x и y (или lon и lat), line и по желанию color,
+width, style и order (порядок станции на линии). Станция пересадки повторяется в строках каждой своей
+линии с теми же названием и координатами (или с тем же id в столбце id).
+
+GeoJSON - точки (Point) становятся станциями, линии (LineString, MultiLineString) - линиями. Станции
+линии - точки, совпадающие с её вершинами, в порядке вершин; если таких нет, станцией становится
+каждая вершина. Кроме того, точку можно отнести к линиям по названию через свойство line или lines.
+"""
+import csv
+import json
+import math
+import os
+
+DEFAULT_IMPORT_SIZE = 2000
+DEFAULT_LINE_WIDTH = 6
+DEFAULT_SMOOTHING = "straight"
+# Цвета линий, для которых в файле цвет не указан
+LINE_COLORS = ("#e42313", "#4baf4f", "#0072ba", "#24bcef", "#92522a", "#ef7e24", "#943f90", "#ffd803",
+               "#adacac", "#b1d332", "#5091bb", "#85d4f3")
+PROJECTIONS = ("auto", "mercator", "linear", "none")
+CSV_EXTENSION = ".csv"
+
+# Названия столбцов CSV и свойств GeoJSON, которые понимает импорт (без учёта регистра)
+COLUMNS = {
+    "id": ("id", "station_id"),
+    "name": ("name", "station", "название", "станция"),
+    "x": ("x",),
+    "y": ("y",),
+    "lon": ("lon", "lng", "long", "longitude", "долгота"),
+    "lat": ("lat", "latitude", "широта"),
+    "line": ("line", "route", "ref", "линия"),
+    "lines": ("lines", "линии"),
+    "color": ("color", "colour", "stroke", "цвет"),
+    "width": ("width", "stroke-width", "толщина"),
+    "style": ("style", "стиль"),
+    "order": ("order", "seq", "sequence", "порядок"),
+}
+# Знаков после запятой в ключе совпадения вершины линии с точкой станции
+COORD_DIGITS = 9
+
+
+def _field(record, key):
+    """Значение поля по любому из его названий в COLUMNS или None"""
+    for name in COLUMNS[key]:
+        value = record.get(name)
+        if value not in (None, ""):
+            return value
+    return None
+
+
+def _lower_keys(record):
+    return {str(key).strip().lower(): value for key, value in record.items()}
+
+
+class _Network:
+    """Собирает станции и линии с временными id"""
+
+    def __init__(self):
+        self.stations = []
+        self.lines = {}  # название -> линия (порядок добавления сохраняется)
+        self.station_keys = {}  # ключ станции -> её временный id
+        self.orders = {}  # id линии -> порядок каждой её станции, если он указан в файле
+
+    def station(self, key, name, x, y, style=None):
+        if key in self.station_keys:
+            return self.station_keys[key]
+        station_id = len(self.stations) + 1
+        self.stations.append({"id": station_id, "name": name or f"Станция {station_id}", "x": x, "y": y,
+                              "style": style or "circle"})
+        self.station_keys[key] = station_id
+        return station_id
+
+    def line(self, name, color=None, width=None):
+        line = self.lines.get(name)
+        if line is None:
+            line = self.lines[name] = {"id": len(self.lines) + 1, "name": name,
+                                       "color": color or LINE_COLORS[len(self.lines) % len(LINE_COLORS)],
+                                       "width": DEFAULT_LINE_WIDTH, "smoothing": DEFAULT_SMOOTHING, "stations": []}
+        elif color:
+            line["color"] = color
+        if width is not None:
+            line["width"] = int(float(width))
+        return line
+
+    def add_to_line(self, line, station_id, order=None):
+        if line["stations"] and line["stations"][-1] == station_id:
+            return
+        line["stations"].append(station_id)
+        if order is not None:
+            self.orders.setdefault(line["id"], []).append(float(order))
+
+    def finish(self):
+        lines = []
+        for line in self.lines.values():
+            orders = self.orders.get(line["id"])
+            if orders is not None and len(orders) == len(line["stations"]):
+                # Станции встают по столбцу order; sorted устойчива, так что равные остаются в порядке файла
+                line["stations"] = [s for _, s in sorted(zip(orders, line["stations"]), key=lambda pair: pair[0])]
+            lines.append(line)
+        return {"lines": lines, "stations": self.stations}
+
+
+def read_csv(file_path):
+    """Сеть из CSV (см. описание модуля) и признак географических координат"""
+    with open(file_path, newline="", encoding="utf-8-sig") as f:
+        sample = f.read(65536)
+        f.seek(0)
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=",;\t")
+        except csv.Error:
+            dialect = csv.excel
+        rows = [_lower_keys(row) for row in csv.DictReader(f, dialect=dialect)]
+    if not rows:
+        raise ValueError("В файле нет строк")
+
+    geographic = _field(rows[0], "lon") is not None and _field(rows[0], "lat") is not None
+    if not geographic and (_field(rows[0], "x") is None or _field(rows[0], "y") is None):
+        raise ValueError("Нужны столбцы x и y или lon и lat")
+    network = _Network()
+    for number, row in enumerate(rows, 2):
+        try:
+            x = float(_field(row, "lon" if geographic else "x"))
+            y = float(_field(row, "lat" if geographic else "y"))
+        except (TypeError, ValueError):
+            raise ValueError(f"Строка {number}: нет координат станции") from None
+        name = _field(row, "name")
+        key = ("id", _field(row, "id")) if _field(row, "id") is not None else (name, x, y)
+        station_id = network.station(key, name, x, y, _field(row, "style"))
+        line_name = _field(row, "line")
+        if line_name is not None:
+            line = network.line(line_name, _field(row, "color"), _field(row, "width"))
+            network.add_to_line(line, station_id, _field(row, "order"))
+    return network.finish(), geographic
+
+
+def _coord_key(x, y):
+    return round(x, COORD_DIGITS), round(y, COORD_DIGITS)
+
+
+def read_geojson(file_path):
+    """Сеть из GeoJSON (см. описание модуля). Координаты GeoJSON всегда географические"""
+    with open(file_path, encoding="utf-8") as f:
+        data = json.load(f)
+    if data.get("type") == "FeatureCollection":
+        features = data.get("features", [])
+    elif data.get("type") == "Feature":
+        features = [data]
+    else:
+        raise ValueError("Ожидается FeatureCollection или Feature")
+
+    network = _Network()
+    points = {}  # координаты -> id станции
+    memberships = []  # (id станции, названия линий из свойств точки)
+    paths = []  # (свойства, список частей линии)
+    for feature in features:
+        geometry = feature.get("geometry") or {}
+        properties = _lower_keys(feature.get("properties") or {})
+        kind = geometry.get("type")
+        if kind == "Point":
+            x, y = geometry["coordinates"][:2]
+            key = _coord_key(x, y)
+            station_id = network.station(key, _field(properties, "name"), x, y, _field(properties, "style"))
+            points[key] = station_id
+            names = _field(properties, "lines") or []
+            if not isinstance(names, list):
+                names = str(names).split(",")
+            if _field(properties, "line") is not None:
+                names.insert(0, _field(properties, "line"))
+            names = [str(name).strip() for name in names]
+            memberships.append((station_id, names))
+        elif kind == "LineString":
+            paths.append((properties, [geometry["coordinates"]]))
+        elif kind == "MultiLineString":
+            paths.append((properties, geometry["coordinates"]))
+
+    for number, (properties, parts) in enumerate(paths, 1):
+        name = str(_field(properties, "name") or _field(properties, "line") or f"Линия {number}")
+        line = network.line(name, _field(properties, "color"), _field(properties, "width"))
+        vertices = [point[:2] for part in parts for point in part]
+        matched = [points[key] for key in (_coord_key(x, y) for x, y in vertices) if key in points]
+        if matched:
+            for station_id in matched:
+                network.add_to_line(line, station_id)
+        else:
+            for x, y in vertices:
+                network.add_to_line(line, network.station(_coord_key(x, y), None, x, y))
+
+    # Точки, отнесённые к линиям по названию, но не лежащие на их геометрии
+    for station_id, names in memberships:
+        for name in names:
+            line = network.line(name)
+            if station_id not in line["stations"]:
+                network.add_to_line(line, station_id)
+    return network.finish(), True
+
+
+def _mercator_y(lat):
+    lat = max(min(lat, 85.0511), -85.0511)
+    return math.degrees(math.log(math.tan(math.pi / 4 + math.radians(lat) / 2)))
+
+
+def project_network(network, projection="linear", size=DEFAULT_IMPORT_SIZE):
+    """Переводит координаты станций сети в координаты редактора (на месте).
+
+    mercator - долгота и широта в проекцию Меркатора, linear - спроецированные координаты как есть;
+    затем сеть вписывается в квадрат size x size с началом в нуле и с осью y вниз. none оставляет
+    координаты нетронутыми - для файлов, уже сохранённых в координатах редактора.
+    """
+    stations = network["stations"]
+    if projection == "none" or not stations:
+        return network
+    if projection == "mercator":
+        for station in stations:
+            station["y"] = _mercator_y(station["y"])
+    elif projection != "linear":
+        raise ValueError(f"Неизвестная проекция: {projection}")
+    xs = [station["x"] for station in stations]
+    ys = [station["y"] for station in stations]
+    span = max(max(xs) - min(xs), max(ys) - min(ys))
+    factor = size / span if span > 0 else 1.0
+    min_x, max_y = min(xs), max(ys)
+    for station in stations:
+        station["x"] = round((station["x"] - min_x) * factor, 2)
+        station["y"] = round((max_y - station["y"]) * factor, 2)
+    return network
+
+
+def read_network(file_path, projection="auto", size=DEFAULT_IMPORT_SIZE):
+    """Сеть из CSV или GeoJSON (по расширению) в координатах редактора.
+
+    При projection="auto" географические координаты идут в проекцию Меркатора, остальные - linear.
+    """
+    if projection not in PROJECTIONS:
+        raise ValueError(f"Неизвестная проекция: {projection}")
+    if os.path.splitext(file_path)[1].lower() == CSV_EXTENSION:
+        network, geographic = read_csv(file_path)
+    else:
+        network, geographic = read_geojson(file_path)
+    if projection == "auto":
+        projection = "mercator" if geographic else "linear"
+    return project_network(network, projection, size)
+
+
+def import_network(metro_map, file_path, projection="auto", size=DEFAULT_IMPORT_SIZE):
+    """Читает сеть из файла и добавляет её на карту; возвращает добавленные линии"""
+    network = read_network(file_path, projection, size)
+    return metro_map.add_network(network["lines"], network["stations"])
@@ -0,0 +1,223 @@
+"""Автосохранение и восстановление после сбоя.
+
+Пока редактор открыт, в папке автосохранения лежат снимок карты (snapshot-N.mmb) и журнал правок
+после него (journal-N.jsonl): по строке JSON на каждую операцию карты (см. описание model.py).
+Правка дописывает в журнал одну короткую строку, поэтому стоимость сохранения зависит от размера
+правки, а не карты. Журнал пишется в фоновом потоке и периодически сбрасывается на диск через
+fsync, а когда разрастается, тот же поток сворачивает его в новый снимок. Карта после сбоя - это
+последний снимок с применёнными к нему операциями журнала.
+"""
+import glob
+import json
+import os
+import queue
+import re
+import threading
+import time
+
+from .binary import write_binary
+from .model import MetroMap
+
+AUTOSAVE_DIR = os.path.join(os.path.expanduser("~"), ".metromap", "autosave")
+# Не реже чем раз в столько секунд записанное доходит до диска
+FSYNC_INTERVAL = 1.0
+# После стольких операций или байт журнал сворачивается в новый снимок
+COMPACT_OPS = 10000
+COMPACT_BYTES = 16 * 1024 * 1024
+
+SNAPSHOT_PATTERN = re.compile(r"snapshot-(\d+)\.mmb")
+
+
+def _snapshot_path(directory, generation):
+    return os.path.join(directory, f"snapshot-{generation}.mmb")
+
+
+def _journal_path(directory, generation):
+    return os.path.join(directory, f"journal-{generation}.jsonl")
+
+
+def latest_generation(directory=AUTOSAVE_DIR):
+    """Номер последнего полностью записанного снимка или None"""
+    generations = [int(match.group(1)) for match in map(SNAPSHOT_PATTERN.fullmatch, os.listdir(directory))
+                   if match] if os.path.isdir(directory) else []
+    return max(generations, default=None)
+
+
+def has_recovery(directory=AUTOSAVE_DIR):
+    """Остались ли от прошлого запуска данные для восстановления (при нормальном закрытии они удаляются)"""
+    return latest_generation(directory) is not None
+
+
+def replay(snapshot_path, journal_path, on_progress=None):
+    """Карта из снимка с применёнными операциями журнала.
+
+    Последняя строка журнала могла записаться не до конца, если процесс упал посреди записи, -
+    на ней воспроизведение останавливается.
+    """
+    metro_map = MetroMap.load(snapshot_path)
+    if not os.path.exists(journal_path):
+        return metro_map
+    total = os.path.getsize(journal_path)
+    done = 0
+    with open(journal_path, "rb") as f:
+        for number, line in enumerate(f):
+            done += len(line)
+            try:
+                op = json.loads(line)
+            except ValueError:
+                break
+            metro_map.apply(op)
+            if on_progress is not None and number % 1000 == 0:
+                on_progress(done / total)
+    return metro_map
+
+
+def recover(directory=AUTOSAVE_DIR, on_progress=None):
+    generation = latest_generation(directory)
+    if generation is None:
+        raise FileNotFoundError("Нет данных для восстановления")
+    return replay(_snapshot_path(directory, generation), _journal_path(directory, generation), on_progress)
+
+
+def discard(directory=AUTOSAVE_DIR, keep=None):
+    """Удаляет снимки и журналы всех поколений, кроме keep"""
+    for path in glob.glob(os.path.join(directory, "snapshot-*.mmb*")) + \
+            glob.glob(os.path.join(directory, "journal-*.jsonl")):
+        generation = re.search(r"-(\d+)\.", os.path.basename(path))
+        if keep is None or generation is None or int(generation.group(1)) != keep:
+            os.remove(path)
+
+
+class Journal:
+    """Фоновая запись журнала правок одной карты.
+
+    attach() подписывается на операции карты и начинает новое поколение со снимка; сами операции
+    только кладутся в очередь, всю работу с диском делает фоновый поток. Если запись на диск не
+    удалась, ошибка сохраняется в self.error и журнал перестаёт писаться.
+    """
+
+    def __init__(self, directory=AUTOSAVE_DIR, fsync_interval=FSYNC_INTERVAL, compact_ops=COMPACT_OPS,
+                 compact_bytes=COMPACT_BYTES):
+        self.directory = directory
+        self.fsync_interval = fsync_interval
+        self.compact_ops = compact_ops
+        self.compact_bytes = compact_bytes
+        self.map = None
+        self.error = None
+        self.queue = queue.Queue()
+        self.thread = None
+        self.generation = 0
+        self.compactions = 0
+
+    def attach(self, metro_map, data=None):
+        """Начинает журнал карты metro_map. data - её копия из MetroMap.snapshot(), если уже есть
+        (большую карту удобно скопировать заранее в фоновом потоке, где она загружалась)"""
+        if self.map is not None:
+            self.map.listeners.remove(self.on_op)
+        self.map = metro_map
+        metro_map.listeners.append(self.on_op)
+        self.queue.put(("reset", data if data is not None else metro_map.snapshot()))
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+
+    def on_op(self, op):
+        if self.error is None:
+            self.queue.put(("op", op))
+
+    def flush(self):
+        """Дожидается, пока всё записанное до этого момента окажется на диске"""
+        done = threading.Event()
+        self.queue.put(("flush", done))
+        while self.thread.is_alive() and not done.wait(0.1):
+            pass
+
+    def close(self, discard_files=False):
+        """Останавливает запись. discard_files - удалить автосохранение (при нормальном закрытии редактора)"""
+        if self.map is not None:
+            self.map.listeners.remove(self.on_op)
+            self.map = None
+        if self.thread is not None:
+            self.queue.put(("close", discard_files))
+            self.thread.join()
+            self.thread = None
+
+    def run(self):
+        journal = None
+        ops = 0
+        dirty = False
+        last_sync = time.monotonic()
+        while True:
+            try:
+                kind, payload = self.queue.get(timeout=self.fsync_interval)
+            except queue.Empty:
+                kind, payload = None, None
+            try:
+                if kind == "op" and journal is not None:
+                    journal.write(json.dumps(payload, ensure_ascii=False, separators=(",", ":")) + "\n")
+                    ops += 1
+                    dirty = True
+                elif kind == "reset":
+                    if journal is not None:
+                        journal.close()
+                    journal = self.start_generation(self.generation + 1, payload)
+                    ops = 0
+                elif kind == "flush":
+                    if journal is not None:
+                        self.sync(journal)
+                    payload.set()
+                elif kind == "close":
+                    if journal is not None:
+                        self.sync(journal)
+                        journal.close()
+                    if payload:
+                        discard(self.directory)
+                    return
+
+                if journal is None:
+                    continue
+                if self.queue.empty():
+                    # Из буфера Python - в систему: падение самого редактора уже ничего не потеряет
+                    journal.flush()
+                if dirty and time.monotonic() - last_sync >= self.fsync_interval:
+                    self.sync(journal)
+                    dirty = False
+                    last_sync = time.monotonic()
+                if ops >= self.compact_ops or journal.tell() >= self.compact_bytes:
+                    journal = self.compact(journal)
+                    ops = 0
+            except OSError as e:
+                self.error = e
+                if kind == "flush":
+                    payload.set()
+                if journal is not None:
+                    journal.close()
+                    journal = None
+
+    @staticmethod
+    def sync(journal):
+        journal.flush()
+        os.fsync(journal.fileno())
+
+    def start_generation(self, generation, data):
+        """Пишет снимок нового поколения, открывает его пустой журнал и удаляет старые поколения"""
+        os.makedirs(self.directory, exist_ok=True)
+        path = _snapshot_path(self.directory, generation)
+        # Снимок появляется под своим именем только целиком и уже на диске
+        write_binary(data, path + ".tmp")
+        with open(path + ".tmp", "rb+") as f:
+            os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+        journal = open(_journal_path(self.directory, generation), "w", encoding="utf-8")
+        self.generation = generation
+        discard(self.directory, keep=generation)
+        return journal
+
+    def compact(self, journal):
+        """Сворачивает журнал в новый снимок. Операции, пришедшие за это время, ждут в очереди"""
+        self.sync(journal)
+        journal.close()
+        metro_map = replay(_snapshot_path(self.directory, self.generation),
+                           _journal_path(self.directory, self.generation))
+        self.compactions += 1
+        return self.start_generation(self.generation + 1, metro_map.to_dict())
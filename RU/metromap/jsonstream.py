@@ -0,0 +1,165 @@
+"""Потоковое чтение и запись JSON-карты: файл обрабатывается по частям, станции и линии - по одной записи"""
+import codecs
+import json
+import os
+import re
+
+CHUNK_SIZE = 1 << 20
+# Массивы верхнего уровня, элементы которых разбираются и отдаются по одному
+STREAMED_KEYS = ("lines", "stations")
+
+_decoder = json.JSONDecoder()
+# Символы, которыми может продолжаться число; в корректном JSON сразу после числа их не бывает
+_NUMBER_CHARS = "0123456789.eE+-"
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+_SEPARATOR = re.compile(r"[ \t\n\r]*([,\]])[ \t\n\r]*")
+
+
+class _Reader:
+    def __init__(self, file, total, chunk_size, on_progress):
+        self.file = file
+        self.total = total
+        self.chunk_size = chunk_size
+        self.on_progress = on_progress
+        self.decoder = codecs.getincrementaldecoder("utf-8")()
+        self.buffer = ""
+        self.pos = 0
+        self.bytes_read = 0
+        self.eof = False
+        # json.load использует одни и те же строки ключей для всех объектов файла, а raw_decode - только
+        # в пределах одного вызова; общие ключи заметно экономят память на сотнях тысяч станций
+        self.keys = {}
+
+    def fill(self):
+        """Дочитывает следующую часть файла, отбрасывая уже разобранное начало буфера"""
+        data = self.file.read(self.chunk_size)
+        self.bytes_read += len(data)
+        self.eof = not data
+        self.buffer = self.buffer[self.pos:] + self.decoder.decode(data, final=self.eof)
+        self.pos = 0
+        if self.on_progress is not None and self.total:
+            self.on_progress(self.bytes_read / self.total)
+
+    def peek(self):
+        """Первый непробельный символ с текущей позиции ('' в конце файла)"""
+        while True:
+            self.pos = _WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer) or self.eof:
+                return self.buffer[self.pos:self.pos + 1]
+            self.fill()
+
+    def expect(self, chars):
+        char = self.peek()
+        if not char or char not in chars:
+            raise ValueError(f"Ожидался символ {' или '.join(chars)} в позиции {self.bytes_read}")
+        self.pos += 1
+        return char
+
+    def value(self):
+        """Следующее JSON-значение целиком"""
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+                self.fill()
+                continue
+            # Число на краю буфера могло оборваться ("1." или "1e") - дочитываем и разбираем заново
+            if not self.eof and (end == len(self.buffer) or self.buffer[end] in _NUMBER_CHARS):
+                self.fill()
+                continue
+            self.pos = end
+            return value
+
+    def records(self):
+        """Элементы массива до закрывающей скобки, со строками ключей, общими для всех записей.
+
+        Запись, за которой в буфере уже виден разделитель, разбирается напрямую; всё остальное
+        (край буфера, ошибки) уходит в медленный путь через value() и expect().
+        """
+        scan = _decoder.scan_once
+        keys = self.keys
+        self.peek()
+        while True:
+            try:
+                value, end = scan(self.buffer, self.pos)
+                match = _SEPARATOR.match(self.buffer, end)
+            except (StopIteration, json.JSONDecodeError):
+                match = None
+            if match is not None:
+                separator = match.group(1)
+                self.pos = match.end()
+            else:
+                value = self.value()
+                separator = self.expect(",]")
+                self.peek()
+            if type(value) is dict:
+                value = {keys.setdefault(key, key): item for key, item in value.items()}
+            yield value
+            if separator == "]":
+                return
+
+
+def iter_map_records(file_path, on_progress=None, chunk_size=CHUNK_SIZE):
+    """Разбирает JSON-карту по частям.
+
+    Выдаёт пары (ключ, значение): для "lines" и "stations" - по одной паре на каждый элемент массива,
+    для остальных полей верхнего уровня (scale, offset_x, ...) - их значения целиком.
+    on_progress получает долю прочитанного файла от 0 до 1.
+    """
+    with open(file_path, "rb") as f:
+        reader = _Reader(f, os.fstat(f.fileno()).st_size, chunk_size, on_progress)
+        reader.expect("{")
+        closed = reader.peek() == "}"
+        if closed:
+            reader.pos += 1
+        while not closed:
+            key = reader.value()
+            reader.expect(":")
+            if key in STREAMED_KEYS and reader.peek() == "[":
+                reader.expect("[")
+                if reader.peek() == "]":
+                    reader.pos += 1
+                else:
+                    for record in reader.records():
+                        yield key, record
+            else:
+                yield key, reader.value()
+            closed = reader.expect(",}") == "}"
+        # Как json.load, после карты ничего не принимаем: склеенный или испорченный файл не загрузится наполовину
+        if reader.peek():
+            raise ValueError(f"Лишние данные после конца карты в позиции {reader.bytes_read}")
+
+
+def _dumps_nested(value):
+    # Отступы как у json.dump(..., indent=2) для элемента массива внутри объекта верхнего уровня;
+    # станции карты (Station) пишутся как словари
+    return "    " + json.dumps(value, ensure_ascii=False, indent=2, default=dict).replace("\n", "\n    ")
+
+
+def write_map_records(data, file, on_progress=None):
+    """Пишет словарь карты в открытый текстовый файл так же, как json.dump(data, ensure_ascii=False, indent=2),
+    но по одной записи за раз, сообщая on_progress долю записанных станций и линий"""
+    total = sum(len(data[key]) for key in STREAMED_KEYS if isinstance(data.get(key), list))
+    written = 0
+    file.write("{")
+    for i, (key, value) in enumerate(data.items()):
+        file.write(",\n  " if i else "\n  ")
+        file.write(json.dumps(key, ensure_ascii=False) + ": ")
+        if key in STREAMED_KEYS and isinstance(value, list) and value:
+            file.write("[\n")
+            for j, item in enumerate(value):
+                if j:
+                    file.write(",\n")
+                file.write(_dumps_nested(item))
+                written += 1
+                if on_progress is not None and written % 1000 == 0:
+                    on_progress(written / total)
+            file.write("\n  ]")
+        else:
+            file.write(json.dumps(value, ensure_ascii=False, indent=2, default=dict).replace("\n", "\n  "))
+    file.write("\n}" if data else "}")
+    if on_progress is not None:
+        on_progress(1.0)
@@ -0,0 +1,105 @@
+"""Шрифт и кэш подписей станций: каждая подпись с обводкой рисуется один раз и затем переиспользуется"""
+import math
+import os
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+
+from PIL import Image, ImageChops, ImageDraw, ImageFont
+
+from .profiling import profiler
+
+FONT_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "assets", "Minecraft.ttf")
+FONT_SIZE = 10
+
+# Ниже этого масштаба (пикселей на единицу карты) подписи не рисуются ни в редакторе, ни на плитках:
+# они сливаются в сплошную массу, а их отрисовка стоит дороже всего остального
+LABELS_MIN_SCALE = 0.2
+
+# Смещения чёрных копий текста, из которых складывается обводка
+OUTLINE_OFFSETS = [(0, -1), (0, 1), (-1, 0), (1, 0)]
+
+
+@lru_cache(maxsize=None)
+def load_font(size=FONT_SIZE):
+    """Шрифт загружается один раз на процесс"""
+    return ImageFont.truetype(FONT_PATH, size)
+
+
+def render_label(text, size=FONT_SIZE, outline=True, frac_x=0.0, frac_y=0.0):
+    """Рисует подпись в RGBA-картинку.
+
+    Возвращает (картинка, ox, oy): точка привязки текста (середина по горизонтали, верх по линии
+    выносных элементов) находится в пикселе (ox, oy) картинки со сдвигом (frac_x, frac_y).
+    Толщина обводки растёт вместе с размером шрифта: пиксель на каждые FONT_SIZE пунктов.
+    """
+    font = load_font(size)
+    outline_width = max(1, round(size / FONT_SIZE))
+    left, top, right, bottom = font.getbbox(text, anchor="ma")
+    # Поля на обводку и на дробный сдвиг
+    margin = outline_width + 1
+    ox, oy = margin - left, margin - top
+    width, height = right - left + 2 * margin, bottom - top + 2 * margin
+
+    mask = Image.new("L", (width, height), 0)
+    ImageDraw.Draw(mask).text((ox + frac_x, oy + frac_y), text, fill=255, anchor="ma", font=font)
+
+    sprite = Image.new("RGBA", (width, height), (0, 0, 0, 0))
+    if outline:
+        black = Image.new("RGBA", (width, height), (0, 0, 0, 0))
+        for step in range(1, outline_width + 1):
+            for dx, dy in OUTLINE_OFFSETS:
+                black.putalpha(ImageChops.offset(mask, dx * step, dy * step))
+                sprite = Image.alpha_composite(sprite, black)
+        fill = (255, 255, 255, 0)
+    else:
+        fill = (0, 0, 0, 0)
+    top_layer = Image.new("RGBA", (width, height), fill)
+    top_layer.putalpha(mask)
+    return Image.alpha_composite(sprite, top_layer), ox, oy
+
+
+class LabelCache:
+    """Готовые картинки подписей по (текст, размер, обводка, дробный сдвиг).
+
+    Кэшем одновременно пользуются редактор и фоновый экспорт, поэтому операции с ним идут под замком.
+    """
+
+    def __init__(self, maxsize=8192):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, text, size=FONT_SIZE, outline=True, frac_x=0.0, frac_y=0.0):
+        # FreeType позиционирует текст с точностью до 1/64 пикселя
+        key = (text, size, outline, round(frac_x * 64) / 64, round(frac_y * 64) / 64)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.hits += 1
+                self.entries.move_to_end(key)
+                return entry
+            self.misses += 1
+
+        with profiler.phase("labels"):
+            entry = render_label(text, size, outline, key[3], key[4])
+        with self.lock:
+            self.entries[key] = entry
+            if len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+        return entry
+
+    def paste(self, img, text, x, y, size=FONT_SIZE, outline=True):
+        """Накладывает подпись на картинку так же, как draw.text(..., anchor="ma") в точке (x, y)"""
+        base_x, base_y = math.floor(x), math.floor(y)
+        sprite, ox, oy = self.get(text, size, outline, x - base_x, y - base_y)
+        img.paste(sprite, (base_x - ox, base_y - oy), sprite)
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "size": len(self.entries), "maxsize": self.maxsize}
+
+
+# Общий кэш процесса: им пользуются и экспорт, и редактор
+label_cache = LabelCache()
@@ -0,0 +1,582 @@
+"""Модель карты метро: линии, станции и индексы для быстрого поиска.
+
+Каждое изменение карты сообщается подписчикам из self.listeners компактной операцией - кортежем
+(вид, данные...), из которого можно восстановить и само изменение, и обратное ему:
+
+    ("add_station", строка, станция, [(id линии, позиция), ...]) и обратная ей "remove_station"
+    ("add_line", индекс, линия, [(строка, станция), ...], [(id линии, её станции до удаления), ...])
+        и обратная ей "remove_line" - вместе с линией удаляются её станции
+    ("move_station", id, старый x, старый y, новый x, новый y)
+    ("update_station", id, старые поля, новые поля) и ("update_line", id, старые поля, новые поля);
+        None среди старых значений означает, что поля не было
+
+Правки сразу многих станций записываются одной операцией на всю группу:
+
+    ("move_stations", [(id, старый x, старый y, новый x, новый y), ...])
+    ("update_stations", [(id, старые поля, новые поля), ...])
+    ("add_stations", [(строка, станция, [(id линии, позиция), ...]), ...]) и обратная ей "remove_stations";
+        строки - по возрастанию, позиции - в списках станций линий до удаления
+    ("set_line_stations", [(id линии, старые станции, новые станции), ...])
+
+Данные операций - копии, не связанные с картой, и состоят только из чисел, строк, списков и словарей
+со строковыми ключами, поэтому операция без потерь проходит через JSON (кортежи становятся списками).
+MetroMap.apply() повторяет операцию, invert_op() строит обратную (см. history.py).
+"""
+from .binary import is_binary_map, read_binary, write_binary
+from .geometry import DEFAULT_BEZIER_SAMPLES, image_points, line_path, np
+from .jsonstream import iter_map_records, write_map_records
+from .pathcache import PathCache
+from .spatial import SpatialGrid
+from .station import Station
+
+
+class MetroMap:
+    def __init__(self, lines=None, stations=None, scale=1.0, offset_x=0, offset_y=0):
+        self.lines = lines if lines is not None else []
+        # Станции хранятся компактными записями Station (см. station.py), а не словарями
+        self.stations = [s if type(s) is Station else Station(s) for s in stations] if stations is not None else []
+        # Вид, сохранённый вместе с картой (масштаб экспорта PNG зависит от него)
+        self.scale = scale
+        self.offset_x = offset_x
+        self.offset_y = offset_y
+
+        self.station_index = {}  # id станции -> станция
+        self.station_lines = {}  # id станции -> линии, на которых она есть
+        self.next_station_id = 1
+        self._coords = None  # координаты станций одним массивом, строятся по запросу
+        self._coord_rows = {}  # id станции -> строка в self._coords
+        self.spatial = SpatialGrid()  # для поиска станции под курсором
+
+        # Пути линий кэшируются по версии геометрии линии: версия меняется только при изменении
+        # состава станций линии, их координат или сглаживания
+        self.path_cache = PathCache()
+        self.line_versions = {}  # id линии -> версия геометрии
+        self._geometry_clock = 0
+        self._line_extents = {}  # id линии -> границы её пути, сбрасываются вместе с путями
+        # Подписчики на изменения карты: вызываются с каждой операцией (см. описание модуля)
+        self.listeners = []
+        self.rebuild_index()
+
+    def rebuild_index(self):
+        """Перестраивает индексы станций по текущим self.stations и self.lines"""
+        self.station_index = {}
+        self.station_lines = {}
+        self.spatial = SpatialGrid(self.spatial.cell_size)
+        for station in self.stations:
+            self._index_station(station)
+        for line in self.lines:
+            self._index_line(line)
+        self._finish_index()
+
+    def _index_station(self, station):
+        self.station_index[station.id] = station
+        self.station_lines.setdefault(station.id, [])
+        self.spatial.insert(station.id, station.x, station.y)
+
+    def _index_line(self, line):
+        # Линия может прийти раньше своих станций - список для станции заводится заранее
+        for station_id in line["stations"]:
+            lines = self.station_lines.setdefault(station_id, [])
+            if not lines or lines[-1] is not line:
+                lines.append(line)
+
+    def _finish_index(self):
+        self.next_station_id = max(self.station_index, default=0) + 1
+        self._coords = None
+        for line in self.lines:
+            self.touch_line(line)
+
+    def touch_line(self, line):
+        """Отмечает, что геометрия линии изменилась и её закэшированные пути устарели"""
+        self._geometry_clock += 1
+        self.line_versions[line["id"]] = self._geometry_clock
+        self.path_cache.invalidate(line["id"])
+        self._line_extents.pop(line["id"], None)
+
+    def _record(self, op):
+        for listener in self.listeners:
+            listener(op)
+
+    def get_station(self, station_id):
+        return self.station_index[station_id]
+
+    def get_line(self, line_id):
+        return next(line for line in self.lines if line["id"] == line_id)
+
+    def station_at(self, x, y, radius):
+        """Ближайшая к точке станция на расстоянии меньше radius (в координатах карты) или None"""
+        station_id = self.spatial.nearest(x, y, radius)
+        return self.station_index[station_id] if station_id is not None else None
+
+    def station_line_width(self, station_id):
+        """Толщина первой линии, проходящей через станцию (от неё зависит размер значка)"""
+        station_lines = self.station_lines.get(station_id)
+        return station_lines[0]["width"] if station_lines else 2
+
+    def station_coords(self):
+        """Координаты всех станций в порядке self.stations одним непрерывным массивом (NumPy, если он есть)"""
+        if self._coords is None:
+            coords = [c for s in self.stations for c in (s.x, s.y)]
+            self._coords = np.array(coords, dtype=float).reshape(-1, 2) if np is not None else coords
+            self._coord_rows = {s.id: row for row, s in enumerate(self.stations)}
+        return self._coords
+
+    def move_station(self, station, x, y):
+        if self.listeners:
+            self._record(("move_station", station.id, station.x, station.y, x, y))
+        station.x = x
+        station.y = y
+        self.spatial.move(station.id, x, y)
+        if self._coords is not None:
+            row = self._coord_rows[station.id]
+            if np is not None:
+                self._coords[row] = (x, y)
+            else:
+                self._coords[2 * row:2 * row + 2] = (x, y)
+        for line in self.station_lines.get(station.id, ()):
+            self.touch_line(line)
+
+    def move_stations(self, moves):
+        """Перемещает сразу много станций по списку [(станция, x, y), ...] одной операцией.
+
+        Каждая затронутая линия помечается изменённой один раз, а не по разу на свою станцию.
+        """
+        if self.listeners:
+            self._record(("move_stations", [(station.id, station.x, station.y, x, y) for station, x, y in moves]))
+        lines = {}
+        for station, x, y in moves:
+            station.x = x
+            station.y = y
+            self.spatial.move(station.id, x, y)
+            for line in self.station_lines.get(station.id, ()):
+                lines[line["id"]] = line
+        # Массив координат дешевле построить заново при следующем запросе, чем править по строке
+        self._coords = None
+        for line in lines.values():
+            self.touch_line(line)
+
+    def line_points(self, line):
+        """Координаты станций линии плоским списком [x0, y0, x1, y1, ...]"""
+        return [c for station in map(self.get_station, line["stations"]) for c in (station.x, station.y)]
+
+    def line_path(self, line, samples=DEFAULT_BEZIER_SAMPLES, grid=None):
+        """Путь линии в координатах карты из кэша.
+
+        Если задан grid, точки станций сначала округляются вниз по сетке с таким шагом (как при экспорте PNG),
+        и путь строится в единицах этой сетки.
+        """
+        if line["smoothing"] != "smooth":
+            samples = None  # от плотности зависят только кривые Безье
+        key = (line["id"], self.line_versions[line["id"]], line["smoothing"], samples, grid)
+
+        def compute():
+            points = self.line_points(line)
+            if grid is not None:
+                points = image_points(points, grid, 0, 0)
+            return line_path(points, line["smoothing"], samples)
+
+        return self.path_cache.get(key, compute, line["id"])
+
+    def line_extent(self, line, samples=DEFAULT_BEZIER_SAMPLES):
+        """Границы пути линии (x0, y0, x1, y1) в координатах карты, или None, если пути нет.
+
+        Хранятся отдельно от путей и не вытесняются: по ним отбрасываются линии вне видимой области,
+        не доставая из кэша их пути. От samples границы кривых почти не зависят, поэтому берутся один раз.
+        """
+        extent = self._line_extents.get(line["id"])
+        if extent is None:
+            path = self.line_path(line, samples)
+            if len(path) < 2:
+                return None
+            extent = self._line_extents[line["id"]] = (min(path[0::2]), min(path[1::2]), max(path[0::2]),
+                                                       max(path[1::2]))
+        return extent
+
+    def set_line_style(self, line, width, smoothing):
+        self.update_line(line, width=width, smoothing=smoothing)
+
+    def update_line(self, line, **fields):
+        """Меняет поля линии (цвет, толщину, сглаживание, название)"""
+        if "smoothing" in self._update(line, "update_line", fields):
+            self.touch_line(line)
+
+    def update_station(self, station, **fields):
+        """Меняет поля станции, кроме координат (для них - move_station)"""
+        self._update(station, "update_station", fields)
+
+    def update_stations(self, changes):
+        """Меняет поля многих станций одной операцией: changes - [(станция, {поле: значение}), ...]"""
+        records = []
+        for station, fields in changes:
+            old = {key: station.get(key) for key in fields}
+            fields = {key: value for key, value in fields.items() if old[key] != value}
+            if not fields:
+                continue
+            records.append((station.id, {key: old[key] for key in fields}, fields))
+            for key, value in fields.items():
+                if value is None:
+                    station.pop(key, None)
+                else:
+                    station[key] = value
+        if records:
+            self._record(("update_stations", records))
+
+    def _update(self, item, kind, fields):
+        old = {key: item.get(key) for key in fields}
+        fields = {key: value for key, value in fields.items() if old[key] != value}
+        if fields:
+            self._record((kind, item["id"], {key: old[key] for key in fields}, fields))
+        for key, value in fields.items():
+            if value is None:
+                item.pop(key, None)
+            else:
+                item[key] = value
+        return fields
+
+    def add_line(self, color, width, smoothing):
+        line_id = max((line["id"] for line in self.lines), default=0) + 1
+        line = {
+            "id": line_id,
+            "name": f"Линия {line_id}",
+            "color": color,
+            "width": width,
+            "smoothing": smoothing,
+            "stations": []
+        }
+        self.insert_line(len(self.lines), line)
+        return self.lines[-1]
+
+    def insert_line(self, index, line, stations=(), other_lines=()):
+        """Вставляет копию линии на место index вместе со станциями [(строка, станция), ...] (по возрастанию
+        строк) и возвращает другим линиям прежние списки станций [(id линии, станции), ...] - обратное
+        к remove_line"""
+        line = dict(line, stations=list(line["stations"]))
+        stations = [(row, dict(station)) for row, station in stations]
+        other_lines = [(line_id, list(station_ids)) for line_id, station_ids in other_lines]
+        self._record(("add_line", index, dict(line, stations=list(line["stations"])), stations, other_lines))
+        stations = [(row, Station(station)) for row, station in stations]
+
+        self.lines.insert(index, line)
+        if not other_lines and (not stations or index == len(self.lines) - 1 and
+                                [row for row, _ in stations] == list(range(len(self.stations),
+                                                                           len(self.stations) + len(stations)))):
+            # Линия и её станции дописываются в конец: индексы дополняются, а не строятся заново
+            for _, station in stations:
+                self.stations.append(station)
+                self._index_station(station)
+                self.next_station_id = max(self.next_station_id, station.id + 1)
+            self._index_line(line)
+            self.touch_line(line)
+            if stations:
+                self._coords = None
+            return
+        # Станции встают на прежние строки одним проходом по списку
+        merged = []
+        rest = iter(self.stations)
+        for row, station in stations:
+            while len(merged) < row:
+                merged.append(next(rest))
+            merged.append(station)
+        merged.extend(rest)
+        self.stations = merged
+        for line_id, station_ids in other_lines:
+            self.get_line(line_id)["stations"] = list(station_ids)
+        self.rebuild_index()
+
+    def add_network(self, lines, stations):
+        """Добавляет в конец карты сразу много станций и линий и возвращает добавленные линии.
+
+        stations - словари станций, lines - словари линий, в "stations" которых перечислены id из stations;
+        эти id временные, карта выдаёт станциям и линиям свои. Каждая линия добавляется одной операцией
+        add_line вместе со станциями, которых ещё нет на карте, а индексы дополняются, не перестраиваясь.
+        """
+        by_id = {station["id"]: station for station in stations}
+        station_ids = {}  # временный id -> id на карте
+        first_id = self.next_station_id
+        next_line_id = max((line["id"] for line in self.lines), default=0) + 1
+        added = []
+        for line in lines:
+            new_stations = []
+            for station_id in line["stations"]:
+                if station_id not in station_ids:
+                    station_ids[station_id] = first_id + len(station_ids)
+                    new_stations.append(station_id)
+            first_row = len(self.stations)
+            rows = [(first_row + i, dict(by_id[station_id], id=station_ids[station_id]))
+                    for i, station_id in enumerate(new_stations)]
+            line = dict(line, id=next_line_id, stations=[station_ids[s] for s in line["stations"]])
+            next_line_id += 1
+            self.insert_line(len(self.lines), line, rows)
+            added.append(self.lines[-1])
+        # Станции вне линий
+        for station in stations:
+            if station["id"] not in station_ids:
+                station_ids[station["id"]] = first_id + len(station_ids)
+                self.insert_station(len(self.stations), dict(station, id=station_ids[station["id"]]), [])
+        return added
+
+    def add_station(self, line, x, y, style):
+        station_id = self.next_station_id
+        station = {
+            "id": station_id,
+            "name": f"Станция {station_id}",
+            "x": x,
+            "y": y,
+            "style": style
+        }
+        return self.insert_station(len(self.stations), station, [(line["id"], len(line["stations"]))])
+
+    def insert_station(self, row, station, memberships):
+        """Вставляет копию станции в строку row и в линии по списку [(id линии, позиция), ...] -
+        обратное к remove_station"""
+        station = Station(station)
+        station_id = station.id
+        self._record(("add_station", row, dict(station), list(memberships)))
+
+        self.stations.insert(row, station)
+        self.station_index[station_id] = station
+        self.next_station_id = max(self.next_station_id, station_id + 1)
+        self.station_lines.setdefault(station_id, [])
+        ranks = self._line_ranks() if memberships else None
+        for line_id, position in memberships:
+            line = self.get_line(line_id)
+            line["stations"].insert(position, station_id)
+            self._link(station_id, line, ranks)
+            self.touch_line(line)
+        self.spatial.insert(station_id, station.x, station.y)
+        self._coords = None
+        return station
+
+    def remove_station(self, station_id):
+        """Удаляет станцию со всех линий и из карты, возвращает затронутые линии"""
+        lines = self.station_lines.pop(station_id, [])
+        station = self.station_index.pop(station_id)
+        if self.listeners:
+            memberships = [(line["id"], position) for line in lines
+                           for position, s in enumerate(line["stations"]) if s == station_id]
+            self._record(("remove_station", self.stations.index(station), dict(station), memberships))
+
+        for line in lines:
+            line["stations"] = [s for s in line["stations"] if s != station_id]
+            self.touch_line(line)
+
+        self.stations.remove(station)
+        self.spatial.remove(station_id)
+        self._coords = None
+        return lines
+
+    def remove_stations(self, station_ids):
+        """Удаляет сразу много станций одной операцией и возвращает затронутые линии.
+
+        Список станций карты и список каждой затронутой линии проходятся по одному разу,
+        сколько бы станций ни удалялось.
+        """
+        station_ids = set(station_ids)
+        lines = {}
+        for station_id in station_ids:
+            for line in self.station_lines.pop(station_id, ()):
+                lines[line["id"]] = line
+        if self.listeners:
+            memberships = {}
+            for line in lines.values():
+                for position, s in enumerate(line["stations"]):
+                    if s in station_ids:
+                        memberships.setdefault(s, []).append((line["id"], position))
+            self._record(("remove_stations", [(row, dict(s), memberships.get(s.id, []))
+                                              for row, s in enumerate(self.stations) if s.id in station_ids]))
+
+        for line in lines.values():
+            line["stations"] = [s for s in line["stations"] if s not in station_ids]
+            self.touch_line(line)
+        self.stations = [s for s in self.stations if s.id not in station_ids]
+        for station_id in station_ids:
+            del self.station_index[station_id]
+            self.spatial.remove(station_id)
+        self._coords = None
+        return list(lines.values())
+
+    def insert_stations(self, entries):
+        """Вставляет копии станций по списку [(строка, станция, [(id линии, позиция), ...]), ...]
+        (по возрастанию строк) - обратное к remove_stations"""
+        entries = [(row, dict(station), list(memberships)) for row, station, memberships in entries]
+        self._record(("add_stations", entries))
+
+        # Станции встают на прежние строки одним проходом по списку
+        merged = []
+        rest = iter(self.stations)
+        inserts = {}  # id линии -> [(позиция, id станции), ...]
+        for row, station, memberships in entries:
+            while len(merged) < row:
+                merged.append(next(rest))
+            station = Station(station)
+            merged.append(station)
+            self._index_station(station)
+            self.next_station_id = max(self.next_station_id, station.id + 1)
+            for line_id, position in memberships:
+                inserts.setdefault(line_id, []).append((position, station.id))
+        merged.extend(rest)
+        self.stations = merged
+
+        # Позиции записаны в итоговых списках линий, поэтому вставляются по возрастанию
+        ranks = self._line_ranks()
+        for line_id, positions in inserts.items():
+            line = self.get_line(line_id)
+            for position, station_id in sorted(positions):
+                line["stations"].insert(position, station_id)
+                self._link(station_id, line, ranks)
+            self.touch_line(line)
+        self._coords = None
+
+    def set_line_stations(self, changes):
+        """Заменяет списки станций линий одной операцией: changes - [(линия, новые id станций), ...]"""
+        changes = [(line, list(station_ids)) for line, station_ids in changes if line["stations"] != station_ids]
+        if not changes:
+            return
+        self._record(("set_line_stations", [(line["id"], list(line["stations"]), list(station_ids))
+                                            for line, station_ids in changes]))
+        ranks = self._line_ranks()
+        for line, station_ids in changes:
+            for station_id in set(line["stations"]).difference(station_ids):
+                self.station_lines[station_id] = [other for other in self.station_lines[station_id]
+                                                  if other is not line]
+            line["stations"] = station_ids
+            for station_id in station_ids:
+                self._link(station_id, line, ranks)
+            self.touch_line(line)
+
+    def _line_ranks(self):
+        """Номер каждой линии в self.lines по id() словаря линии"""
+        return {id(line): i for i, line in enumerate(self.lines)}
+
+    def _link(self, station_id, line, ranks):
+        """Отмечает, что станция есть на линии. Линии станции идут в порядке self.lines, как после
+        rebuild_index(): от первой из них зависит размер значка"""
+        lines = self.station_lines.setdefault(station_id, [])
+        if any(other is line for other in lines):
+            return
+        rank = ranks[id(line)]
+        position = len(lines)
+        while position and ranks[id(lines[position - 1])] > rank:
+            position -= 1
+        lines.insert(position, line)
+
+    def relink_stations(self, station_ids, target):
+        """Переносит станции на линию target: со всех прочих линий они убираются, а на target
+        дописываются в конец в порядке station_ids (те, что уже на ней, остаются на месте)"""
+        moved = set(station_ids)
+        changes = []
+        for line in self.lines:
+            if line is target:
+                present = set(line["stations"])
+                changes.append((line, line["stations"] + [s for s in station_ids if s not in present]))
+            elif not moved.isdisjoint(line["stations"]):
+                changes.append((line, [s for s in line["stations"] if s not in moved]))
+        self.set_line_stations(changes)
+
+    def remove_line(self, line_index):
+        """Удаляет линию вместе с её станциями (в том числе с пересекающихся линий)"""
+        removed_line = self.lines[line_index]
+        station_ids = set(removed_line["stations"])
+        if self.listeners:
+            stations = [(row, dict(s)) for row, s in enumerate(self.stations) if s.id in station_ids]
+            other_lines = [(line["id"], list(line["stations"])) for line in self.lines
+                           if line is not removed_line and any(s in station_ids for s in line["stations"])]
+            self._record(("remove_line", line_index, dict(removed_line, stations=list(removed_line["stations"])),
+                          stations, other_lines))
+        self.stations = [s for s in self.stations if s.id not in station_ids]
+
+        del self.lines[line_index]
+        for line in self.lines:
+            if any(station_id in station_ids for station_id in line["stations"]):
+                line["stations"] = [s for s in line["stations"] if s not in station_ids]
+        self.rebuild_index()
+
+    def apply(self, op):
+        """Выполняет операцию из тех, что получают подписчики self.listeners"""
+        kind = op[0]
+        if kind == "add_station":
+            self.insert_station(op[1], op[2], op[3])
+        elif kind == "remove_station":
+            self.remove_station(op[2]["id"])
+        elif kind == "add_line":
+            self.insert_line(op[1], op[2], op[3], op[4])
+        elif kind == "remove_line":
+            self.remove_line(op[1])
+        elif kind == "move_station":
+            self.move_station(self.get_station(op[1]), op[4], op[5])
+        elif kind == "update_station":
+            self.update_station(self.get_station(op[1]), **op[3])
+        elif kind == "update_line":
+            self.update_line(self.get_line(op[1]), **op[3])
+        elif kind == "move_stations":
+            self.move_stations([(self.get_station(m[0]), m[3], m[4]) for m in op[1]])
+        elif kind == "update_stations":
+            self.update_stations([(self.get_station(station_id), new) for station_id, _, new in op[1]])
+        elif kind == "add_stations":
+            self.insert_stations(op[1])
+        elif kind == "remove_stations":
+            self.remove_stations([station["id"] for _, station, _ in op[1]])
+        elif kind == "set_line_stations":
+            self.set_line_stations([(self.get_line(line_id), new) for line_id, _, new in op[1]])
+        else:
+            raise ValueError(f"Неизвестная операция: {kind}")
+
+    def snapshot(self):
+        """Независимая копия данных карты в формате to_dict(). Её можно отдать фоновому потоку, пока
+        редактор меняет оригинал; индексы для копии строит уже сам поток через from_dict"""
+        data = self.to_dict()
+        data["lines"] = [dict(line, stations=list(line["stations"])) for line in self.lines]
+        data["stations"] = [dict(station) for station in self.stations]
+        return data
+
+    def to_dict(self):
+        return {
+            "lines": self.lines,
+            "stations": self.stations,
+            "scale": self.scale,
+            "offset_x": self.offset_x,
+            "offset_y": self.offset_y
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data.get("lines", []), data.get("stations", []), data.get("scale", 1.0),
+                   data.get("offset_x", 0), data.get("offset_y", 0))
+
+    @classmethod
+    def from_records(cls, records):
+        """Собирает карту из потока пар (ключ, значение) от iter_map_records, наполняя индексы по мере
+        поступления станций и линий"""
+        metro_map = cls()
+        for key, value in records:
+            if key == "stations":
+                value = Station(value)
+                metro_map.stations.append(value)
+                metro_map._index_station(value)
+            elif key == "lines":
+                metro_map.lines.append(value)
+                metro_map._index_line(value)
+            elif key in ("scale", "offset_x", "offset_y"):
+                setattr(metro_map, key, value)
+        metro_map._finish_index()
+        return metro_map
+
+    @classmethod
+    def load(cls, file_path, on_progress=None):
+        """Загружает карту из JSON или из двоичного файла - формат определяется по содержимому.
+
+        JSON читается потоково, on_progress получает долю прочитанного файла.
+        """
+        if is_binary_map(file_path):
+            metro_map = cls.from_dict(read_binary(file_path))
+            if on_progress is not None:
+                on_progress(1.0)
+            return metro_map
+        return cls.from_records(iter_map_records(file_path, on_progress))
+
+    def save(self, file_path, on_progress=None):
+        with open(file_path, "w", encoding="utf-8") as f:
+            write_map_records(self.to_dict(), f, on_progress)
+
+    def save_binary(self, file_path):
+        write_binary(self.to_dict(), file_path)
@@ -0,0 +1,46 @@
+"""Кэш путей линий с вытеснением давно не использованных записей"""
+from collections import OrderedDict
+
+
+class PathCache:
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()  # ключ -> (группа, путь)
+        self.groups = {}  # группа (id линии) -> ключи её записей
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, compute, group=None):
+        """Возвращает путь по ключу, вычисляя его через compute() при промахе"""
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return entry[1]
+
+        self.misses += 1
+        path = compute()
+        self.entries[key] = (group, path)
+        self.groups.setdefault(group, set()).add(key)
+        if len(self.entries) > self.maxsize:
+            old_key, (old_group, _) = self.entries.popitem(last=False)
+            self._forget(old_group, old_key)
+        return path
+
+    def invalidate(self, group):
+        """Сразу удаляет все записи группы, чтобы устаревшие пути не занимали память до вытеснения"""
+        for key in self.groups.pop(group, ()):
+            del self.entries[key]
+
+    def _forget(self, group, key):
+        keys = self.groups[group]
+        keys.discard(key)
+        if not keys:
+            del self.groups[group]
+
+    def clear(self):
+        self.entries.clear()
+        self.groups.clear()
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "size": len(self.entries), "maxsize": self.maxsize}
@@ -0,0 +1,41 @@
+"""Потоковая запись PNG: картинка пишется полосами, не собираясь в памяти целиком"""
+import struct
+import zlib
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+class PngStreamWriter:
+    def __init__(self, file, width, height, compress_level=6):
+        self.file = file
+        self.width = width
+        self.height = height
+        self.rows_written = 0
+        self.compressor = zlib.compressobj(compress_level)
+
+        self.file.write(PNG_SIGNATURE)
+        # 8 бит на канал, RGB, без чересстрочности
+        self._write_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+
+    def _write_chunk(self, chunk_type, data):
+        self.file.write(struct.pack(">I", len(data)))
+        self.file.write(chunk_type)
+        self.file.write(data)
+        self.file.write(struct.pack(">I", zlib.crc32(data, zlib.crc32(chunk_type)) & 0xFFFFFFFF))
+
+    def write_rows(self, img):
+        """Дописывает строки RGB-картинки шириной self.width"""
+        stride = self.width * 3
+        raw = img.tobytes()
+        # Каждая строка PNG начинается с байта фильтра (0 - без фильтра)
+        rows = b"".join(b"\x00" + raw[i:i + stride] for i in range(0, len(raw), stride))
+        data = self.compressor.compress(rows)
+        if data:
+            self._write_chunk(b"IDAT", data)
+        self.rows_written += img.height
+
+    def close(self):
+        if self.rows_written != self.height:
+            raise ValueError(f"Записано {self.rows_written} строк из {self.height}")
+        self._write_chunk(b"IDAT", self.compressor.flush())
+        self._write_chunk(b"IEND", b"")
@@ -0,0 +1,158 @@
+"""Замеры отрисовки по фазам: сколько времени уходит на пути линий, станции, подписи, запись файла.
+
+Профилировщик включается явно (profiler.enable()); выключенный, он отвечает на каждую точку замера
+одной проверкой флага и общим пустым контекстом, поэтому замеры можно оставлять в горячем коде.
+Замер верхнего уровня - кадр (frame): фазы и счётчики внутри него складываются в разбивку
+последнего кадра, а все отрезки времени копятся в ограниченной очереди событий и сохраняются в
+формате Chrome Trace Event, который открывают chrome://tracing, Perfetto (ui.perfetto.dev) и speedscope.
+"""
+import json
+import os
+import threading
+import time
+from collections import deque
+
+# Сколько последних отрезков времени держать для трассы; старые вытесняются
+MAX_EVENTS = 200000
+
+
+class _NullSpan:
+    """Замер выключенного профилировщика: ничего не делает"""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ("profiler", "name", "frame", "caches", "started")
+
+    def __init__(self, profiler, name, frame, caches=None):
+        self.profiler = profiler
+        self.name = name
+        self.frame = frame  # разбивка кадра, которую открыл этот замер, или None для фазы
+        self.caches = caches
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler._finish(self, time.perf_counter())
+        return False
+
+
+class Profiler:
+    """Собирает время фаз, число созданных элементов и обращений к кэшам.
+
+    Кадры разных потоков не смешиваются: фоновый экспорт и перерисовка редактора собирают
+    каждый свою разбивку, а в трассе оказываются на разных дорожках.
+    """
+
+    def __init__(self, max_events=MAX_EVENTS):
+        self.enabled = False
+        self.events = deque(maxlen=max_events)
+        self.last_frames = {}  # имя кадра -> разбивка последнего такого кадра
+        self.thread_names = {}
+        self.origin = time.perf_counter()
+        self.local = threading.local()
+
+    def enable(self, enabled=True):
+        self.enabled = enabled
+
+    def clear(self):
+        self.events.clear()
+        self.last_frames.clear()
+
+    def frame(self, name, caches=None):
+        """Замер кадра - перерисовки или экспорта целиком.
+
+        caches - словарь имя -> кэш со stats(): в разбивку попадут его попадания и промахи за кадр.
+        Кадр внутри другого кадра того же потока считается его фазой.
+        """
+        if not self.enabled:
+            return NULL_SPAN
+        if getattr(self.local, "frame", None) is not None:
+            return _Span(self, name, None)
+        frame = {"name": name, "seconds": 0.0, "phases": {}, "counts": {}}
+        if caches:
+            caches = {key: (cache, cache.stats()) for key, cache in caches.items()}
+        self.local.frame = frame
+        return _Span(self, name, frame, caches)
+
+    def phase(self, name):
+        """Замер фазы текущего кадра; время одноимённых фаз за кадр складывается"""
+        if not self.enabled:
+            return NULL_SPAN
+        return _Span(self, name, None)
+
+    def count(self, name, n=1):
+        """Прибавляет n к счётчику текущего кадра. В циклах по станциям лучше считать сразу пачку"""
+        if not self.enabled:
+            return
+        frame = getattr(self.local, "frame", None)
+        if frame is not None:
+            frame["counts"][name] = frame["counts"].get(name, 0) + n
+
+    def _finish(self, span, finished):
+        duration = finished - span.started
+        tid = threading.get_ident()
+        if tid not in self.thread_names:
+            self.thread_names[tid] = threading.current_thread().name
+        event = {"name": span.name, "ph": "X", "ts": (span.started - self.origin) * 1e6, "dur": duration * 1e6,
+                 "pid": os.getpid(), "tid": tid}
+
+        frame = span.frame
+        if frame is None:
+            current = getattr(self.local, "frame", None)
+            if current is not None:
+                current["phases"][span.name] = current["phases"].get(span.name, 0.0) + duration
+            self.events.append(event)
+            return
+
+        self.local.frame = None
+        if span.caches:
+            for key, (cache, before) in span.caches.items():
+                after = cache.stats()
+                frame["counts"][key + " hits"] = after["hits"] - before["hits"]
+                frame["counts"][key + " misses"] = after["misses"] - before["misses"]
+        frame["seconds"] = duration
+        event["args"] = dict(frame["counts"])
+        self.events.append(event)
+        self.events.append({"name": span.name, "ph": "C", "ts": event["ts"], "pid": event["pid"], "tid": tid,
+                            "args": dict(frame["counts"])})
+        self.last_frames[span.name] = frame
+
+    def last_frame(self, name):
+        return self.last_frames.get(name)
+
+    def trace(self):
+        """События в формате Chrome Trace Event"""
+        pid = os.getpid()
+        names = [{"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}}
+                 for tid, name in list(self.thread_names.items())]
+        return {"traceEvents": names + list(self.events), "displayTimeUnit": "ms"}
+
+    def export_trace(self, file_path):
+        with open(file_path, "w", encoding="utf-8") as f:
+            json.dump(self.trace(), f, ensure_ascii=False)
+
+
+def format_frame(frame):
+    """Разбивка кадра текстом: время фаз по убыванию, затем счётчики"""
+    lines = [f"{frame['name']}: {frame['seconds'] * 1000:.1f} мс"]
+    for name, seconds in sorted(frame["phases"].items(), key=lambda item: -item[1]):
+        lines.append(f"  {name}: {seconds * 1000:.1f} мс")
+    for name, value in frame["counts"].items():
+        lines.append(f"  {name}: {value}")
+    return "\n".join(lines)
+
+
+# Общий профилировщик процесса: им пользуются и редактор, и экспорт
+profiler = Profiler()
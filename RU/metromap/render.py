@@ -0,0 +1,377 @@
+"""Отрисовка карты в картинку средствами Pillow, без графического интерфейса"""
+import math
+import os
+from contextlib import contextmanager
+
+from PIL import Image, ImageDraw
+
+from .geometry import (bezier_samples, image_points, simplify_path, station_size_mult, transform_points,
+                       visible_runs)
+from .labels import FONT_SIZE, label_cache
+from .png import PngStreamWriter
+from .profiling import profiler
+
+# Картинки больше этого числа пикселей экспортируются полосами
+MAX_FULL_IMAGE_PIXELS = 64 * 1024 * 1024
+DEFAULT_TILE_SIZE = 1024
+# При таком разрешении единица карты при масштабе 1 - ровно один пиксель, как в редакторе
+BASE_DPI = 96
+# Как часто (в станциях) сообщать о ходе отрисовки и проверять отмену
+PROGRESS_EVERY = 1000
+# Запас вокруг видимой области редактора в пикселях: значки и подписи станций за краем заходят внутрь
+VIEW_MARGIN = 128
+
+
+class ExportCancelled(Exception):
+    """Экспорт остановлен по запросу пользователя"""
+
+
+def _checkpoint(on_progress, cancelled, fraction):
+    if cancelled is not None and cancelled():
+        raise ExportCancelled("Экспорт отменён")
+    if on_progress is not None:
+        on_progress(fraction)
+
+
+@contextmanager
+def _atomic_output(file_path):
+    """Путь временного файла рядом с file_path, который по успешном выходе встаёт на место file_path.
+
+    При любой ошибке или отмене временный файл удаляется: на месте file_path не остаётся
+    недописанной картинки, а прежний файл, если он был, не портится.
+    """
+    temp_path = file_path + ".tmp"
+    try:
+        yield temp_path
+        os.replace(temp_path, file_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def map_bounds(metro_map, scale=None, padding=40):
+    """Размер картинки карты: (единиц мира на пиксель, min_x, min_y, ширина, высота)"""
+    size = 1 / (scale if scale is not None else metro_map.scale)
+
+    if not metro_map.stations:
+        raise ValueError("Нет станций для экспорта")
+
+    all_points = image_points(metro_map.station_coords(), size, 0, 0)
+    min_x = min(all_points[0::2]) - padding
+    max_x = max(all_points[0::2]) + padding
+    min_y = min(all_points[1::2]) - padding
+    max_y = max(all_points[1::2]) + padding
+
+    return size, min_x, min_y, int(max_x - min_x), int(max_y - min_y)
+
+
+def resolve_resolution(metro_map, scale=None, dpi=None, width=None, padding=40):
+    """Масштаб карты и плотность пикселей (pixel_ratio) для экспорта.
+
+    Без dpi и width картинка, как и раньше, повторяет масштаб редактора. С ними размер не зависит
+    от масштаба на экране: по умолчанию единица карты - пиксель при BASE_DPI, а dpi или ширина
+    картинки в пикселях задают, во сколько раз крупнее рисуется всё, включая толщину линий, значки
+    и подписи. Ровно ту ширину, что запрошена, картинке даёт canvas_geometry(..., width=width).
+    """
+    if dpi is None and width is None:
+        return scale, 1.0
+    if scale is None:
+        scale = 1.0
+    if width is not None:
+        logical_width = map_bounds(metro_map, scale, padding)[3]
+        return scale, width / logical_width
+    return scale, dpi / BASE_DPI
+
+
+def canvas_geometry(metro_map, scale=None, padding=40, pixel_ratio=1.0, antialias=1, width=None):
+    """Геометрия холста для отрисовки в antialias раз крупнее итоговой картинки.
+
+    Возвращает (единиц мира на пиксель холста, min_x, min_y, ширина, высота итоговой картинки).
+    Холст ровно в antialias раз больше картинки по каждой стороне, поэтому уменьшается
+    в неё простым усреднением блоков antialias x antialias. width - ширина картинки, запрошенная
+    при экспорте: координаты станций округляются по сетке пикселей, и границы карты при pixel_ratio
+    из resolve_resolution могут разойтись с ней на пиксель-другой - эта разница уходит в правое поле.
+    """
+    scale = scale if scale is not None else metro_map.scale
+    size, min_x, min_y, bounds_width, height = map_bounds(metro_map, scale * pixel_ratio, padding * pixel_ratio)
+    return size / antialias, min_x * antialias, min_y * antialias, width or bounds_width, height
+
+
+def line_image_path(metro_map, line, size, min_x, min_y):
+    return transform_points(metro_map.line_path(line, grid=size), 1, -min_x, -min_y)
+
+
+def draw_line_path(draw, line, path, ratio=1.0):
+    """Рисует путь линии; ratio - во сколько раз пиксель холста мельче пикселя редактора"""
+    width = line["width"] if ratio == 1 else max(1, round(line["width"] * ratio))
+    if line["smoothing"] == "smooth":
+        draw.line(path, fill=line["color"], width=width)
+    else:
+        draw.line(path, fill=line["color"], width=width, joint="curve")
+
+
+def station_vertical_extent(y, size_mult, ratio=1.0):
+    """Верх и низ значка станции вместе с подписью (с запасом) относительно её центра y"""
+    return (y - (15 * size_mult + 2) * ratio,
+            y + (14 * ((size_mult - 0.4) / 2) + 2 * FONT_SIZE + 2) * ratio)
+
+
+# Значки станций в единицах size_mult относительно центра станции: вид фигуры и её координаты.
+# По этим же описаниям строятся общие символы векторного экспорта
+STATION_GLYPHS = {
+    "circle": ("ellipse", (-5, -5, 5, 5)),
+    "square": ("rectangle", (-5, -5, 5, 5)),
+    "horizontal rect": ("rectangle", (-15, -5, 5, 5)),
+    "vertical rect": ("rectangle", (-5, -15, 5, 5)),
+    "triangle": ("polygon", (0, -6, -6, 6, 6, 6)),
+}
+
+
+def station_label_anchor(style, x, y, size_mult, ratio=1.0):
+    """Точка привязки подписи станции (середина по горизонтали, верх текста) или None, если подписи нет"""
+    if style == "label":
+        return x, y
+    if style == "empty":
+        return None
+    if style == "horizontal rect":
+        x -= int(6 * size_mult * ratio)
+    return x, y + 14 * ((size_mult - 0.4) / 2) * ratio
+
+
+def draw_station(img, draw, station, x, y, size_mult, ratio=1.0, labels=True, outline=True):
+    style = station.get("style", "circle")
+    glyph = STATION_GLYPHS.get(style)
+    if glyph is not None:
+        kind, offsets = glyph
+        scaled = size_mult * ratio
+        coords = [(x if i % 2 == 0 else y) + c * scaled for i, c in enumerate(offsets)]
+        getattr(draw, kind)(coords, fill="white", outline="black", width=max(1, round(ratio)))
+
+    anchor = station_label_anchor(style, x, y, size_mult, ratio) if labels else None
+    if anchor is not None:
+        # Подпись с обводкой берётся из кэша готовых картинок
+        label_cache.paste(img, station["name"], *anchor, round(FONT_SIZE * ratio), outline)
+
+
+def render_map(metro_map, scale=None, padding=40, on_progress=None, cancelled=None, pixel_ratio=1.0, antialias=1,
+               width=None):
+    """Рисует карту в изображение. Масштаб по умолчанию берётся из сохранённого вида карты.
+
+    pixel_ratio - сколько пикселей картинки приходится на пиксель редактора (см. resolve_resolution),
+    antialias - во сколько раз крупнее рисуется холст перед уменьшением до итогового размера,
+    width - точная ширина картинки в пикселях (см. canvas_geometry).
+    on_progress получает долю выполненной работы, а если cancelled() вернёт True, отрисовка
+    прерывается исключением ExportCancelled.
+    """
+    size, min_x, min_y, width, height = canvas_geometry(metro_map, scale, padding, pixel_ratio, antialias, width)
+    ratio = pixel_ratio * antialias
+
+    img = Image.new("RGB", (width * antialias, height * antialias), "white")
+    draw = ImageDraw.Draw(img)
+
+    # Рисуем линии (первая половина работы)
+    line_count = max(1, len(metro_map.lines))
+    with profiler.phase("lines"):
+        for line_index, line in enumerate(metro_map.lines):
+            _checkpoint(on_progress, cancelled, 0.5 * line_index / line_count)
+            if len(line["stations"]) < 2:
+                continue
+            with profiler.phase("line_paths"):
+                path = line_image_path(metro_map, line, size, min_x, min_y)
+            draw_line_path(draw, line, path, ratio)
+    profiler.count("drawn_lines", len(metro_map.lines))
+
+    # Рисуем станции
+    station_count = len(metro_map.stations)
+    with profiler.phase("stations"):
+        positions = image_points(metro_map.station_coords(), size, min_x, min_y)
+        for i, (station, x, y) in enumerate(zip(metro_map.stations, positions[0::2], positions[1::2])):
+            if i % PROGRESS_EVERY == 0:
+                _checkpoint(on_progress, cancelled, 0.5 + 0.5 * i / station_count)
+            size_mult = station_size_mult(metro_map.station_line_width(station.id))
+            draw_station(img, draw, station, x, y, size_mult, ratio)
+    profiler.count("drawn_stations", station_count)
+
+    # Усреднение блоков antialias x antialias - быстрое уменьшение без лишних копий
+    if antialias == 1:
+        return img
+    with profiler.phase("downsample"):
+        return img.reduce(antialias)
+
+
+def render_view(metro_map, scale, offset_x, offset_y, width, height, labels=True, outline=True):
+    """Рисует видимую в редакторе часть карты в картинку width x height - растровый вид редактора.
+
+    Точка карты (x, y) попадает в пиксель (x * scale + offset_x, y * scale + offset_y), как на холсте,
+    а линии и станции рисуются тем же кодом, что и при экспорте. Станции ставятся в целые пиксели, чтобы
+    подписи брались из кэша без дробных сдвигов. Без подписей из станций, попавших в один пиксель,
+    рисуется только верхняя - при отдалении их тысячи, а видна всё равно одна.
+    """
+    img = Image.new("RGB", (width, height), "white")
+    draw = ImageDraw.Draw(img)
+    x0, y0 = -offset_x / scale, -offset_y / scale
+    x1, y1 = (width - offset_x) / scale, (height - offset_y) / scale
+
+    with profiler.phase("lines"):
+        samples = bezier_samples(scale)
+        for line in metro_map.lines:
+            if len(line["stations"]) < 2:
+                continue
+            # Запас на толщину линии и пиксель на кривые, выступающие между точками пути
+            margin = (line["width"] + 2) / scale
+            with profiler.phase("line_paths"):
+                lx0, ly0, lx1, ly1 = metro_map.line_extent(line, samples)
+                if lx1 < x0 - margin or lx0 > x1 + margin or ly1 < y0 - margin or ly0 > y1 + margin:
+                    continue
+                runs = visible_runs(metro_map.line_path(line, samples), x0 - margin, y0 - margin, x1 + margin,
+                                    y1 + margin)
+            for run in runs:
+                # Как и на холсте, точки, сливающиеся в один пиксель, отбрасываются
+                draw_line_path(draw, line, simplify_path(transform_points(run, scale, offset_x, offset_y), 1.0))
+
+    with profiler.phase("query"):
+        margin = VIEW_MARGIN / scale
+        station_ids = sorted(metro_map.spatial.query_rect(x0 - margin, y0 - margin, x1 + margin, y1 + margin))
+    with profiler.phase("stations"):
+        stations = [metro_map.get_station(station_id) for station_id in station_ids]
+        positions = transform_points([c for s in stations for c in (s.x, s.y)], scale, offset_x, offset_y)
+        points = [(station, round(x), round(y)) for station, x, y in zip(stations, positions[0::2], positions[1::2])]
+        if not labels:
+            topmost = {}
+            for station, x, y in points:
+                topmost[x, y] = (station, x, y)
+            points = sorted(topmost.values(), key=lambda point: point[0].id)
+        for station, x, y in points:
+            size_mult = station_size_mult(metro_map.station_line_width(station.id))
+            draw_station(img, draw, station, x, y, size_mult, labels=labels, outline=outline)
+    profiler.count("visible_stations", len(station_ids))
+    profiler.count("drawn_stations", len(points))
+    return img
+
+
+def _segment_runs(indices):
+    """Группирует номера отрезков в непрерывные участки, захватывая по соседнему отрезку с каждой стороны,
+    чтобы скругления на стыках внутри полосы рисовались так же, как на целой картинке"""
+    runs = []
+    for i in sorted(indices):
+        if runs and i - 1 <= runs[-1][1] + 2:
+            runs[-1][1] = i + 1
+        else:
+            runs.append([i - 1, i + 1])
+    return runs
+
+
+def export_png_tiled(metro_map, file_path, scale=None, tile_size=DEFAULT_TILE_SIZE, padding=40, on_progress=None,
+                     cancelled=None, pixel_ratio=1.0, antialias=1, width=None):
+    """Экспортирует карту полосами высотой tile_size, дописывая их в PNG по мере готовности.
+
+    В памяти одновременно находится только одна полоса, а в каждую полосу попадают лишь те
+    участки линий и станции, которые её пересекают. Края наклонных линий на стыках полос
+    могут отличаться от render_map на пиксель из-за округления координат в Pillow.
+    Полосы пишутся во временный файл, который заменяет file_path только после последней полосы, так что
+    при отмене или ошибке недописанной картинки не остаётся. Со сглаживанием каждая полоса рисуется
+    в antialias раз крупнее и уменьшается перед записью, так что в памяти по-прежнему одна полоса.
+    """
+    size, min_x, min_y, width, height = canvas_geometry(metro_map, scale, padding, pixel_ratio, antialias, width)
+    ratio = pixel_ratio * antialias
+    strip_count = max(1, math.ceil(height / tile_size))
+    # Дальше всё считается в пикселях увеличенного холста
+    canvas_height = height * antialias
+    tile_size *= antialias
+
+    def strips_between(top, bottom):
+        first = max(0, int(top // tile_size))
+        last = min(strip_count - 1, int(bottom // tile_size))
+        return range(first, last + 1)
+
+    # Раскладываем отрезки линий и станции по полосам
+    strip_segments = [{} for _ in range(strip_count)]  # номер линии -> номера отрезков
+    line_paths = {}
+    with profiler.phase("layout"):
+        for line_index, line in enumerate(metro_map.lines):
+            if len(line["stations"]) < 2:
+                continue
+            with profiler.phase("line_paths"):
+                path = line_image_path(metro_map, line, size, min_x, min_y)
+            line_paths[line_index] = path
+            margin = line["width"] * ratio / 2 + 2
+            for i in range(len(path) // 2 - 1):
+                y0, y1 = path[2 * i + 1], path[2 * i + 3]
+                for strip in strips_between(min(y0, y1) - margin, max(y0, y1) + margin):
+                    strip_segments[strip].setdefault(line_index, []).append(i)
+
+        strip_stations = [[] for _ in range(strip_count)]
+        positions = image_points(metro_map.station_coords(), size, min_x, min_y)
+        for station, x, y in zip(metro_map.stations, positions[0::2], positions[1::2]):
+            size_mult = station_size_mult(metro_map.station_line_width(station.id))
+            for strip in strips_between(*station_vertical_extent(y, size_mult, ratio)):
+                strip_stations[strip].append((station, x, y, size_mult))
+    profiler.count("drawn_lines", len(metro_map.lines))
+    profiler.count("drawn_stations", len(metro_map.stations))
+    profiler.count("strips", strip_count)
+
+    with _atomic_output(file_path) as temp_path:
+        with open(temp_path, "wb") as f:
+            writer = PngStreamWriter(f, width, height)
+            for strip in range(strip_count):
+                _checkpoint(on_progress, cancelled, strip / strip_count)
+                top = strip * tile_size
+                img = Image.new("RGB", (width * antialias, min(tile_size, canvas_height - top)), "white")
+                draw = ImageDraw.Draw(img)
+
+                # Внутри полосы ход работы тоже отмечается: полоса большой карты рисуется секундами
+                line_runs = sorted(strip_segments[strip].items())
+                with profiler.phase("lines"):
+                    for n, (line_index, segments) in enumerate(line_runs):
+                        _checkpoint(on_progress, cancelled, (strip + 0.5 * n / len(line_runs)) / strip_count)
+                        line = metro_map.lines[line_index]
+                        path = line_paths[line_index]
+                        for start, end in _segment_runs(segments):
+                            start, end = max(0, start), min(len(path) // 2 - 2, end)
+                            run = path[2 * start:2 * (end + 2)]
+                            run[1::2] = [y - top for y in run[1::2]]
+                            draw_line_path(draw, line, run, ratio)
+
+                stations = strip_stations[strip]
+                with profiler.phase("stations"):
+                    for i, (station, x, y, size_mult) in enumerate(stations):
+                        if i % PROGRESS_EVERY == 0:
+                            _checkpoint(on_progress, cancelled,
+                                        (strip + 0.5 + 0.5 * i / len(stations)) / strip_count)
+                        draw_station(img, draw, station, x, y - top, size_mult, ratio)
+
+                if antialias > 1:
+                    with profiler.phase("downsample"):
+                        img = img.reduce(antialias)
+                with profiler.phase("encode"):
+                    writer.write_rows(img)
+                # Полосу больше не держим в памяти
+                strip_segments[strip] = None
+                strip_stations[strip] = None
+            writer.close()
+
+
+def export_png(metro_map, file_path, scale=None, tile_size=None, on_progress=None, cancelled=None, dpi=None,
+               width=None, antialias=1):
+    """Сохраняет карту в PNG. Слишком большие карты (или при заданном tile_size) пишутся полосами.
+
+    dpi или width (ширина в пикселях) делают размер картинки независимым от масштаба редактора,
+    antialias > 1 включает сглаживание отрисовкой в увеличенном виде (см. render_map).
+    """
+    with profiler.frame("export_png", {"paths": metro_map.path_cache, "labels": label_cache}):
+        scale, pixel_ratio = resolve_resolution(metro_map, scale, dpi, width)
+        if tile_size is None:
+            _, _, _, out_width, out_height = canvas_geometry(metro_map, scale, pixel_ratio=pixel_ratio, width=width)
+            # Учитывается размер увеличенного холста, а не итоговой картинки
+            if out_width * out_height * antialias * antialias <= MAX_FULL_IMAGE_PIXELS:
+                with profiler.phase("render"):
+                    img = render_map(metro_map, scale, on_progress=on_progress, cancelled=cancelled,
+                                     pixel_ratio=pixel_ratio, antialias=antialias, width=width)
+                _checkpoint(on_progress, cancelled, 1.0)
+                with profiler.phase("encode"), _atomic_output(file_path) as temp_path:
+                    img.save(temp_path, format="PNG")
+                return
+            tile_size = DEFAULT_TILE_SIZE
+        export_png_tiled(metro_map, file_path, scale, tile_size, on_progress=on_progress, cancelled=cancelled,
+                         pixel_ratio=pixel_ratio, antialias=antialias, width=width)
@@ -0,0 +1,71 @@
+"""Пространственный индекс станций: равномерная сетка в координатах карты"""
+import math
+
+
+class SpatialGrid:
+    def __init__(self, cell_size=64.0):
+        self.cell_size = cell_size
+        # (столбец, строка) -> список id станций в клетке: в клетке их обычно единицы, а пустое множество
+        # весит втрое больше короткого списка
+        self.cells = {}
+        self.positions = {}  # id станции -> (x, y)
+
+    def _cell(self, x, y):
+        return math.floor(x / self.cell_size), math.floor(y / self.cell_size)
+
+    def insert(self, item_id, x, y):
+        self.positions[item_id] = (x, y)
+        self.cells.setdefault(self._cell(x, y), []).append(item_id)
+
+    def remove(self, item_id):
+        x, y = self.positions.pop(item_id)
+        cell = self._cell(x, y)
+        items = self.cells[cell]
+        items.remove(item_id)
+        if not items:
+            del self.cells[cell]
+
+    def move(self, item_id, x, y):
+        old_x, old_y = self.positions[item_id]
+        if self._cell(old_x, old_y) == self._cell(x, y):
+            self.positions[item_id] = (x, y)
+        else:
+            self.remove(item_id)
+            self.insert(item_id, x, y)
+
+    def _cells_in(self, min_col, min_row, max_col, max_row):
+        # При сильном отдалении окно запроса может быть больше всей заполненной сетки
+        if (max_col - min_col + 1) * (max_row - min_row + 1) > len(self.cells):
+            return (items for (col, row), items in self.cells.items()
+                    if min_col <= col <= max_col and min_row <= row <= max_row)
+        return (self.cells[cell]
+                for cell in ((col, row) for col in range(min_col, max_col + 1) for row in range(min_row, max_row + 1))
+                if cell in self.cells)
+
+    def query_rect(self, x0, y0, x1, y1):
+        """id всех точек внутри прямоугольника"""
+        min_col, min_row = self._cell(x0, y0)
+        max_col, max_row = self._cell(x1, y1)
+        result = []
+        for items in self._cells_in(min_col, min_row, max_col, max_row):
+            for item_id in items:
+                px, py = self.positions[item_id]
+                if x0 <= px <= x1 and y0 <= py <= y1:
+                    result.append(item_id)
+        return result
+
+    def nearest(self, x, y, radius):
+        """id ближайшей точки на расстоянии меньше radius или None"""
+        min_col, min_row = self._cell(x - radius, y - radius)
+        max_col, max_row = self._cell(x + radius, y + radius)
+        candidates = (item_id for items in self._cells_in(min_col, min_row, max_col, max_row) for item_id in items)
+
+        best_id = None
+        best_distance = radius * radius
+        for item_id in candidates:
+            px, py = self.positions[item_id]
+            distance = (px - x) ** 2 + (py - y) ** 2
+            if distance < best_distance:
+                best_id = item_id
+                best_distance = distance
+        return best_id
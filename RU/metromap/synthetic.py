@@ -0,0 +1,70 @@
+"""Синтетические карты метро для замеров производительности.
+
+Сеть строится воспроизводимо по seed: линии идут от случайной точки ломаной под углами, кратными
+45 градусам, как на настоящих схемах, и время от времени проходят через уже существующую станцию
+другой линии - так появляются пересадки. Плотность станций не зависит от их числа, поэтому карта
+на 100 000 станций выглядит как карта на 1000, только больше.
+"""
+import math
+import random
+
+from .model import MetroMap
+from .spatial import SpatialGrid
+
+SMOOTHINGS = ("straight", "smooth", "metro")
+# Обычные станции встречаются чаще остальных стилей
+STATION_STYLES = ("circle",) * 4 + ("square", "horizontal rect", "vertical rect", "triangle", "label", "empty")
+LINE_WIDTHS = (4, 6, 8)
+STATIONS_PER_LINE = 40
+INTERCHANGE_SHARE = 0.1
+# Расстояние между соседними станциями линии и радиус, в котором ищется станция для пересадки
+STEP = 60.0
+INTERCHANGE_RADIUS = 90.0
+
+
+def generate_map(stations, lines=None, seed=0, interchange=INTERCHANGE_SHARE):
+    """Карта с stations станциями на lines линиях (по умолчанию - по STATIONS_PER_LINE станций на линию).
+
+    interchange - доля шагов линии, на которых она заходит на ближайшую станцию другой линии вместо
+    новой; такие заходы не добавляют станций, так что их всегда ровно stations.
+    """
+    rng = random.Random(seed)
+    line_count = max(1, min(stations, lines or round(stations / STATIONS_PER_LINE)))
+    side = math.sqrt(stations) * STEP * 1.5
+    grid = SpatialGrid(INTERCHANGE_RADIUS)
+    station_line = {}  # id станции -> id линии, которая её создала
+    all_stations = []
+    all_lines = []
+    for line_index in range(line_count):
+        line_id = line_index + 1
+        count = stations // line_count + (1 if line_index < stations % line_count else 0)
+        x, y = rng.uniform(0, side), rng.uniform(0, side)
+        direction = rng.randrange(8)
+        line_stations = []
+        created = 0
+        while created < count:
+            if line_stations and rng.random() < 0.2:
+                direction = (direction + rng.choice((-1, 1))) % 8
+            angle = direction * math.pi / 4
+            x += math.cos(angle) * STEP * rng.uniform(0.7, 1.3)
+            y += math.sin(angle) * STEP * rng.uniform(0.7, 1.3)
+            # У края области линия разворачивается внутрь
+            if not 0 <= x <= side or not 0 <= y <= side:
+                x, y = min(max(x, 0), side), min(max(y, 0), side)
+                direction = (direction + 4) % 8
+
+            other = grid.nearest(x, y, INTERCHANGE_RADIUS) if rng.random() < interchange else None
+            if other is not None and station_line[other] != line_id and other not in line_stations[-2:]:
+                line_stations.append(other)
+                continue
+            station_id = len(all_stations) + 1
+            all_stations.append({"id": station_id, "name": f"Станция {station_id}", "x": round(x, 1),
+                                 "y": round(y, 1), "style": rng.choice(STATION_STYLES)})
+            grid.insert(station_id, x, y)
+            station_line[station_id] = line_id
+            line_stations.append(station_id)
+            created += 1
+        all_lines.append({"id": line_id, "name": f"Линия {line_id}", "color": f"#{rng.randrange(1 << 24):06x}",
+                          "width": rng.choice(LINE_WIDTHS), "smoothing": rng.choice(SMOOTHINGS),
+                          "stations": line_stations})
+    return MetroMap.from_dict({"lines": all_lines, "stations": all_stations})
@@ -0,0 +1,272 @@
+"""Плитки z/x/y для веб-просмотрщика.
+
+Плитки рисуются тем же кодом, что и PNG-экспорт, но лениво: только когда их запросили, и только
+из тех линий и станций, которые в них попадают. Готовые плитки складываются в папку кэша, имя
+которой - хэш содержимого карты, так что после изменения карты старые плитки просто перестают
+использоваться.
+"""
+import hashlib
+import io
+import json
+import math
+import os
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+from PIL import Image, ImageDraw
+
+from .geometry import image_points, station_size_mult, transform_points, visible_runs
+from .jsonstream import write_map_records
+from .labels import LABELS_MIN_SCALE
+from .render import draw_line_path, draw_station
+
+TILE_SIZE = 256
+DEFAULT_MAX_ZOOM = 6
+# Запас вокруг плитки в пикселях: значки и подписи станций за её краем могут заходить внутрь
+TILE_MARGIN = 128
+# Меняется вместе с внешним видом плиток, чтобы кэш не отдавал нарисованные по-старому
+TILES_VERSION = 1
+
+# Сторона метатайла в плитках: столько плиток по каждой оси рисуется за один раз
+METATILE = 4
+BLANK_EXTREMA = ((255, 255),) * 3
+
+TILE_URL = re.compile(r"/(\d+)/(\d+)/(\d+)\.png")
+
+
+def map_hash(metro_map):
+    """Короткий хэш содержимого карты (и версии плиток) - имя папки её кэша"""
+    digest = hashlib.sha256(str(TILES_VERSION).encode("ascii"))
+    # Карта хэшируется по записи за раз, не собираясь целиком в одну строку
+    write_map_records(metro_map.to_dict(), _HashWriter(digest))
+    return digest.hexdigest()[:16]
+
+
+class _HashWriter:
+    """Файлоподобный объект, который не хранит текст, а сразу передаёт его в хэш"""
+
+    def __init__(self, digest):
+        self.digest = digest
+
+    def write(self, text):
+        self.digest.update(text.encode("utf-8"))
+
+
+class TileRenderer:
+    """Рисует и кэширует плитки одной карты.
+
+    На нулевом уровне вся карта с полями помещается в одну плитку, на каждом следующем масштаб
+    удваивается. Толщина линий, значки и подписи, как и в редакторе, от масштаба не зависят.
+    """
+
+    def __init__(self, metro_map, cache_dir, min_zoom=0, max_zoom=DEFAULT_MAX_ZOOM, tile_size=TILE_SIZE):
+        if not metro_map.stations:
+            raise ValueError("Нет станций для экспорта")
+        self.map = metro_map
+        self.min_zoom = min_zoom
+        self.max_zoom = max_zoom
+        self.tile_size = tile_size
+        self.hash = map_hash(metro_map)
+        self.cache_dir = os.path.join(cache_dir, self.hash)
+
+        xs = [station.x for station in metro_map.stations]
+        ys = [station.y for station in metro_map.stations]
+        # Квадрат вокруг карты с полями в 5% стороны
+        side = max(max(xs) - min(xs), max(ys) - min(ys), 1)
+        self.extent = side * 1.1
+        self.origin_x = (min(xs) + max(xs) - self.extent) / 2
+        self.origin_y = (min(ys) + max(ys) - self.extent) / 2
+
+        # Станции рисуются в том же порядке, что и в PNG
+        self.rows = {station.id: row for row, station in enumerate(metro_map.stations)}
+        # Модель и её кэш путей не рассчитаны на одновременную работу из нескольких потоков сервера
+        self.lock = threading.Lock()
+        self.blank = self.encode(Image.new("RGB", (tile_size, tile_size), "white"))
+        self.rendered = 0
+        self.cached = 0
+        self.empty = 0
+
+    @staticmethod
+    def encode(img):
+        data = io.BytesIO()
+        img.save(data, "PNG")
+        return data.getvalue()
+
+    def tile_grid(self, zoom):
+        """Единиц карты на пиксель плитки на уровне zoom"""
+        return self.extent / (self.tile_size * 2 ** zoom)
+
+    def tile_path(self, zoom, x, y):
+        return os.path.join(self.cache_dir, str(zoom), str(x), f"{y}.png")
+
+    def in_range(self, zoom, x, y):
+        return self.min_zoom <= zoom <= self.max_zoom and 0 <= x < 2 ** zoom and 0 <= y < 2 ** zoom
+
+    def get_tile(self, zoom, x, y):
+        """PNG плитки в байтах или None, если такой плитки нет.
+
+        При промахе кэша рисуется сразу весь метатайл METATILE x METATILE вокруг плитки: линии, проходящие
+        через соседние плитки, рисуются один раз, а соседей просмотрщик обычно запрашивает следом.
+        """
+        if not self.in_range(zoom, x, y):
+            return None
+        path = self.tile_path(zoom, x, y)
+        data = self.read_cached(path)
+        if data is not None:
+            return data
+
+        with self.lock:
+            # Пока ждали замка, ту же плитку мог нарисовать другой запрос
+            data = self.read_cached(path)
+            if data is not None:
+                return data
+            meta = min(METATILE, 2 ** zoom)
+            meta_x, meta_y = x - x % meta, y - y % meta
+            img = self.render_tile(zoom, meta_x, meta_y, meta)
+            tile = self.tile_size
+            for tile_x in range(meta_x, meta_x + meta):
+                for tile_y in range(meta_y, meta_y + meta):
+                    part = None
+                    if img is not None:
+                        left, top = (tile_x - meta_x) * tile, (tile_y - meta_y) * tile
+                        part = img.crop((left, top, left + tile, top + tile))
+                        if part.getextrema() == BLANK_EXTREMA:
+                            part = None
+                    if part is None:
+                        # Пустая плитка сохраняется файлом нулевой длины, чтобы не рисовать её повторно
+                        self.empty += 1
+                        tile_data = b""
+                    else:
+                        self.rendered += 1
+                        tile_data = self.encode(part)
+                    self.write_cached(self.tile_path(zoom, tile_x, tile_y), tile_data)
+                    if (tile_x, tile_y) == (x, y):
+                        data = tile_data
+        return data or self.blank
+
+    def read_cached(self, path):
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        self.cached += 1
+        return data or self.blank
+
+    @staticmethod
+    def write_cached(path, data):
+        # Через временный файл, чтобы параллельный запрос не прочитал недописанную плитку
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".tmp", "wb") as f:
+            f.write(data)
+        os.replace(path + ".tmp", path)
+
+    def render_tile(self, zoom, x, y, count=1):
+        """Картинка count x count плиток, начиная с (x, y), или None, если в неё ничего не попадает"""
+        metro_map = self.map
+        size = self.tile_grid(zoom)
+        width = self.tile_size * count
+        min_x = math.floor(self.origin_x / size) + x * self.tile_size
+        min_y = math.floor(self.origin_y / size) + y * self.tile_size
+
+        img = None
+        draw = None
+        for line in metro_map.lines:
+            if len(line["stations"]) < 2:
+                continue
+            margin = line["width"] / 2 + 2
+            path = metro_map.line_path(line, grid=size)
+            runs = visible_runs(path, min_x - margin, min_y - margin, min_x + width + margin, min_y + width + margin)
+            for run in runs:
+                if img is None:
+                    img = Image.new("RGB", (width, width), "white")
+                    draw = ImageDraw.Draw(img)
+                draw_line_path(draw, line, transform_points(run, 1, -min_x, -min_y))
+
+        station_ids = metro_map.spatial.query_rect((min_x - TILE_MARGIN) * size, (min_y - TILE_MARGIN) * size,
+                                                   (min_x + width + TILE_MARGIN) * size,
+                                                   (min_y + width + TILE_MARGIN) * size)
+        if station_ids:
+            if img is None:
+                img = Image.new("RGB", (width, width), "white")
+                draw = ImageDraw.Draw(img)
+            labels = 1 / size >= LABELS_MIN_SCALE
+            drawn = set()
+            stations = sorted(map(metro_map.get_station, station_ids), key=lambda s: self.rows[s.id])
+            positions = image_points([c for s in stations for c in (s.x, s.y)], size, min_x, min_y)
+            for station, px, py in zip(stations, positions[0::2], positions[1::2]):
+                size_mult = station_size_mult(metro_map.station_line_width(station.id))
+                if not labels:
+                    # На мелких уровнях тысячи станций попадают в одни и те же пиксели
+                    key = (px, py, station.get("style", "circle"), size_mult)
+                    if key in drawn:
+                        continue
+                    drawn.add(key)
+                draw_station(img, draw, station, px, py, size_mult, labels=labels)
+        return img
+
+    def metadata(self, url):
+        """Описание набора плиток в духе TileJSON"""
+        return {"tilejson": "2.2.0", "scheme": "xyz", "tiles": [url + "/{z}/{x}/{y}.png"],
+                "minzoom": self.min_zoom, "maxzoom": self.max_zoom, "tileSize": self.tile_size,
+                "version": self.hash}
+
+    def stats(self):
+        return {"rendered": self.rendered, "cached": self.cached, "empty": self.empty}
+
+
+class TileRequestHandler(BaseHTTPRequestHandler):
+    """GET /z/x/y.png - плитка, GET /tiles.json - описание набора"""
+
+    def do_GET(self):
+        renderer = self.server.renderer
+        path = urlsplit(self.path).path
+        if path == "/tiles.json":
+            body = json.dumps(renderer.metadata(f"http://{self.headers.get('Host', 'localhost')}")).encode("utf-8")
+            self.send_body(body, "application/json")
+            return
+
+        match = TILE_URL.fullmatch(path)
+        if match is None:
+            self.send_error(404)
+            return
+        zoom, x, y = map(int, match.groups())
+        # Содержимое плитки определяется хэшем карты, поэтому браузеру достаточно проверить ETag
+        etag = f'"{renderer.hash}-{zoom}-{x}-{y}"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        data = renderer.get_tile(zoom, x, y)
+        if data is None:
+            self.send_error(404)
+            return
+        self.send_body(data, "image/png", etag)
+
+    def send_body(self, body, content_type, etag=None):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Access-Control-Allow-Origin", "*")
+        if etag is not None:
+            self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class TileServer(ThreadingHTTPServer):
+    # Просмотрщик запрашивает сразу десятки плиток; с очередью по умолчанию (5) лишние соединения
+    # отбрасываются и повторяются клиентом только через секунду
+    request_queue_size = 128
+    daemon_threads = True
+
+
+def make_tile_server(metro_map, cache_dir, host="127.0.0.1", port=8000, min_zoom=0, max_zoom=DEFAULT_MAX_ZOOM):
+    """HTTP-сервер плиток карты; запускается через serve_forever()"""
+    renderer = TileRenderer(metro_map, cache_dir, min_zoom, max_zoom)
+    server = TileServer((host, port), TileRequestHandler)
+    server.renderer = renderer
+    return server
@@ -0,0 +1,156 @@
+"""Векторный экспорт карты в SVG и PDF.
+
+Пути линий берутся из того же кэша, что и у PNG-экспорта, значки станций - из тех же описаний
+STATION_GLYPHS. Каждый вид значка определяется в файле один раз как символ и дальше только
+ссылается на него, а оформление подписей задаётся одним общим стилем, поэтому даже большая
+сеть занимает немного места.
+"""
+import base64
+import io
+import os
+from xml.sax.saxutils import escape
+
+from .geometry import image_points, station_size_mult
+from .labels import FONT_PATH, FONT_SIZE
+from .render import (PROGRESS_EVERY, STATION_GLYPHS, _atomic_output, _checkpoint, line_image_path, map_bounds,
+                     station_label_anchor)
+
+try:
+    import cairosvg
+except (ImportError, OSError):  # PDF необязателен: cairosvg нужна ещё и системная библиотека cairo
+    cairosvg = None
+
+SVG_EXTENSION = ".svg"
+PDF_EXTENSION = ".pdf"
+FONT_FAMILY = "Minecraft"
+
+
+def _num(value):
+    """Координата с точностью до сотой пикселя и без лишних нулей"""
+    text = f"{value:.2f}".rstrip("0").rstrip(".")
+    return "0" if text == "-0" else text
+
+
+def _points(coords):
+    return " ".join(f"{_num(x)},{_num(y)}" for x, y in zip(coords[0::2], coords[1::2]))
+
+
+def _glyph_element(kind, offsets, size_mult):
+    """Значок станции с центром в (0, 0) - тот же, что рисует draw_station"""
+    x0, y0, *rest = [c * size_mult for c in offsets]
+    if kind == "polygon":
+        return f'<polygon points="{_points([x0, y0, *rest])}"/>'
+    x1, y1 = rest
+    if kind == "ellipse":
+        return (f'<ellipse cx="{_num((x0 + x1) / 2)}" cy="{_num((y0 + y1) / 2)}" rx="{_num((x1 - x0) / 2)}" '
+                f'ry="{_num((y1 - y0) / 2)}"/>')
+    return f'<rect x="{_num(x0)}" y="{_num(y0)}" width="{_num(x1 - x0)}" height="{_num(y1 - y0)}"/>'
+
+
+def _style(embed_font):
+    rules = []
+    if embed_font:
+        with open(FONT_PATH, "rb") as f:
+            font = base64.b64encode(f.read()).decode("ascii")
+        rules.append(f'@font-face{{font-family:"{FONT_FAMILY}";src:url(data:font/ttf;base64,{font})}}')
+    rules += [
+        "polyline{fill:none}",
+        ".joint{stroke-linejoin:round}",
+        "symbol{overflow:visible}",
+        "symbol *{fill:#fff;stroke:#000;stroke-width:1}",
+        # Белый текст с чёрной обводкой, как у подписей PNG: обводка рисуется под заливкой
+        f'text{{font-family:"{FONT_FAMILY}",monospace;font-size:{FONT_SIZE}px;text-anchor:middle;'
+        "dominant-baseline:text-before-edge;fill:#fff;stroke:#000;stroke-width:2;stroke-linejoin:round;"
+        "paint-order:stroke}",
+    ]
+    return "\n".join(rules)
+
+
+def write_svg(metro_map, file, scale=None, padding=40, embed_font=True, on_progress=None, cancelled=None):
+    """Пишет карту в открытый текстовый файл в формате SVG.
+
+    Размеры и координаты совпадают с export_png при том же масштабе. embed_font встраивает шрифт
+    подписей в файл (около 90 КБ), иначе просмотрщик подставит шрифт Minecraft, если он установлен.
+    """
+    size, min_x, min_y, width, height = map_bounds(metro_map, scale, padding)
+
+    file.write(f'<svg xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink" '
+               f'width="{width}" height="{height}" viewBox="0 0 {width} {height}">\n')
+    file.write(f"<style>\n{_style(embed_font)}\n</style>\n")
+
+    # Символы значков: по одному на сочетание стиля и размера
+    positions = image_points(metro_map.station_coords(), size, min_x, min_y)
+    size_mults = [station_size_mult(metro_map.station_line_width(station.id)) for station in metro_map.stations]
+    symbols = {}
+    file.write("<defs>\n")
+    for station, size_mult in zip(metro_map.stations, size_mults):
+        style = station.get("style", "circle")
+        if style in STATION_GLYPHS and (style, size_mult) not in symbols:
+            symbol_id = symbols[style, size_mult] = f"s{len(symbols)}"
+            file.write(f'<symbol id="{symbol_id}">{_glyph_element(*STATION_GLYPHS[style], size_mult)}</symbol>\n')
+    file.write("</defs>\n")
+
+    file.write(f'<rect width="{width}" height="{height}" fill="#fff"/>\n')
+    # Pillow ставит точку с целыми координатами в центр пикселя
+    file.write('<g transform="translate(0.5 0.5)">\n')
+
+    # Линии (первая половина работы)
+    line_count = len(metro_map.lines)
+    for line_index, line in enumerate(metro_map.lines):
+        _checkpoint(on_progress, cancelled, 0.5 * line_index / line_count)
+        if len(line["stations"]) < 2:
+            continue
+        path = line_image_path(metro_map, line, size, min_x, min_y)
+        joint = "" if line["smoothing"] == "smooth" else ' class="joint"'
+        file.write(f'<polyline points="{_points(path)}" stroke="{escape(line["color"])}" '
+                   f'stroke-width="{_num(line["width"])}"{joint}/>\n')
+
+    # Станции в том же порядке, что и в PNG: значок, затем его подпись
+    station_count = len(metro_map.stations)
+    for i, (station, x, y, size_mult) in enumerate(zip(metro_map.stations, positions[0::2], positions[1::2],
+                                                       size_mults)):
+        if i % PROGRESS_EVERY == 0:
+            _checkpoint(on_progress, cancelled, 0.5 + 0.5 * i / station_count)
+        style = station.get("style", "circle")
+        symbol_id = symbols.get((style, size_mult))
+        if symbol_id is not None:
+            file.write(f'<use xlink:href="#{symbol_id}" x="{_num(x)}" y="{_num(y)}"/>\n')
+        anchor = station_label_anchor(style, x, y, size_mult)
+        if anchor is not None:
+            file.write(f'<text x="{_num(anchor[0])}" y="{_num(anchor[1])}">{escape(station["name"])}</text>\n')
+
+    file.write("</g>\n</svg>\n")
+    _checkpoint(on_progress, cancelled, 1.0)
+
+
+def export_svg(metro_map, file_path, scale=None, padding=40, embed_font=True, on_progress=None, cancelled=None):
+    """Сохраняет карту в SVG (см. write_svg). При отмене или ошибке недописанного файла не остаётся"""
+    with _atomic_output(file_path) as temp_path:
+        with open(temp_path, "w", encoding="utf-8") as f:
+            write_svg(metro_map, f, scale, padding, embed_font, on_progress, cancelled)
+
+
+def export_pdf(metro_map, file_path, scale=None, padding=40, on_progress=None, cancelled=None):
+    """Сохраняет карту в PDF, переводя в него SVG через необязательный пакет cairosvg.
+
+    cairo не понимает встроенные в SVG шрифты, поэтому для подписей нужен установленный в системе
+    шрифт Minecraft, иначе будет подставлен моноширинный.
+    """
+    if cairosvg is None:
+        raise RuntimeError("Для экспорта в PDF нужен пакет cairosvg")
+    svg = io.StringIO()
+    # Построение SVG - первая половина работы, перевод в PDF - вторая
+    svg_progress = (lambda fraction: on_progress(0.5 * fraction)) if on_progress is not None else None
+    write_svg(metro_map, svg, scale, padding, False, svg_progress, cancelled)
+    _checkpoint(on_progress, cancelled, 0.5)
+    with _atomic_output(file_path) as temp_path:
+        cairosvg.svg2pdf(bytestring=svg.getvalue().encode("utf-8"), write_to=temp_path)
+    _checkpoint(on_progress, cancelled, 1.0)
+
+
+def export_vector(metro_map, file_path, scale=None, on_progress=None, cancelled=None):
+    """SVG или PDF в зависимости от расширения file_path"""
+    if os.path.splitext(file_path)[1].lower() == PDF_EXTENSION:
+        export_pdf(metro_map, file_path, scale, on_progress=on_progress, cancelled=cancelled)
+    else:
+        export_svg(metro_map, file_path, scale, on_progress=on_progress, cancelled=cancelled)
@@ -0,0 +1,43 @@
+import os
+import sys
+
+import pytest
+
+# Тесты запускаются из любой папки: пакет metromap и main.py лежат в RU
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from metromap import MetroMap  # noqa: E402
+
+
+@pytest.fixture
+def metro_map():
+    """Две линии по пять станций с пересадкой на средней станции"""
+    metro_map = MetroMap()
+    red = metro_map.add_line("#d62828", 8, "metro")
+    blue = metro_map.add_line("#1d3557", 4, "smooth")
+    for i in range(5):
+        metro_map.add_station(red, 100 * i, 200, "circle")
+    for i in range(5):
+        if i == 2:
+            blue["stations"].append(red["stations"][2])
+        else:
+            metro_map.add_station(blue, 200, 100 * i, "square")
+    metro_map.rebuild_index()
+    return metro_map
+
+
+def _index_state(metro_map):
+    """Индексы карты в сравнимом виде: станции - по тождеству объектов, линии - по id"""
+    return ({station_id: id(station) for station_id, station in metro_map.station_index.items()},
+            {station_id: [line["id"] for line in lines] for station_id, lines in metro_map.station_lines.items()},
+            metro_map.spatial.positions,
+            {cell: set(items) for cell, items in metro_map.spatial.cells.items()})
+
+
+@pytest.fixture
+def check_indexes():
+    """Проверяет, что индексы, которые карта обновляла по ходу правок, совпадают с построенными заново"""
+    def check(metro_map):
+        fresh = MetroMap(metro_map.lines, metro_map.stations)
+        assert _index_state(metro_map) == _index_state(fresh)
+    return check
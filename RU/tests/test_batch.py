@@ -0,0 +1,39 @@
+import os
+
+import pytest
+
+from metromap.batch import batch_export, collect_maps, output_names
+
+
+def test_output_names_keep_extension_on_collision():
+    assert output_names(["maps/a.json", "maps/a.old", "maps/b.json"]) == ["a.json.png", "a.old.png", "b.png"]
+
+
+def test_output_names_reject_same_file_name_in_different_folders():
+    with pytest.raises(ValueError):
+        output_names(["one/a.json", "two/a.json"])
+
+
+def test_batch_export_does_not_overwrite_same_stem(metro_map, tmp_path):
+    metro_map.save(str(tmp_path / "a.json"))
+    metro_map.save(str(tmp_path / "a.old"))
+    output_dir = tmp_path / "png"
+
+    results = batch_export(collect_maps(str(tmp_path / "a.*")), str(output_dir), workers=1)
+
+    assert [r["error"] for r in results] == [None, None]
+    assert len({r["output"] for r in results}) == 2
+    assert sorted(os.listdir(output_dir)) == ["a.json.png", "a.old.png"]
+
+
+def test_batch_export_folder_with_json_and_binary_map(metro_map, tmp_path):
+    maps_dir = tmp_path / "maps"
+    maps_dir.mkdir()
+    metro_map.save(str(maps_dir / "a.json"))
+    metro_map.save_binary(str(maps_dir / "a.mmb"))
+    output_dir = tmp_path / "png"
+
+    results = batch_export(collect_maps(str(maps_dir)), str(output_dir), workers=1)
+
+    assert [r["error"] for r in results] == [None, None]
+    assert sorted(os.listdir(output_dir)) == ["a.json.png", "a.mmb.png"]
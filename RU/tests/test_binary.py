@@ -0,0 +1,79 @@
+import json
+
+import pytest
+
+from metromap.binary import is_binary_map, read_binary, write_binary
+from metromap.model import MetroMap
+
+
+def _station(station_id, x, y, **fields):
+    return dict({"id": station_id, "name": f"Станция {station_id}", "x": x, "y": y, "style": "circle"}, **fields)
+
+
+def _line(line_id, stations, **fields):
+    return dict({"id": line_id, "name": f"Линия {line_id}", "color": "#ff0000", "width": 8, "smoothing": "metro",
+                 "stations": stations}, **fields)
+
+
+MAPS = {
+    "empty": {"lines": [], "stations": []},
+    "plain": {
+        "lines": [_line(1, [1, 2, 3])],
+        "stations": [_station(1, 0, 0), _station(2, 100, 0), _station(3, 100, 100)],
+        "scale": 1.0, "offset_x": 0, "offset_y": 0,
+    },
+    # Целые и дробные координаты вперемешку: 1 и 1.0 должны остаться разными типами
+    "integer_and_float": {
+        "lines": [_line(1, [1, 2]), _line(2, [2], width=2.5)],
+        "stations": [_station(1, 1, 2.0), _station(2, 1.0, -3)],
+        "scale": 2, "offset_x": -10.5, "offset_y": 7,
+    },
+    # Отсутствующие поля не должны появиться после чтения
+    "absent_fields": {
+        "lines": [{"id": 1, "color": "#00ff00", "stations": [1]}, _line(2, [])],
+        "stations": [{"id": 1, "x": 5, "y": 5}, _station(2, 1, 1)],
+    },
+    # Незнакомые ключи и значения не по схеме уходят в JSON-хвост
+    "unknown_keys": {
+        "lines": [_line(1, [1], dash=[4, 2]), _line(2, [1], name=None, width="толстая")],
+        "stations": [_station(1, 0, 0, label_angle=45, name=12), _station(2, "x", 0, id=2 ** 70)],
+        "scale": 1.0, "offset_x": 0, "offset_y": 0, "version": 2, "title": "Схема",
+    },
+    # Ссылки на несуществующие станции и не-список в stations сохраняются как есть
+    "dangling_references": {
+        "lines": [_line(1, [1, 99]), _line(2, "все"), {"id": 3, "color": "#0000ff"}, _line(4, [1, "1"])],
+        "stations": [_station(1, 0, 0)],
+    },
+    "strings_with_zero_byte": {
+        "lines": [_line(1, [1], name="Кольцевая\0")],
+        "stations": [_station(1, 0, 0, name="\0"), _station(2, 0, 0, name="")],
+    },
+}
+
+
+@pytest.mark.parametrize("data", MAPS.values(), ids=MAPS.keys())
+def test_round_trip(data, tmp_path):
+    file_path = str(tmp_path / "map.mmb")
+    write_binary(data, file_path)
+
+    # Сравниваем через JSON, чтобы 1 и 1.0 считались разными значениями
+    assert json.dumps(read_binary(file_path), sort_keys=True) == json.dumps(data, sort_keys=True)
+
+
+def test_round_trip_of_generated_map(metro_map, tmp_path):
+    file_path = str(tmp_path / "map.mmb")
+    metro_map.save_binary(file_path)
+
+    assert read_binary(file_path) == metro_map.snapshot()
+
+
+def test_load_detects_format_by_content(metro_map, tmp_path):
+    binary_path = str(tmp_path / "map.json")
+    json_path = str(tmp_path / "map.mmb")
+    metro_map.save_binary(binary_path)
+    metro_map.save(json_path)
+
+    assert is_binary_map(binary_path)
+    assert not is_binary_map(json_path)
+    assert MetroMap.load(binary_path).snapshot() == metro_map.snapshot()
+    assert MetroMap.load(json_path).snapshot() == metro_map.snapshot()
@@ -0,0 +1,52 @@
+import tkinter as tk
+
+import pytest
+
+import main
+from metromap.synthetic import generate_map
+
+
+@pytest.fixture
+def app(tmp_path):
+    try:
+        root = tk.Tk()
+    except tk.TclError:
+        pytest.skip("Tk не может открыть окно")
+    app = main.MetroMapGenerator(root, autosave_dir=str(tmp_path / "autosave"))
+    app.set_map(generate_map(200, seed=2))
+    yield app
+    app.on_close()
+
+
+def render_pending(app):
+    if app.frame_job is not None:
+        app.root.after_cancel(app.frame_job)
+    app.render_frame()
+
+
+def test_line_color_change_rerenders_raster_view(app, monkeypatch):
+    app.display_var.set(main.DISPLAY_RASTER)
+    app.set_display()
+    render_pending(app)
+    assert not app.raster_stale()
+
+    app.selected_line = 0
+    monkeypatch.setattr(main.colorchooser, "askcolor", lambda **kwargs: ((255, 0, 0), "#ff0000"))
+    app.change_line_color()
+
+    assert app.map.lines[0]["color"] == "#ff0000"
+    assert app.frame_job is not None
+    assert app.raster_stale()
+
+
+def test_line_color_change_recolors_vector_items(app, monkeypatch):
+    render_pending(app)
+    app.selected_line = 0
+    line_id = app.map.lines[0]["id"]
+    monkeypatch.setattr(main.colorchooser, "askcolor", lambda **kwargs: ((255, 0, 0), "#ff0000"))
+    app.change_line_color()
+    render_pending(app)
+
+    items = app.line_items[line_id]
+    assert items
+    assert all(app.canvas.itemcget(item, "fill") == "#ff0000" for item in items)
@@ -0,0 +1,54 @@
+import os
+
+import pytest
+from PIL import Image
+
+from metromap import render, vector
+from metromap.render import export_png, export_png_tiled
+from metromap.vector import export_svg
+
+
+def _fail(*args, **kwargs):
+    raise OSError("диск заполнен")
+
+
+@pytest.mark.parametrize("export", [
+    lambda metro_map, path: export_png_tiled(metro_map, path, 1.0, tile_size=64),
+    lambda metro_map, path: export_png(metro_map, path, 1.0),
+])
+def test_failed_png_export_leaves_no_file(metro_map, tmp_path, monkeypatch, export):
+    path = str(tmp_path / "map.png")
+    monkeypatch.setattr(render, "draw_station", _fail)
+    with pytest.raises(OSError):
+        export(metro_map, path)
+    assert os.listdir(tmp_path) == []
+
+
+def test_failed_png_export_keeps_previous_file(metro_map, tmp_path, monkeypatch):
+    path = str(tmp_path / "map.png")
+    export_png_tiled(metro_map, path, 1.0, tile_size=64)
+    with open(path, "rb") as f:
+        previous = f.read()
+    monkeypatch.setattr(render, "draw_station", _fail)
+    with pytest.raises(OSError):
+        export_png_tiled(metro_map, path, 1.0, tile_size=64)
+    with open(path, "rb") as f:
+        assert f.read() == previous
+    assert os.listdir(tmp_path) == ["map.png"]
+
+
+@pytest.mark.parametrize("width", [97, 300, 641, 1000, 1023, 1777])
+@pytest.mark.parametrize("antialias, tile_size", [(1, None), (2, None), (1, 128), (3, 128)])
+def test_png_has_requested_width(metro_map, tmp_path, width, antialias, tile_size):
+    path = str(tmp_path / "map.png")
+    export_png(metro_map, path, tile_size=tile_size, width=width, antialias=antialias)
+    with Image.open(path) as img:
+        assert img.width == width
+
+
+def test_failed_svg_export_leaves_no_file(metro_map, tmp_path, monkeypatch):
+    path = str(tmp_path / "map.svg")
+    monkeypatch.setattr(vector, "station_label_anchor", _fail)
+    with pytest.raises(OSError):
+        export_svg(metro_map, path)
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,220 @@
+import pytest
+
+from metromap.history import History
+from metromap.model import MetroMap
+
+
+def _add_station(metro_map):
+    metro_map.add_station(metro_map.lines[1], 300, 500, "circle")
+
+
+def _add_line(metro_map):
+    line = metro_map.add_line("#2a9d8f", 6, "straight")
+    metro_map.add_station(line, -100, -100, "circle")
+    metro_map.add_station(line, -200, -100, "square")
+
+
+def _remove_station(metro_map):
+    metro_map.remove_station(1)
+
+
+def _remove_interchange(metro_map):
+    metro_map.remove_station(3)
+
+
+def _remove_line(metro_map):
+    metro_map.remove_line(0)
+
+
+def _move_station(metro_map):
+    metro_map.move_station(metro_map.get_station(3), 1000, -1000)
+
+
+def _update_station(metro_map):
+    metro_map.update_station(metro_map.get_station(2), name="Пересадочная", style=None)
+
+
+def _update_line(metro_map):
+    metro_map.update_line(metro_map.lines[0], color="#000000", smoothing="smooth", name="Красная")
+
+
+def _move_stations(metro_map):
+    metro_map.move_stations([(metro_map.get_station(1), 5, 5), (metro_map.get_station(3), 7, -7)])
+
+
+def _update_stations(metro_map):
+    metro_map.update_stations([(metro_map.get_station(1), {"name": "Депо"}),
+                               (metro_map.get_station(3), {"style": None}),
+                               (metro_map.get_station(6), {"style": "circle"})])
+
+
+def _remove_stations(metro_map):
+    metro_map.remove_stations({7, 3, 1})
+
+
+def _relink_stations(metro_map):
+    metro_map.relink_stations([1, 3], metro_map.lines[1])
+
+
+def _set_line_stations(metro_map):
+    red, blue = metro_map.lines
+    metro_map.set_line_stations([(red, red["stations"][::-1]), (blue, blue["stations"] + [1])])
+
+
+EDITS = {
+    "add_station": [_add_station],
+    "add_line": [_add_line],
+    "remove_station": [_remove_station],
+    "remove_interchange": [_remove_interchange],
+    "remove_line": [_remove_line],
+    "move_station": [_move_station],
+    "update_station": [_update_station],
+    "update_line": [_update_line],
+    "move_stations": [_move_stations],
+    "update_stations": [_update_stations],
+    "remove_stations": [_remove_stations],
+    "relink_stations": [_relink_stations],
+    "set_line_stations": [_set_line_stations],
+    "mixed": [_move_station, _add_line, _update_station, _remove_interchange, _add_station, _update_line,
+              _remove_line],
+    "mixed_groups": [_move_stations, _set_line_stations, _update_stations, _relink_stations, _add_line,
+                     _remove_stations],
+}
+
+
+@pytest.mark.parametrize("edits", EDITS.values(), ids=EDITS.keys())
+def test_undo_and_redo_restore_map(metro_map, edits, check_indexes):
+    history = History(metro_map)
+    states = [metro_map.snapshot()]
+    for edit in edits:
+        with history.transaction(edit.__name__):
+            edit(metro_map)
+        check_indexes(metro_map)
+        states.append(metro_map.snapshot())
+
+    for state in reversed(states[:-1]):
+        assert history.undo() is not None
+        check_indexes(metro_map)
+        assert metro_map.snapshot() == state
+    assert history.undo() is None
+
+    for state in states[1:]:
+        assert history.redo() is not None
+        check_indexes(metro_map)
+        assert metro_map.snapshot() == state
+    assert history.redo() is None
+
+
+def test_undo_of_removed_interchange_keeps_station_size(metro_map):
+    history = History(metro_map)
+    with history.transaction("Удаление"):
+        metro_map.remove_station(3)
+
+    history.undo()
+
+    assert metro_map.station_line_width(3) == 8
+
+
+def _two_lines_with_interchange():
+    """Станция 1 только на линии B, станция 2 - на A и B; A идёт первой и толще"""
+    metro_map = MetroMap()
+    a = metro_map.add_line("#ff0000", 10, "metro")
+    b = metro_map.add_line("#0000ff", 2, "metro")
+    metro_map.add_station(b, 0, 0, "circle")
+    metro_map.add_station(a, 10, 0, "circle")
+    b["stations"].append(2)
+    metro_map.rebuild_index()
+    return metro_map
+
+
+@pytest.mark.parametrize("edit", [lambda m: m.relink_stations([2], m.lines[1]), lambda m: m.remove_stations({1, 2})],
+                         ids=["relink_stations", "remove_stations"])
+def test_undo_keeps_station_lines_in_map_order(edit, check_indexes):
+    metro_map = _two_lines_with_interchange()
+    assert metro_map.station_line_width(2) == 10
+    history = History(metro_map)
+    with history.transaction("Правка"):
+        edit(metro_map)
+
+    history.undo()
+
+    assert [line["id"] for line in metro_map.station_lines[2]] == [1, 2]
+    assert metro_map.station_line_width(2) == 10
+    check_indexes(metro_map)
+
+
+def test_moves_with_same_merge_key_become_one_entry(metro_map):
+    history = History(metro_map)
+    station = metro_map.get_station(1)
+    for x in (10, 20, 30):
+        with history.transaction("Перемещение", merge_key=("drag", 1)):
+            metro_map.move_station(station, x, x)
+            metro_map.move_station(metro_map.get_station(2), x, 0)
+
+    assert len(history.undo_stack) == 1
+    assert [op[1] for op in history.undo_stack[0].ops] == [1, 2]
+
+    with history.transaction("Перемещение", merge_key=("drag", 2)):
+        metro_map.move_station(station, 40, 40)
+    assert len(history.undo_stack) == 2
+
+    history.undo()
+    history.undo()
+    assert (station["x"], station["y"]) == (0, 200)
+    assert (metro_map.get_station(2)["x"], metro_map.get_station(2)["y"]) == (100, 200)
+
+
+def test_group_moves_with_same_merge_key_become_one_entry(metro_map):
+    history = History(metro_map)
+    stations = [metro_map.get_station(1), metro_map.get_station(2)]
+    for _ in range(3):
+        with history.transaction("Перемещение", merge_key="drag"):
+            metro_map.move_stations([(station, station.x + 10, station.y) for station in stations])
+
+    assert len(history.undo_stack) == 1
+    assert history.undo_stack[0].ops == [("move_stations", [(1, 0, 200, 30, 200), (2, 100, 200, 130, 200)])]
+
+    history.undo()
+    assert [(station.x, station.y) for station in stations] == [(0, 200), (100, 200)]
+
+
+def test_redone_entry_does_not_merge_with_new_edits(metro_map):
+    history = History(metro_map)
+    station = metro_map.get_station(1)
+    with history.transaction("Перемещение", merge_key="drag"):
+        metro_map.move_station(station, 10, 10)
+    history.undo()
+    history.redo()
+    with history.transaction("Перемещение", merge_key="drag"):
+        metro_map.move_station(station, 20, 20)
+
+    assert len(history.undo_stack) == 2
+
+
+def test_history_stays_within_budget(metro_map):
+    history = History(metro_map, budget=2000)
+    station = metro_map.get_station(1)
+    for x in range(200):
+        with history.transaction("Перемещение"):
+            metro_map.move_station(station, x, 0)
+
+        assert history.size <= history.budget
+        assert history.size == sum(entry.size for entry in history.undo_stack)
+    assert 1 < len(history.undo_stack) < 200
+
+    # Отменяются самые свежие правки, самые старые забыты
+    while history.undo():
+        pass
+    assert station["x"] == 199 - len(history.redo_stack)
+
+
+def test_last_entry_is_kept_even_over_budget(metro_map):
+    history = History(metro_map, budget=1)
+    with history.transaction("Удаление"):
+        metro_map.remove_line(0)
+    with history.transaction("Удаление"):
+        metro_map.remove_line(0)
+
+    assert len(history.undo_stack) == 1
+    history.undo()
+    assert len(metro_map.lines) == 1
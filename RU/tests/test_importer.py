@@ -0,0 +1,150 @@
+import json
+
+import pytest
+
+from metromap.history import History
+from metromap.importer import import_network, read_csv, read_geojson, read_network
+
+
+def _write(path, text):
+    path.write_text(text, encoding="utf-8")
+    return str(path)
+
+
+def _csv(tmp_path, rows, delimiter=","):
+    return _write(tmp_path / "net.csv", "\n".join(delimiter.join(row) for row in rows) + "\n")
+
+
+def _names(network, line):
+    by_id = {station["id"]: station["name"] for station in network["stations"]}
+    return [by_id[station_id] for station_id in line["stations"]]
+
+
+@pytest.mark.parametrize("delimiter", [",", ";", "\t"])
+def test_csv_delimiter_is_detected(tmp_path, delimiter):
+    path = _csv(tmp_path, [["name", "x", "y", "line", "color"], ["Первая", "0", "0", "A", "#ff0000"],
+                           ["Вторая", "10.5", "0", "A", ""], ["Третья", "20", "5", "A", ""]], delimiter)
+
+    network, geographic = read_csv(path)
+
+    assert not geographic
+    assert [(s["name"], s["x"], s["y"]) for s in network["stations"]] == [("Первая", 0, 0), ("Вторая", 10.5, 0),
+                                                                          ("Третья", 20, 5)]
+    assert [(line["name"], line["color"], len(line["stations"])) for line in network["lines"]] == [("A", "#ff0000", 3)]
+
+
+def test_csv_geographic_coordinates_use_mercator(tmp_path):
+    path = _csv(tmp_path, [["Название", "Долгота", "Широта", "Линия"], ["Юг", "37.6", "55.0", "A"],
+                           ["Север", "37.6", "60.0", "A"], ["Восток", "38.6", "55.0", "A"]])
+
+    assert read_csv(path)[1]
+    network = read_network(path, size=1000)
+
+    south, north, east = network["stations"]
+    # Ось y в редакторе направлена вниз, и по Меркатору градус широты длиннее градуса долготы
+    assert (north["x"], north["y"]) == (0, 0)
+    assert (south["x"], south["y"]) == (0, 1000)
+    assert east["y"] == 1000 and 0 < east["x"] < 1000 * 1 / 5
+
+
+def test_csv_projected_coordinates_are_scaled(tmp_path):
+    path = _csv(tmp_path, [["name", "x", "y", "line"], ["A", "1000", "500", "1"], ["B", "3000", "1500", "1"]])
+
+    network = read_network(path, size=100)
+
+    assert [(s["x"], s["y"]) for s in network["stations"]] == [(0, 50), (100, 0)]
+
+
+def test_csv_order_column_sorts_stations(tmp_path):
+    path = _csv(tmp_path, [["name", "x", "y", "line", "order"], ["Третья", "2", "0", "A", "3"],
+                           ["Первая", "0", "0", "A", "1"], ["Вторая", "1", "0", "A", "2"],
+                           ["Отдельная", "5", "5", "B", ""]])
+
+    network, _ = read_csv(path)
+
+    assert [_names(network, line) for line in network["lines"]] == [["Первая", "Вторая", "Третья"], ["Отдельная"]]
+
+
+def test_csv_interchange_is_one_station(tmp_path):
+    path = _csv(tmp_path, [["name", "x", "y", "line"], ["Пересадка", "1", "1", "A"], ["Конечная", "2", "1", "A"],
+                           ["Пересадка", "1", "1", "B"], ["Пересадка", "1", "2", "B"]])
+
+    network, _ = read_csv(path)
+
+    # Совпадают название и координаты; одноимённая станция в другом месте - другая станция
+    assert len(network["stations"]) == 3
+    a, b = network["lines"]
+    assert a["stations"][0] == b["stations"][0]
+    assert a["stations"][0] != b["stations"][1]
+
+
+def test_csv_interchange_by_id(tmp_path):
+    path = _csv(tmp_path, [["id", "name", "x", "y", "line"], ["7", "Площадь", "1", "1", "A"],
+                           ["7", "Площадь (B)", "1.001", "1", "B"], ["8", "Площадь", "1", "1", "B"]])
+
+    network, _ = read_csv(path)
+
+    assert [s["name"] for s in network["stations"]] == ["Площадь", "Площадь"]
+    a, b = network["lines"]
+    assert b["stations"] == [a["stations"][0], 2]
+
+
+def test_csv_without_coordinates(tmp_path):
+    with pytest.raises(ValueError, match="x и y"):
+        read_csv(_csv(tmp_path, [["name", "line"], ["A", "1"]]))
+    with pytest.raises(ValueError, match="Строка 3"):
+        read_csv(_csv(tmp_path, [["name", "x", "y", "line"], ["A", "1", "1", "1"], ["B", "", "1", "1"]]))
+
+
+def _feature(kind, coordinates, **properties):
+    return {"type": "Feature", "geometry": {"type": kind, "coordinates": coordinates}, "properties": properties}
+
+
+def test_geojson_stations_follow_line_vertices(tmp_path):
+    path = _write(tmp_path / "net.geojson", json.dumps({"type": "FeatureCollection", "features": [
+        _feature("Point", [2.0, 0.0], name="Вторая"),
+        _feature("Point", [0.0, 0.0], name="Первая"),
+        _feature("Point", [5.0, 5.0], name="Депо", lines="Красная, Синяя"),
+        _feature("LineString", [[0.0, 0.0], [1.0, 0.0], [2.0, 0.0]], name="Красная", stroke="#ff0000"),
+        _feature("MultiLineString", [[[10.0, 10.0], [11.0, 10.0]], [[12.0, 10.0]]], name="Синяя"),
+    ]}))
+
+    network, geographic = read_geojson(path)
+
+    assert geographic
+    red, blue = network["lines"]
+    # Вершина без точки станции пропускается, станции идут в порядке вершин, а не точек
+    assert _names(network, red) == ["Первая", "Вторая", "Депо"]
+    assert red["color"] == "#ff0000"
+    # У линии нет ни одной точки-станции - станцией становится каждая вершина
+    assert len(blue["stations"]) == 4 and _names(network, blue)[-1] == "Депо"
+    assert len(network["stations"]) == 6
+
+
+def test_geojson_requires_feature(tmp_path):
+    with pytest.raises(ValueError):
+        read_geojson(_write(tmp_path / "net.geojson", json.dumps({"type": "Point", "coordinates": [0, 0]})))
+
+
+def test_import_and_undo_keep_indexes(metro_map, tmp_path, check_indexes):
+    path = _csv(tmp_path, [["name", "x", "y", "line"], ["A", "0", "0", "1"], ["B", "1", "0", "1"],
+                           ["B", "1", "0", "2"], ["C", "1", "1", "2"]])
+    history = History(metro_map)
+    before = metro_map.snapshot()
+
+    with history.transaction("Импорт"):
+        added = import_network(metro_map, path)
+    after = metro_map.snapshot()
+
+    assert [len(line["stations"]) for line in added] == [2, 2]
+    assert added[0]["stations"][1] == added[1]["stations"][0]
+    assert len(metro_map.stations) == len(before["stations"]) + 3
+    check_indexes(metro_map)
+
+    history.undo()
+    check_indexes(metro_map)
+    assert metro_map.snapshot() == before
+
+    history.redo()
+    check_indexes(metro_map)
+    assert metro_map.snapshot() == after
@@ -0,0 +1,81 @@
+import os
+
+import pytest
+
+from metromap.history import History
+from metromap.journal import Journal, has_recovery, latest_generation, recover
+
+
+@pytest.fixture
+def journal(tmp_path):
+    journal = Journal(str(tmp_path / "autosave"), fsync_interval=0.01, compact_ops=5)
+    yield journal
+    journal.close()
+
+
+def _edit(metro_map):
+    """Правки всех видов, в том числе отмена удаления линии с пересадкой"""
+    history = History(metro_map)
+    metro_map.move_station(metro_map.get_station(1), 15, 25.5)
+    metro_map.update_station(metro_map.get_station(2), name="Вокзальная", style=None)
+    metro_map.update_line(metro_map.lines[1], color="#000000", smoothing="metro")
+    line = metro_map.add_line("#2a9d8f", 6, "straight")
+    metro_map.add_station(line, -100, -100, "circle")
+    metro_map.remove_station(4)
+    with history.transaction("Удаление линии"):
+        metro_map.remove_line(0)
+    history.undo()
+
+
+def test_recovered_map_equals_live_map(metro_map, journal):
+    journal.attach(metro_map)
+    _edit(metro_map)
+    journal.flush()
+
+    assert journal.error is None
+    assert recover(journal.directory).snapshot() == metro_map.snapshot()
+
+
+def test_torn_last_line_is_ignored(metro_map, journal):
+    journal.compact_ops = 1000
+    journal.attach(metro_map)
+    metro_map.move_station(metro_map.get_station(1), 15, 25)
+    journal.close()
+    expected = metro_map.snapshot()
+
+    # Процесс упал, успев записать только начало следующей операции
+    with open(os.path.join(journal.directory, f"journal-{journal.generation}.jsonl"), "a", encoding="utf-8") as f:
+        f.write('["move_station",1,15,25,')
+
+    assert recover(journal.directory).snapshot() == expected
+
+
+def test_compaction_switches_generation(metro_map, journal):
+    journal.attach(metro_map)
+    journal.flush()
+    first = journal.generation
+    station = metro_map.get_station(1)
+    for x in range(12):
+        metro_map.move_station(station, x, x)
+    journal.flush()
+
+    assert journal.compactions == 2
+    assert journal.generation == first + 2
+    assert latest_generation(journal.directory) == journal.generation
+    # Старые поколения удалены, осталось только текущее
+    assert sorted(os.listdir(journal.directory)) == [f"journal-{journal.generation}.jsonl",
+                                                     f"snapshot-{journal.generation}.mmb"]
+    assert recover(journal.directory).snapshot() == metro_map.snapshot()
+
+
+def test_close_with_discard_removes_files(metro_map, journal):
+    journal.attach(metro_map)
+    metro_map.move_station(metro_map.get_station(1), 15, 25)
+    journal.flush()
+    assert has_recovery(journal.directory)
+
+    journal.close(discard_files=True)
+
+    assert not has_recovery(journal.directory)
+    assert os.listdir(journal.directory) == []
+    assert journal.on_op not in metro_map.listeners
@@ -0,0 +1,25 @@
+import json
+
+import pytest
+
+from metromap.jsonstream import iter_map_records
+
+
+@pytest.mark.parametrize("text", ["{} x", "{}{}", '{"scale": 1} ,', '{"stations": []}\n{"lines": []}'])
+def test_trailing_content_is_rejected(tmp_path, text):
+    path = tmp_path / "map.json"
+    path.write_text(text, encoding="utf-8")
+    with pytest.raises(ValueError):
+        json.loads(text)
+    with pytest.raises(ValueError):
+        list(iter_map_records(str(path)))
+
+
+@pytest.mark.parametrize("text", ["{}", "{}\n", ' {"scale": 1.5, "stations": [{"id": 1}]} \n'])
+def test_whitespace_after_map_is_accepted(tmp_path, text):
+    path = tmp_path / "map.json"
+    path.write_text(text, encoding="utf-8")
+    records = list(iter_map_records(str(path), chunk_size=4))
+    data = json.loads(text)
+    assert records == [(key, item) for key, value in data.items()
+                       for item in (value if key == "stations" else [value])]
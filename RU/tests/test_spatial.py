@@ -0,0 +1,70 @@
+import pytest
+
+from metromap.spatial import SpatialGrid
+
+
+@pytest.fixture
+def grid():
+    grid = SpatialGrid(cell_size=10)
+    # 1 лежит в той же клетке, что и точка запроса, но дальше, чем 2 в соседней
+    grid.insert(1, 1, 1)
+    grid.insert(2, 10.5, 5)
+    grid.insert(3, -25, -25)
+    return grid
+
+
+def test_nearest_returns_closest_not_first_found(grid):
+    assert grid.nearest(9, 5, 20) == 2
+    assert grid.nearest(2, 2, 20) == 1
+    assert grid.nearest(-20, -20, 10) == 3
+
+
+def test_nearest_radius_is_strict(grid):
+    assert grid.nearest(4, 5, 5) is None
+    assert grid.nearest(4, 5, 5.0001) == 1
+    assert grid.nearest(500, 500, 10) is None
+
+
+def test_nearest_with_window_larger_than_grid(grid):
+    assert grid.nearest(0, 0, 10000) == 1
+
+
+def test_move_and_remove_keep_grid_consistent(grid):
+    grid.move(1, 100, 100)
+    assert grid.nearest(2, 2, 5) is None
+    assert grid.nearest(101, 101, 5) == 1
+    grid.move(1, 102, 101)
+    assert grid.positions[1] == (102, 101)
+
+    grid.remove(2)
+    assert grid.nearest(10, 5, 5) is None
+    assert 2 not in grid.positions
+    assert all(items for items in grid.cells.values())
+    assert {item for items in grid.cells.values() for item in items} == {1, 3}
+
+
+def test_station_at_follows_moved_station(metro_map):
+    station = metro_map.stations[0]
+    assert metro_map.station_at(station["x"] + 3, station["y"], 10) is station
+    metro_map.move_station(station, -300, -300)
+    assert metro_map.station_at(-298, -300, 10) is station
+    assert metro_map.station_at(3, 200, 10) is None
+
+
+def test_query_rect_across_cells_and_negative_coordinates(grid):
+    assert sorted(grid.query_rect(-30, -30, 11, 6)) == [1, 2, 3]
+    assert sorted(grid.query_rect(0, 0, 10.5, 5)) == [1, 2]
+    assert grid.query_rect(-26, -26, -24, -24) == [3]
+    assert grid.query_rect(-24, -24, 0, 0) == []
+
+
+def test_query_rect_with_window_larger_than_grid(grid):
+    assert sorted(grid.query_rect(-1e6, -1e6, 1e6, 1e6)) == [1, 2, 3]
+    assert grid.query_rect(1e5, 1e5, 1e6, 1e6) == []
+
+
+def test_query_rect_after_move_and_remove(grid):
+    grid.move(3, 35, -5)
+    grid.remove(1)
+    assert sorted(grid.query_rect(0, -10, 40, 10)) == [2, 3]
+    assert grid.query_rect(-30, -30, -20, -20) == []
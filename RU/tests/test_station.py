@@ -0,0 +1,53 @@
+import pytest
+
+from metromap.station import Station
+
+
+def test_station_round_trips_as_dict():
+    fields = {"id": 1, "name": "Площадь", "x": 10, "y": 2.5, "style": "circle"}
+    station = Station(fields)
+
+    assert dict(station) == fields
+    assert list(station) == ["id", "name", "x", "y", "style"]
+    assert (station.x, station.y, station.id) == (10, 2.5, 1)
+    assert station.get("style") == "circle" and station["name"] == "Площадь"
+
+
+def test_unknown_keys_go_to_extra():
+    station = Station({"id": 1, "x": 0, "y": 0, "label_angle": 45})
+    station["note"] = "закрыта"
+
+    assert station.extra == {"label_angle": 45, "note": "закрыта"}
+    assert dict(station) == {"id": 1, "x": 0, "y": 0, "label_angle": 45, "note": "закрыта"}
+    assert "note" in station and len(station) == 5
+
+    del station["note"]
+    assert "note" not in station
+    with pytest.raises(KeyError):
+        station["note"]
+
+
+def test_missing_schema_field_is_absent():
+    station = Station({"id": 1, "name": "А", "x": 0, "y": 0, "style": "square"})
+
+    assert station.pop("style") == "square"
+    assert "style" not in station and station.get("style", "circle") == "circle"
+    assert dict(station) == {"id": 1, "name": "А", "x": 0, "y": 0}
+    with pytest.raises(KeyError):
+        station["style"]
+    with pytest.raises(KeyError):
+        del station["style"]
+    assert station.pop("style", None) is None
+
+
+def test_stations_compare_by_identity():
+    first = Station({"id": 1, "x": 0, "y": 0})
+    twin = Station(dict(first))
+    stations = [twin, first]
+
+    assert first != twin and first == first
+    assert len({first, twin}) == 2
+    # list.remove должен убрать именно этот объект, а не первую станцию с таким же содержимым
+    stations.remove(first)
+    assert stations[0] is twin
+    assert stations.index(twin) == 0
@@ -0,0 +1,13 @@
+from metromap.model import MetroMap
+from metromap.tiles import map_hash
+
+
+def test_map_hash_depends_only_on_content(metro_map):
+    copy = MetroMap.from_dict(metro_map.snapshot())
+
+    assert map_hash(copy) == map_hash(metro_map)
+
+    station = metro_map.stations[0]
+    metro_map.move_station(station, station["x"] + 1, station["y"])
+
+    assert map_hash(copy) != map_hash(metro_map)